@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistroSAP',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chave_pallet', models.CharField(max_length=100)),
+                ('doc_material', models.CharField(max_length=50)),
+                ('ano_doc_material', models.IntegerField()),
+                ('item_doc_material', models.IntegerField()),
+                ('data_entrada', models.DateField()),
+                ('centro', models.CharField(max_length=10)),
+                ('deposito', models.CharField(max_length=10)),
+                ('material', models.CharField(max_length=50)),
+                ('lote', models.CharField(max_length=50)),
+                ('data_vencimento', models.DateField()),
+                ('data_producao', models.DateField()),
+                ('ordem', models.CharField(max_length=50)),
+                ('qtd_um_registro', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('um_registro', models.CharField(max_length=10)),
+                ('status_chave_pallet', models.CharField(blank=True, max_length=10)),
+                ('nome_usuario', models.CharField(max_length=100)),
+                ('data_criacao', models.DateField()),
+                ('hora_criacao', models.TimeField()),
+                ('modificado_por', models.CharField(blank=True, max_length=100, null=True)),
+                ('data_modificacao', models.DateField()),
+                ('hora_modificacao', models.TimeField()),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
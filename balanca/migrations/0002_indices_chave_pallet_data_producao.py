@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('balanca', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='registrosap',
+            name='chave_pallet',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='registrosap',
+            name='data_producao',
+            field=models.DateField(db_index=True),
+        ),
+    ]
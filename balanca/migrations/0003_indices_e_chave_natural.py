@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:45
+
+from django.db import migrations, models
+
+
+def remover_duplicados(apps, schema_editor):
+    """
+    Uploads anteriores só acrescentavam linhas; antes de criar a restrição
+    única fica apenas o registro mais recente (maior id) de cada documento.
+    """
+    RegistroSAP = apps.get_model('balanca', 'RegistroSAP')
+    banco = schema_editor.connection.alias
+    vistos = set()
+    remover = []
+    linhas = (
+        RegistroSAP.objects.using(banco)
+        .order_by('-id')
+        .values_list('id', 'doc_material', 'ano_doc_material', 'item_doc_material')
+        .iterator(chunk_size=5000)
+    )
+    for pk, *chave in linhas:
+        chave = tuple(chave)
+        if chave in vistos:
+            remover.append(pk)
+        else:
+            vistos.add(chave)
+    for i in range(0, len(remover), 1000):
+        RegistroSAP.objects.using(banco).filter(id__in=remover[i:i + 1000]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('balanca', '0002_indices_chave_pallet_data_producao'),
+    ]
+
+    operations = [
+        migrations.RunPython(remover_duplicados, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='registrosap',
+            name='material',
+            field=models.CharField(db_index=True, max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='registrosap',
+            index=models.Index(fields=['lote', 'data_producao'], name='registrosap_lote_data_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='registrosap',
+            constraint=models.UniqueConstraint(fields=('doc_material', 'ano_doc_material', 'item_doc_material'), name='registrosap_doc_material_uniq'),
+        ),
+    ]
@@ -1,17 +1,17 @@
 from django.db import models
 
 class RegistroSAP(models.Model):
-    chave_pallet = models.CharField(max_length=100)
+    chave_pallet = models.CharField(max_length=100, db_index=True)
     doc_material = models.CharField(max_length=50)
     ano_doc_material = models.IntegerField()
     item_doc_material = models.IntegerField()
     data_entrada = models.DateField()
     centro = models.CharField(max_length=10)
     deposito = models.CharField(max_length=10)
-    material = models.CharField(max_length=50)
+    material = models.CharField(max_length=50, db_index=True)
     lote = models.CharField(max_length=50)
     data_vencimento = models.DateField()
-    data_producao = models.DateField()
+    data_producao = models.DateField(db_index=True)
     ordem = models.CharField(max_length=50)
     qtd_um_registro = models.DecimalField(max_digits=10, decimal_places=2)
     um_registro = models.CharField(max_length=10)
@@ -23,3 +23,15 @@ class RegistroSAP(models.Model):
     data_modificacao = models.DateField()
     hora_modificacao = models.TimeField()
     criado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['lote', 'data_producao'], name='registrosap_lote_data_idx'),
+        ]
+        constraints = [
+            # chave natural do documento de material no SAP
+            models.UniqueConstraint(
+                fields=['doc_material', 'ano_doc_material', 'item_doc_material'],
+                name='registrosap_doc_material_uniq',
+            ),
+        ]
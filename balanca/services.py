@@ -0,0 +1,541 @@
+"""
+Bases usadas pela análise de ocorrências (/balanca/analise/).
+
+Remessas e pallets vêm do banco (tabela_exped e RegistroSAP), então uploads
+novos aparecem sem reiniciar o processo. Os cadastros estáticos (SKU e
+sobrepeso por linha/dia) continuam em planilha: são lidos uma vez e
+convertidos em dicionários, de modo que cada requisição custa só algumas
+consultas por chave. A leitura é preguiçosa (na primeira requisição, não no
+import) e é refeita quando algum arquivo muda de mtime/tamanho. Os índices
+prontos ficam também num cache em disco, para que novos workers não precisem
+reparsear os .xlsx. O cache é JSON (nada executável) numa pasta da aplicação
+(BALANCA_CACHE_DIR, 0700) e só é lido se pertencer ao usuário do processo.
+"""
+import codecs
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from decimal import Decimal
+
+import pandas as pd
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections, connection, models, transaction
+
+from .models import RegistroSAP
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+ARQUIVOS = {
+    'sku': 'dados_sku.xlsx',
+    'sobrepeso': 'dados_sobrepeso.xlsx',
+}
+
+# Incrementar quando a estrutura de IndicesBalanca mudar, para invalidar o cache em disco.
+VERSAO_CACHE = 3
+
+
+class RemessaExpedicao:
+    """Resumo de uma remessa da tabela_exped."""
+
+    __slots__ = ('item', 'qtd_caixas', 'chaves_pallet')
+
+    def __init__(self, item, qtd_caixas, chaves_pallet):
+        self.item = item
+        self.qtd_caixas = qtd_caixas
+        self.chaves_pallet = chaves_pallet
+
+
+def _codigo(valor):
+    """Normaliza códigos numéricos vindos do banco (75370.0, '75370') para int."""
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    if isinstance(valor, str) and valor.strip().isdigit():
+        return int(valor)
+    return valor
+
+
+def buscar_remessa(remessa_num):
+    """Item da primeira linha, soma de QUANTIDADE e chaves de palete da remessa, ou None."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT ITEM, QUANTIDADE, CHAVE_PALETE FROM tabela_exped WHERE REMESSA = %s",
+            [remessa_num],
+        )
+        linhas = cursor.fetchall()
+    if not linhas:
+        return None
+    qtd_caixas = sum(qtd for _, qtd, _ in linhas if qtd is not None)
+    # dict preserva a ordem de chegada, como o unique() do pandas
+    chaves = dict.fromkeys(chave for _, _, chave in linhas)
+    return RemessaExpedicao(linhas[0][0], qtd_caixas, list(chaves))
+
+
+def pallets_da_remessa(chaves_pallet):
+    """(lote, data de produção) dos registros do SAP com as chaves dadas, na ordem de carga."""
+    chaves = set()
+    for c in chaves_pallet:
+        if c is None:
+            continue
+        if isinstance(c, (int, float)):
+            # coluna numérica na tabela_exped: 123.0 -> '123'
+            chaves.add(str(_codigo(c)))
+        else:
+            # texto é comparado exato: '000123' e '123' são pallets diferentes
+            chaves.add(str(c).strip())
+    if not chaves:
+        return []
+    return list(
+        RegistroSAP.objects.filter(chave_pallet__in=chaves)
+        .order_by('id')
+        .values_list('lote', 'data_producao')
+    )
+
+
+SQL_INSERIR_EXPEDICAO = (
+    "INSERT INTO tabela_exped (REMESSA, ITEM, QUANTIDADE, CHAVE_PALETE, DATA) "
+    "VALUES (%s, %s, %s, %s, %s)"
+)
+
+
+def linha_expedicao(registro):
+    """Parâmetros do INSERT em tabela_exped para um registro recebido via API."""
+    return (
+        registro.get('remessa'),
+        registro.get('item'),
+        registro.get('quantidade'),
+        registro.get('chave_palete'),
+        registro.get('data'),
+    )
+
+
+def inserir_expedicao(linhas):
+    """Grava as linhas em tabela_exped com um executemany e um único commit."""
+    if not linhas:
+        return 0
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.executemany(SQL_INSERIR_EXPEDICAO, linhas)
+    return len(linhas)
+
+
+class BufferExpedicao:
+    """
+    Junta leituras de vários POSTs e grava em tabela_exped a cada max_linhas
+    linhas ou max_ms milissegundos, o que vier primeiro. A gravação roda numa
+    thread própria, que mantém a sua conexão com o banco entre os lotes.
+
+    As linhas ficam só em memória até a gravação: uma queda do worker nesse
+    intervalo perde o que estava no buffer, e um lote que falhar no banco é
+    apenas registrado no log.
+    """
+
+    def __init__(self, max_linhas, max_ms):
+        self.max_linhas = max_linhas
+        self.max_ms = max_ms
+        self._linhas = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def adicionar(self, linhas):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._rodar, name='buffer-expedicao', daemon=True)
+                self._thread.start()
+            self._linhas.extend(linhas)
+            self._cond.notify()
+
+    def _rodar(self):
+        while True:
+            with self._cond:
+                while not self._linhas:
+                    self._cond.wait()
+                limite = time.monotonic() + self.max_ms / 1000
+                while len(self._linhas) < self.max_linhas:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        break
+                    self._cond.wait(restante)
+                lote, self._linhas = self._linhas, []
+            close_old_connections()
+            try:
+                inserir_expedicao(lote)
+            except Exception:
+                logger.exception("Falha ao gravar %d linhas de expedição do buffer", len(lote))
+
+
+_buffer_expedicao = None
+_buffer_lock = threading.Lock()
+
+
+def buffer_expedicao():
+    """Buffer do processo, ou None se EXPEDICAO_BUFFER_LINHAS não estiver configurado."""
+    global _buffer_expedicao
+    max_linhas = getattr(settings, 'EXPEDICAO_BUFFER_LINHAS', 0)
+    if not max_linhas:
+        return None
+    with _buffer_lock:
+        if _buffer_expedicao is None:
+            _buffer_expedicao = BufferExpedicao(max_linhas, getattr(settings, 'EXPEDICAO_BUFFER_MS', 200))
+        return _buffer_expedicao
+
+
+CAMPOS_DATA_SAP = ['data_entrada', 'data_vencimento', 'data_producao', 'data_criacao', 'data_modificacao']
+CAMPOS_HORA_SAP = ['hora_criacao', 'hora_modificacao']
+CHAVE_NATURAL_SAP = ('doc_material', 'ano_doc_material', 'item_doc_material')
+
+TAMANHO_LEITURA = 64 * 1024
+# Maior registro aceito no upload do SAP; um objeto que não fecha nesse tamanho é corpo malformado
+MAX_OBJETO_JSON = 4 * 1024 * 1024
+
+
+def _pedacos_texto(arquivo):
+    """Texto do corpo em pedaços, descompactando gzip (detectado pelos bytes mágicos)."""
+    primeiro = arquivo.read(TAMANHO_LEITURA)
+    descompactar = zlib.decompressobj(wbits=31) if primeiro[:2] == b'\x1f\x8b' else None
+    decodificar = codecs.getincrementaldecoder('utf-8')()
+    bloco = primeiro
+    while bloco:
+        if descompactar is not None:
+            bloco = descompactar.decompress(bloco)
+        yield decodificar.decode(bloco)
+        bloco = arquivo.read(TAMANHO_LEITURA)
+    if descompactar is not None:
+        yield decodificar.decode(descompactar.flush())
+    yield decodificar.decode(b'', final=True)
+
+
+def ler_objetos_json(arquivo, max_pendente=MAX_OBJETO_JSON):
+    """
+    Objetos de um corpo JSON lidos um a um, sem carregar o payload inteiro.
+
+    Aceita uma lista JSON ([{...}, {...}]) ou NDJSON (um objeto por linha),
+    com ou sem gzip: os dois formatos são objetos separados por espaço,
+    vírgula ou colchetes no nível de fora. Levanta ValueError assim que o
+    registro seguinte não começa com '{' ou passa de `max_pendente` caracteres
+    sem fechar, em vez de acumular o resto do corpo na memória.
+    """
+    decoder = json.JSONDecoder()
+    pedacos = _pedacos_texto(arquivo)
+    buf = ''
+    pos = 0
+    acabou = False
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,[]':
+            pos += 1
+        if pos == len(buf):
+            if acabou:
+                return
+            buf, pos = next(pedacos, None), 0
+            if buf is None:
+                acabou, buf = True, ''
+            continue
+        if buf[pos] != '{':
+            raise ValueError(f"Esperado um objeto JSON na posição {pos}, encontrado {buf[pos:pos + 20]!r}")
+        try:
+            obj, fim = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # objeto cortado no fim do pedaço: junta o próximo e tenta de novo
+            if len(buf) - pos > max_pendente:
+                raise ValueError(f"Registro JSON com mais de {max_pendente} caracteres sem fechar")
+            proximo = None if acabou else next(pedacos, None)
+            if proximo is None:
+                raise
+            buf, pos = buf[pos:] + proximo, 0
+            continue
+        if not isinstance(obj, dict):
+            raise ValueError(f"Esperado um objeto JSON por registro, recebido {type(obj).__name__}")
+        yield obj
+        pos = fim
+
+
+def _lotes(iteravel, tamanho):
+    lote = []
+    for item in iteravel:
+        lote.append(item)
+        if len(lote) >= tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+# formatos aceitos pelo parse_time do Django, do mais comum ao menos comum
+FORMATOS_HORA_SAP = ('%H:%M:%S', '%H:%M', '%H:%M:%S.%f')
+
+
+def _converter_horas(valores):
+    """Horas 'HH:MM[:SS[.ffffff]]' para datetime.time; fora do formato ou do intervalo viram NaT."""
+    texto = valores.astype('string').str.strip()
+    horas = pd.Series(pd.NaT, index=valores.index, dtype='datetime64[ns]')
+    for formato in FORMATOS_HORA_SAP:
+        faltando = horas.isna()
+        if not faltando.any():
+            break
+        horas[faltando] = pd.to_datetime(texto[faltando], format=formato, errors='coerce')
+    return horas.dt.time
+
+
+def _preparar_lote_sap(registros):
+    """
+    DataFrame com as colunas do RegistroSAP e datas/horas já convertidas;
+    valores inválidos viram None.
+    """
+    campos = [f.name for f in RegistroSAP._meta.concrete_fields if f.name not in ('id', 'criado_em')]
+    # dtype=object preserva os inteiros do JSON (sem virar float quando há nulos)
+    df = pd.DataFrame(registros, dtype=object).reindex(columns=campos)
+    for col in CHAVE_NATURAL_SAP[1:]:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    for col in CAMPOS_DATA_SAP:
+        df[col] = pd.to_datetime(df[col], format='ISO8601', errors='coerce').dt.date
+    for col in CAMPOS_HORA_SAP:
+        df[col] = _converter_horas(df[col])
+    df['status_chave_pallet'] = df['status_chave_pallet'].where(df['status_chave_pallet'].notna(), '')
+    df = df.astype(object).where(df.notna(), None)
+    return df
+
+
+def _normalizar_sap(campo, valor):
+    """Valor como o banco vai devolvê-lo depois de gravado, para comparar com o existente."""
+    valor = campo.to_python(valor)
+    if isinstance(campo, models.DecimalField) and valor is not None:
+        valor = valor.quantize(Decimal(1).scaleb(-campo.decimal_places))
+    return valor
+
+
+def gravar_registros_sap(objetos, tamanho_lote=2000):
+    """
+    Grava os registros em lotes de tamanho_lote numa única transação, como
+    upsert pela chave natural do documento (doc_material, ano_doc_material,
+    item_doc_material).
+
+    Cada lote é comparado com o que já está no banco e só os registros novos
+    ou alterados são enviados ao bulk_create(update_conflicts=True); reenviar
+    a mesma exportação custa uma consulta por lote. Registros sem algum campo
+    obrigatório ou com valor inválido são ignorados; se a mesma chave aparece
+    mais de uma vez no lote, vale a última. Devolve um dict com as contagens
+    de novos, alterados, inalterados e ignorados.
+    """
+    campos = [f for f in RegistroSAP._meta.concrete_fields if f.name not in ('id', 'criado_em')]
+    nomes = [f.name for f in campos]
+    obrigatorios = [f.name for f in campos if not f.null and f.name != 'status_chave_pallet']
+    pos_chave = [nomes.index(n) for n in CHAVE_NATURAL_SAP]
+    atualizar = [n for n in nomes if n not in CHAVE_NATURAL_SAP]
+    # MySQL resolve o conflito por qualquer índice único (ON DUPLICATE KEY) e não aceita alvo
+    alvo = list(CHAVE_NATURAL_SAP) if connection.features.supports_update_conflicts_with_target else None
+
+    contagem = {'novos': 0, 'alterados': 0, 'inalterados': 0, 'ignorados': 0}
+    with transaction.atomic():
+        for registros in _lotes(objetos, tamanho_lote):
+            df = _preparar_lote_sap(registros)
+            validos = df[obrigatorios].notna().all(axis=1)
+            contagem['ignorados'] += int((~validos).sum())
+
+            recebidos = {}
+            for linha in df[validos].itertuples(index=False, name=None):
+                try:
+                    valores = tuple(_normalizar_sap(f, v) for f, v in zip(campos, linha))
+                except ValidationError:
+                    contagem['ignorados'] += 1
+                    continue
+                chave = tuple(valores[i] for i in pos_chave)
+                if chave in recebidos:
+                    contagem['ignorados'] += 1
+                recebidos[chave] = valores
+            if not recebidos:
+                continue
+
+            existentes = {}
+            docs = {chave[0] for chave in recebidos}
+            for valores in RegistroSAP.objects.filter(doc_material__in=docs).values_list(*nomes):
+                existentes[tuple(valores[i] for i in pos_chave)] = valores
+
+            gravar = []
+            for chave, valores in recebidos.items():
+                atual = existentes.get(chave)
+                if atual is None:
+                    contagem['novos'] += 1
+                elif atual == valores:
+                    contagem['inalterados'] += 1
+                    continue
+                else:
+                    contagem['alterados'] += 1
+                gravar.append(RegistroSAP(**dict(zip(nomes, valores))))
+            if gravar:
+                RegistroSAP.objects.bulk_create(
+                    gravar,
+                    batch_size=tamanho_lote,
+                    update_conflicts=True,
+                    unique_fields=alvo,
+                    update_fields=atualizar,
+                )
+    return contagem
+
+
+def _valor_json(valor):
+    # escalares numpy (np.int64, np.float64) para os tipos do Python
+    return valor.item() if hasattr(valor, 'item') else valor
+
+
+def _arquivo_confiavel(caminho):
+    """O arquivo pertence ao usuário do processo e ninguém mais pode escrever nele."""
+    st = os.stat(caminho)
+    if not hasattr(os, 'getuid'):
+        return True
+    return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+
+class IndicesBalanca:
+    """
+    Índices montados a partir de uma leitura das planilhas. Não é alterado
+    depois de pronto: uma recarga cria outro objeto e troca a referência.
+    """
+
+    def __init__(self, df_sku, df_sobrepeso):
+        # COD_PRODUTO (unidade Caixa) -> QTDE_PESO_LIQ da primeira ocorrência
+        caixas = df_sku[(df_sku['DESC_UNID_MEDID'] == 'Caixa') & df_sku['COD_PRODUTO'].notna()]
+        caixas = caixas.drop_duplicates('COD_PRODUTO')
+        self.peso_caixa = dict(zip(caixas['COD_PRODUTO'], caixas['QTDE_PESO_LIQ']))
+
+        # (Linhas, Dia) -> Média de sobrepeso da primeira ocorrência
+        sp = df_sobrepeso[df_sobrepeso['Linhas'].notna() & df_sobrepeso['Dia'].notna()]
+        sp = sp.drop_duplicates(['Linhas', 'Dia'])
+        self.sobrepeso = dict(zip(zip(sp['Linhas'], sp['Dia']), sp['Média de sobrepeso']))
+
+    @classmethod
+    def de_json(cls, dados):
+        indices = cls.__new__(cls)
+        indices.peso_caixa = {cod: peso for cod, peso in dados['peso_caixa']}
+        indices.sobrepeso = {(linha, pd.Timestamp(dia)): media for linha, dia, media in dados['sobrepeso']}
+        return indices
+
+    def para_json(self):
+        # pares em vez de objetos JSON: preserva o tipo das chaves (int, float ou texto)
+        return {
+            'peso_caixa': [[_valor_json(cod), _valor_json(peso)] for cod, peso in self.peso_caixa.items()],
+            'sobrepeso': [[_valor_json(linha), pd.Timestamp(dia).isoformat(), _valor_json(media)]
+                          for (linha, dia), media in self.sobrepeso.items()],
+        }
+
+    def peso_por_caixa(self, sku):
+        return self.peso_caixa.get(_codigo(sku))
+
+    def sobrepeso_medio(self, linha, data_producao):
+        # Dia vem da planilha como Timestamp; o banco devolve datetime.date
+        return self.sobrepeso.get((linha, pd.Timestamp(data_producao)))
+
+
+class ServicoBalanca:
+    """
+    Mantém os IndicesBalanca atualizados em relação aos arquivos de data_dir.
+
+    A verificação de mtime acontece no máximo a cada INTERVALO_VERIFICACAO
+    segundos. Enquanto uma thread recarrega, as demais seguem respondendo com
+    os índices anteriores; se a recarga falhar, os índices antigos são mantidos.
+    """
+
+    INTERVALO_VERIFICACAO = 5.0
+
+    def __init__(self, data_dir=DATA_DIR, cache_path=None):
+        self.data_dir = data_dir
+        self.cache_path = cache_path or os.path.join(settings.BALANCA_CACHE_DIR, 'balanca_indices.json')
+        self._lock = threading.Lock()
+        self._indices = None
+        self._assinaturas = None
+        self._verificado_em = 0.0
+
+    def _caminho(self, nome):
+        return os.path.join(self.data_dir, ARQUIVOS[nome])
+
+    def _assinaturas_atuais(self):
+        assinaturas = {}
+        for nome in ARQUIVOS:
+            st = os.stat(self._caminho(nome))
+            assinaturas[nome] = (st.st_mtime_ns, st.st_size)
+        return assinaturas
+
+    def _ler_cache(self, assinaturas):
+        try:
+            pasta = os.path.dirname(self.cache_path)
+            if not (_arquivo_confiavel(pasta) and _arquivo_confiavel(self.cache_path)):
+                logger.warning("Cache de índices %s ignorado: dono ou permissões inesperados", self.cache_path)
+                return None
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                dados = json.load(f)
+            # JSON devolve listas; as assinaturas são tuplas
+            assinaturas_cache = {nome: tuple(v) for nome, v in dados['assinaturas'].items()}
+            if (dados['versao'] != VERSAO_CACHE or dados['data_dir'] != self.data_dir
+                    or assinaturas_cache != assinaturas):
+                return None
+            return IndicesBalanca.de_json(dados['indices'])
+        except Exception:
+            return None
+
+    def _gravar_cache(self, assinaturas, indices):
+        tmp = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            pasta = os.path.dirname(self.cache_path)
+            os.makedirs(pasta, mode=0o700, exist_ok=True)
+            os.chmod(pasta, 0o700)
+            dados = {
+                'versao': VERSAO_CACHE,
+                'data_dir': self.data_dir,
+                'assinaturas': assinaturas,
+                'indices': indices.para_json(),
+            }
+            with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='utf-8') as f:
+                json.dump(dados, f)
+            os.replace(tmp, self.cache_path)
+        except (OSError, TypeError, ValueError):
+            logger.warning("Não foi possível gravar o cache de índices em %s", self.cache_path)
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def _carregar(self, assinaturas):
+        indices = self._ler_cache(assinaturas)
+        if indices is not None:
+            logger.info("Índices da balança carregados do cache %s", self.cache_path)
+            return indices
+        inicio = time.perf_counter()
+        indices = IndicesBalanca(
+            df_sku=pd.read_excel(self._caminho('sku')),
+            df_sobrepeso=pd.read_excel(self._caminho('sobrepeso')),
+        )
+        logger.info("Índices da balança montados a partir das planilhas em %.2fs",
+                    time.perf_counter() - inicio)
+        self._gravar_cache(assinaturas, indices)
+        return indices
+
+    def indices(self):
+        """Índices atuais; carrega na primeira chamada e recarrega se as planilhas mudaram."""
+        if self._indices is not None and time.monotonic() - self._verificado_em < self.INTERVALO_VERIFICACAO:
+            return self._indices
+        # outra thread já está verificando: segue com os índices que existem
+        if not self._lock.acquire(blocking=self._indices is None):
+            return self._indices
+        try:
+            if self._indices is not None and time.monotonic() - self._verificado_em < self.INTERVALO_VERIFICACAO:
+                return self._indices
+            self._verificado_em = time.monotonic()
+            try:
+                assinaturas = self._assinaturas_atuais()
+                if assinaturas != self._assinaturas:
+                    self._indices = self._carregar(assinaturas)
+                    self._assinaturas = assinaturas
+            except Exception:
+                if self._indices is None:
+                    raise
+                logger.exception("Falha ao recarregar as bases da balança; mantendo a versão anterior")
+            return self._indices
+        finally:
+            self._lock.release()
+
+
+servico_balanca = ServicoBalanca()
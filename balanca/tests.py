@@ -1,3 +1,140 @@
-from django.test import TestCase
+import datetime
+import gzip
+import io
+import os
+import shutil
+import stat
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+
+from .models import RegistroSAP
+from .services import ServicoBalanca, gravar_registros_sap, ler_objetos_json, pallets_da_remessa
+
+
+def registro_sap(**campos):
+    hoje = datetime.date(2025, 1, 2)
+    dados = dict(
+        doc_material='4900000001', ano_doc_material=2025, item_doc_material=1, data_entrada=hoje,
+        centro='C001', deposito='D001', material='75370', lote='A1', data_producao=hoje,
+        data_vencimento=hoje, ordem='100', qtd_um_registro=1, um_registro='CX', chave_pallet='1',
+        nome_usuario='usuario', data_criacao=hoje, hora_criacao=datetime.time(8),
+        data_modificacao=hoje, hora_modificacao=datetime.time(8),
+    )
+    dados.update(campos)
+    return RegistroSAP.objects.create(**dados)
+
+
+def objeto_sap(item, **campos):
+    """Registro como chega no JSON do upload_sap."""
+    dados = dict(
+        chave_pallet=f'P{item}', doc_material='4900000001', ano_doc_material=2025, item_doc_material=item,
+        data_entrada='2025-01-02', centro='C001', deposito='D001', material='75370', lote='A1',
+        data_vencimento='2025-06-30', data_producao='2025-01-01', ordem='100', qtd_um_registro=10,
+        um_registro='CX', status_chave_pallet=None, nome_usuario='usuario', data_criacao='2025-01-02',
+        hora_criacao='07:08:09', modificado_por=None, data_modificacao='2025-01-02',
+        hora_modificacao='07:08:09',
+    )
+    dados.update(campos)
+    return dados
+
+
+class CacheIndicesTests(SimpleTestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.pasta, 'cache', 'balanca_indices.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def test_cache_json_em_pasta_privada(self):
+        indices = ServicoBalanca(cache_path=self.cache_path).indices()
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.dirname(self.cache_path)).st_mode), 0o700)
+
+        with mock.patch('balanca.services.pd.read_excel', side_effect=AssertionError('releu a planilha')):
+            do_cache = ServicoBalanca(cache_path=self.cache_path).indices()
+        self.assertEqual(do_cache.peso_caixa, indices.peso_caixa)
+        self.assertEqual(do_cache.sobrepeso, indices.sobrepeso)
+
+    def test_cache_gravavel_por_outros_e_ignorado(self):
+        ServicoBalanca(cache_path=self.cache_path).indices()
+        os.chmod(self.cache_path, 0o666)
+        servico = ServicoBalanca(cache_path=self.cache_path)
+        self.assertIsNone(servico._ler_cache(servico._assinaturas_atuais()))
+
+
+class PalletsDaRemessaTests(TestCase):
+
+    def test_chave_com_zeros_a_esquerda(self):
+        registro_sap(chave_pallet='000123', lote='L1', item_doc_material=1)
+        registro_sap(chave_pallet='124', lote='L2', item_doc_material=2)
+        registro_sap(chave_pallet='999', lote='L3', item_doc_material=3)
+        registro_sap(chave_pallet='123', lote='L4', item_doc_material=4)
+
+        lotes = [lote for lote, _ in pallets_da_remessa(['000123', 124.0, None])]
+        self.assertEqual(lotes, ['L1', 'L2'])
+        self.assertEqual([lote for lote, _ in pallets_da_remessa([123.0])], ['L4'])
+
+
+class LerObjetosJsonTests(SimpleTestCase):
+
+    def test_lista_e_ndjson_com_gzip(self):
+        lista = b'[{"a": 1}, {"a": 2}]'
+        ndjson = b'{"a": 1}\n{"a": 2}\n'
+        for corpo in (lista, ndjson, gzip.compress(lista)):
+            with self.subTest(corpo=corpo[:10]):
+                self.assertEqual(list(ler_objetos_json(io.BytesIO(corpo))), [{'a': 1}, {'a': 2}])
+
+    def test_registro_que_nao_e_objeto(self):
+        for corpo in (b'[{"a": 1}, 42]', b'lixo', b'{"a": 1} x'):
+            with self.subTest(corpo=corpo), self.assertRaises(ValueError):
+                list(ler_objetos_json(io.BytesIO(corpo)))
+
+    def test_registro_sem_fechar_para_no_limite(self):
+        corpo = io.BytesIO(b'[{"a": 1}, {"a": "' + b'x' * (1024 * 1024))
+        objetos = ler_objetos_json(corpo, max_pendente=100 * 1024)
+        self.assertEqual(next(objetos), {'a': 1})
+        with self.assertRaises(ValueError):
+            next(objetos)
+        # parou perto do limite, sem ler o corpo inteiro
+        self.assertLess(corpo.tell(), 300 * 1024)
+
+
+class HorasUploadSapTests(TestCase):
+
+    def test_formatos_de_hora(self):
+        contagem = gravar_registros_sap([
+            objeto_sap(1, hora_criacao='7:08'),
+            objeto_sap(2, hora_criacao='12:00', hora_modificacao='12:00:30.5'),
+            objeto_sap(3, hora_criacao='5'),
+            objeto_sap(4, hora_criacao='25:00:00'),
+        ])
+        self.assertEqual(contagem, {'novos': 2, 'alterados': 0, 'inalterados': 0, 'ignorados': 2})
+        horas = dict(RegistroSAP.objects.values_list('item_doc_material', 'hora_criacao'))
+        self.assertEqual(horas, {1: datetime.time(7, 8), 2: datetime.time(12, 0)})
+        self.assertEqual(RegistroSAP.objects.get(item_doc_material=2).hora_modificacao,
+                         datetime.time(12, 0, 30, 500000))
+
+
+class GravarRegistrosSapTests(TestCase):
+
+    def test_contagens_do_upsert(self):
+        self.assertEqual(gravar_registros_sap([objeto_sap(1), objeto_sap(2)]),
+                         {'novos': 2, 'alterados': 0, 'inalterados': 0, 'ignorados': 0})
+
+        # mesma exportação de novo
+        self.assertEqual(gravar_registros_sap([objeto_sap(1), objeto_sap(2)]),
+                         {'novos': 0, 'alterados': 0, 'inalterados': 2, 'ignorados': 0})
+
+        # item 2 com outro lote; item 3 repetido no mesmo lote: vale o último
+        contagem = gravar_registros_sap([
+            objeto_sap(1),
+            objeto_sap(2, lote='B2'),
+            objeto_sap(3, lote='C1'),
+            objeto_sap(3, lote='C2'),
+        ])
+        self.assertEqual(contagem, {'novos': 1, 'alterados': 1, 'inalterados': 1, 'ignorados': 1})
+        lotes = dict(RegistroSAP.objects.values_list('item_doc_material', 'lote'))
+        self.assertEqual(lotes, {1: 'A1', 2: 'B2', 3: 'C2'})
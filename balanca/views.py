@@ -1,82 +1,73 @@
 from django.shortcuts import render
-import pandas as pd
-import os
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse
-from .models import RegistroSAP
+from .services import (
+    buffer_expedicao,
+    buscar_remessa,
+    gravar_registros_sap,
+    inserir_expedicao,
+    ler_objetos_json,
+    linha_expedicao,
+    pallets_da_remessa,
+    servico_balanca,
+)
 import json
-import pymysql
-from dotenv import load_dotenv
-from pathlib import Path
-from pymysql import OperationalError
+from django.db import OperationalError as DatabaseOperationalError
 import logging
 import traceback
-from django.utils.dateparse import parse_date, parse_time
-import certifi
+import zlib
+from django.conf import settings
 
 logger = logging.getLogger(__name__)
-BASE_DIR = Path(__file__).resolve().parent
-env_path = BASE_DIR.parent / 'databaseinfo.env'
-load_dotenv(dotenv_path="/home/ubuntu/simulador_sobrepeso/databaseinfo.env")
 
-sap_file = os.path.join(BASE_DIR, 'data', 'dados_sap.xlsx')
-sku_file = os.path.join(BASE_DIR, 'data', 'dados_sku.xlsx')
-sobrepeso_file = os.path.join(BASE_DIR, 'data', 'dados_sobrepeso.xlsx')
-expedicao_file = os.path.join(BASE_DIR, 'data', 'dados_expedicao.xlsx')
-df_sap = pd.read_excel(sap_file)
-df_sku = pd.read_excel(sku_file)
-df_sobrepeso = pd.read_excel(sobrepeso_file)
-df_expedicao = pd.read_excel(expedicao_file)
 
 
-import pandas as pd
-
 def calcular_peso_final(remessa_num, peso_veiculo_vazio):
     try:
         remessa_num = int(remessa_num)
     except ValueError:
         return None
 
-    df_exp = df_expedicao[df_expedicao['REMESSA'] == remessa_num]
-    if df_exp.empty:
+    try:
+        indices = servico_balanca.indices()
+    except FileNotFoundError as e:
+        logger.error("Base da balança indisponível: %s", e.filename)
         return None
 
-    sku = df_exp.iloc[0]['ITEM']
-    qtd_caixas = df_exp['QUANTIDADE'].sum()  
+    remessa = buscar_remessa(remessa_num)
+    if remessa is None:
+        return None
 
-    df_sku_filtrado = df_sku[(df_sku['COD_PRODUTO'] == sku) & (df_sku['DESC_UNID_MEDID'] == 'Caixa')]
-    if df_sku_filtrado.empty:
+    sku = remessa.item
+    qtd_caixas = remessa.qtd_caixas
+
+    peso_por_caixa = indices.peso_por_caixa(sku)
+    if peso_por_caixa is None:
         print("SKU não encontrado na base de SKU ou unidade diferente de Caixa.")
         return None
 
-    peso_por_caixa = df_sku_filtrado.iloc[0]['QTDE_PESO_LIQ']
     peso_base = qtd_caixas * peso_por_caixa
-    chaves_pallet = df_exp['CHAVE_PALETE'].unique()
-    
-    df_pallets = df_sap[df_sap['Chave Pallet'].isin(chaves_pallet)]
-    if df_pallets.empty:
+    chaves_pallet = remessa.chaves_pallet
+
+    pallets = pallets_da_remessa(chaves_pallet)
+    if not pallets:
         print("Nenhum pallet encontrado na base do SAP para a remessa.")
         return None
 
     num_pallets = len(chaves_pallet)
+    pallet_weight_share = peso_base / num_pallets
+    overweight_adjustment = 0
     total_overweight_adjustment=0
-    for _, row in df_pallets.iterrows():
-        lote = row['Lote']
-        data_producao = row['Data de produção']
+    for lote, data_producao in pallets:
         last3=lote[-3:]
         linha_produzida = "L" + last3
-        df_sobrepeso_filtrado = df_sobrepeso[
-            (df_sobrepeso['Linhas'] == linha_produzida) &
-            (df_sobrepeso['Dia']==data_producao)
-        ]
-        if not df_sobrepeso_filtrado.empty:
-            sobrepeso_medio = df_sobrepeso_filtrado.iloc[0]['Média de sobrepeso']
+        sobrepeso_medio = indices.sobrepeso_medio(linha_produzida, data_producao)
+        if sobrepeso_medio is not None:
             overweight_decimal = sobrepeso_medio
-            pallet_weight_share = peso_base / num_pallets
             overweight_adjustment = peso_base * overweight_decimal
             total_overweight_adjustment += overweight_adjustment
         else:
-            print(f"Nenhum dado de sobrepeso encontrado para o pallet com data {data_producao.date()} e linha {linha_produzida}.")
+            print(f"Nenhum dado de sobrepeso encontrado para o pallet com data {data_producao} e linha {linha_produzida}.")
     
     
     peso_final = peso_veiculo_vazio + (peso_base + total_overweight_adjustment)
@@ -111,33 +102,32 @@ def analise_ocorrencias(request):
 
 @csrf_exempt
 def receber_expedicao(request):
+    """
+    Aceita um registro ({"remessa": ..., "item": ..., ...}) ou uma lista deles.
+    Sem buffer configurado, grava tudo num executemany e responde depois do
+    commit; com EXPEDICAO_BUFFER_LINHAS, enfileira e responde 202.
+    """
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
-            logger.info(f"Recebido via POST: {data}")
-            remessa = data.get('remessa')
-            item = data.get('item')
-            quantidade = data.get('quantidade')
-            chave_plt = data.get('chave_palete')
-            data_str = data.get('data')
-            print("Tentando conectar ao banco...")
+            registros = [data] if isinstance(data, dict) else data
+            if not isinstance(registros, list) or not all(isinstance(r, dict) for r in registros):
+                return JsonResponse({'erro': 'Esperado um objeto ou uma lista de objetos'}, status=400)
+            logger.info("Recebidos via POST: %d registro(s) de expedição", len(registros))
+            linhas = [linha_expedicao(r) for r in registros]
+
+            buffer = buffer_expedicao()
+            if buffer is not None:
+                buffer.adicionar(linhas)
+                return JsonResponse({'mensagem': 'Dados enfileirados para inserção', 'enfileirados': len(linhas)}, status=202)
+
             try:
-                conexao = pymysql.connect(
-                    host=os.getenv('DB_HOST'),
-                    user=os.getenv('DB_USER'),
-                    password=os.getenv('DB_PASSWORD'),
-                    database=os.getenv('DB_NAME')
-                )
-            except OperationalError as e:
+                inseridos = inserir_expedicao(linhas)
+            except DatabaseOperationalError as e:
                 print("Erro de conexão com o banco:", e)
                 return JsonResponse({'erro': 'Erro de conexão com o banco de dados'}, status=500)
 
-            with conexao.cursor() as cursor:
-                sql = "INSERT INTO tabela_exped (REMESSA, ITEM, QUANTIDADE,CHAVE_PALETE, DATA) VALUES (%s, %s, %s, %s,%s)"
-                cursor.execute(sql, (remessa, item, quantidade,chave_plt,data_str))
-                conexao.commit()
-
-            return JsonResponse({'mensagem': 'Dados inseridos com sucesso!'})
+            return JsonResponse({'mensagem': 'Dados inseridos com sucesso!', 'inseridos': inseridos})
 
         except Exception as e:
             print("Erro durante a inserção:", str(e))
@@ -146,45 +136,26 @@ def receber_expedicao(request):
     return JsonResponse({'erro': 'Método não permitido'}, status=405)
 @csrf_exempt
 def upload_sap(request):
-    print("📢 A view upload_sap foi acionada")
+    """
+    Recebe registros do SAP como lista JSON ou NDJSON, opcionalmente com gzip.
+    O corpo é lido e gravado em lotes, sem montar a lista inteira em memória;
+    registros já existentes (mesmo documento de material) são atualizados.
+    """
     logger.info("📥 A view upload_sap foi acionada")
     if request.method == 'POST':
         try:
-            dados = json.loads(request.body)
-            print("Registros recebidos:", len(dados))
-            print("Primeiro registro:", dados[0] if dados else "vazio")
-            registros = []
-            for row in dados:
-                registros.append(
-                    RegistroSAP(
-                        chave_pallet=row.get("chave_pallet"),
-                        doc_material=row.get("doc_material"),
-                        ano_doc_material=row.get("ano_doc_material"),
-                        item_doc_material=row.get("item_doc_material"),
-                        data_entrada=parse_date(str(row.get("data_entrada"))) if row.get("data_entrada") else None,
-                        centro=row.get("centro"),
-                        deposito=row.get("deposito"),
-                        material=row.get("material"),
-                        lote=row.get("lote"),
-                        data_vencimento=parse_date(str(row.get("data_vencimento"))) if row.get("data_vencimento") else None,
-                        data_producao=parse_date(row.get("data_producao")),
-                        ordem=row.get("ordem"),
-                        qtd_um_registro=row.get("qtd_um_registro"),
-                        um_registro=row.get("um_registro"),
-                        status_chave_pallet=row.get("status_chave_pallet") or '',
-                        nome_usuario=row.get("nome_usuario"),
-                        data_criacao=parse_date(str(row.get("data_criacao"))) if row.get("data_criacao") else None,
-                        hora_criacao=parse_time(str(row.get("hora_criacao"))) if row.get("hora_criacao") else None,
-                        modificado_por=row.get("modificado_por"),
-                        data_modificacao=parse_date(str(row.get("data_modificacao"))) if row.get("data_modificacao") else None,
-                        hora_modificacao=parse_time(str(row.get("hora_modificacao"))) if row.get("hora_modificacao") else None,
-                    )
-                )
-
-            RegistroSAP.objects.bulk_create(registros)
-            return JsonResponse({"status": "ok"}, status=201)
+            contagem = gravar_registros_sap(
+                ler_objetos_json(request),
+                tamanho_lote=getattr(settings, 'SAP_UPLOAD_LOTE', 2000),
+            )
+        except (ValueError, zlib.error, UnicodeDecodeError) as e:
+            logger.warning("Corpo inválido em upload_sap: %s", e)
+            return JsonResponse({'erro': f'Corpo inválido: {e}'}, status=400)
         except Exception as e:
             print("ERRO AO PROCESSAR UPLOAD_SAP")
             traceback.print_exc()
             return JsonResponse({'erro': str(e)}, status=500)
-    return JsonResponse({"erro": "Método não permitido"}, status=405)
\ No newline at end of file
+        logger.info("upload_sap: %(novos)d novos, %(alterados)d alterados, "
+                    "%(inalterados)d inalterados, %(ignorados)d ignorados", contagem)
+        return JsonResponse({"status": "ok", **contagem}, status=201)
+    return JsonResponse({"erro": "Método não permitido"}, status=405)
@@ -90,6 +90,9 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': '3306',
+        # reaproveita a conexão entre requisições do mesmo worker
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
         'OPTIONS': {
             'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
         },
@@ -140,5 +143,13 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Permitir uploads maiores via POST (100MB, por exemplo)
 DATA_UPLOAD_MAX_MEMORY_SIZE = 100 * 1024 * 1024  # 100 megabytes
 
+# Micro-lotes em /balanca/api/expedicao/: com EXPEDICAO_BUFFER_LINHAS > 0 as leituras
+# são enfileiradas e gravadas a cada N linhas ou EXPEDICAO_BUFFER_MS milissegundos.
+EXPEDICAO_BUFFER_LINHAS = int(os.getenv('EXPEDICAO_BUFFER_LINHAS', '0'))
+EXPEDICAO_BUFFER_MS = int(os.getenv('EXPEDICAO_BUFFER_MS', '200'))
 
+# Registros do SAP gravados por lote em /balanca/api/upload_sap/
+SAP_UPLOAD_LOTE = int(os.getenv('SAP_UPLOAD_LOTE', '2000'))
 
+# Cache em disco dos índices da balança (dados_sku/dados_sobrepeso); a pasta é criada com permissão 0700
+BALANCA_CACHE_DIR = os.getenv('BALANCA_CACHE_DIR', str(BASE_DIR / 'cache'))
@@ -1,14 +1,27 @@
 import os
 import gc
+import argparse
+import json
 import time
+import logging
+import codecs
+import csv
+import io
+import hashlib
+import tempfile
 import shutil
 import traceback
 import threading
+import queue
+import multiprocessing
+import sqlite3
 import subprocess
 from datetime import datetime
 from collections import defaultdict, Counter
+from contextlib import closing
 import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 import customtkinter as ctk
@@ -40,6 +53,95 @@ if not BASE_DIR_AUD:
 
 
 
+logger = logging.getLogger("simulador_sobrepeso")
+
+def configurar_log(nivel=None):
+    """Nível do logger do simulador: o informado, a variável SIMULADOR_LOG_NIVEL ou INFO."""
+    nivel = (nivel or os.environ.get("SIMULADOR_LOG_NIVEL") or "INFO").upper()
+    logger.setLevel(getattr(logging, nivel, logging.INFO))
+
+class _LogParaCallback(logging.Handler):
+    """Entrega cada registro do logger, já formatado, a uma função (tela, corpo do e-mail)."""
+
+    def __init__(self, callback, nivel=logging.NOTSET):
+        super().__init__(nivel)
+        self.callback = callback
+        self.setFormatter(logging.Formatter("%(message)s"))
+
+    def emit(self, record):
+        try:
+            self.callback(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+CACHE_DIR = os.path.join(os.environ.get("LOCALAPPDATA") or tempfile.gettempdir(), "SimuladorSobrepeso", "cache")
+
+def _assinatura_arquivo(path):
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_mtime_ns, st.st_size
+
+def _gravar_snapshot(df, destino_base):
+    """Grava em Feather (pyarrow) quando possível; senão cai para pickle. Devolve (arquivo, formato)."""
+    try:
+        import pyarrow.feather as feather
+        arquivo = destino_base + ".feather"
+        tmp = arquivo + ".tmp"
+        feather.write_feather(df.reset_index(drop=True), tmp)
+        os.replace(tmp, arquivo)
+        return arquivo, "feather"
+    except Exception:
+        arquivo = destino_base + ".pkl"
+        tmp = arquivo + ".tmp"
+        df.to_pickle(tmp)
+        os.replace(tmp, arquivo)
+        return arquivo, "pickle"
+
+def _ler_snapshot(arquivo, formato):
+    if formato == "feather":
+        import pyarrow.feather as feather
+        return feather.read_table(arquivo, memory_map=True).to_pandas()
+    return pd.read_pickle(arquivo)
+
+def ler_com_snapshot(path, nome, carregar, log=print):
+    """
+    Lê uma visão (`nome`, ex.: a aba) de `path` a partir de um snapshot colunar local,
+    válido enquanto caminho, mtime e tamanho do arquivo forem os mesmos. `carregar`
+    só é chamado (e o snapshot regravado) quando o OneDrive traz uma versão nova.
+    """
+    caminho_abs, mtime_ns, tamanho = _assinatura_arquivo(path)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    destino_base = os.path.join(CACHE_DIR, hashlib.sha1(f"{caminho_abs}|{nome}".encode("utf-8")).hexdigest()[:20])
+    meta_path = destino_base + ".json"
+
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("mtime_ns") == mtime_ns and meta.get("size") == tamanho:
+            df = _ler_snapshot(meta["arquivo"], meta["formato"])
+            log(f"[cache] {os.path.basename(path)}:{nome} lido do snapshot ({len(df)} linhas)")
+            return df
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log(f"[cache] snapshot de {os.path.basename(path)}:{nome} inválido, relendo a origem ({e!r})")
+
+    df = carregar()
+    try:
+        arquivo, formato = _gravar_snapshot(df, destino_base)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump({"path": caminho_abs, "nome": nome, "mtime_ns": mtime_ns, "size": tamanho,
+                       "arquivo": arquivo, "formato": formato}, f)
+        log(f"[cache] {os.path.basename(path)}:{nome} convertido para snapshot {formato}")
+        # devolve o que foi gravado, para a carga fria e a quente verem os mesmos tipos
+        return _ler_snapshot(arquivo, formato)
+    except Exception as e:
+        log(f"[cache][warn] não foi possível gravar snapshot de {os.path.basename(path)}:{nome}: {e!r}")
+    return df
+
+def ler_excel_cache(path, sheet_name, log=print):
+    return ler_com_snapshot(path, f"xlsx:{sheet_name}",
+                            lambda: pd.read_excel(path, sheet_name=sheet_name), log=log)
+
 def _norm_remessa_tuple(s):
     if s is None:
         return ("", "")
@@ -51,29 +153,57 @@ def _norm_remessa_tuple(s):
     sem_zeros = dig.lstrip('0') or "0"
     return (dig, sem_zeros)
 
-def _match_remessa_series(sr, alvo):
-    # força Series
-    if not isinstance(sr, pd.Series):
-        sr = pd.Series(sr)
-    # normaliza alvo
-    a, b = _norm_remessa_tuple(alvo)
-    if a == "" and b == "":
-        return pd.Series(False, index=sr.index)
-
-    vals = (sr.astype(str)
-              .str.strip()
-              .str.replace(r'\.0$', '', regex=True)
-              .str.replace(r'\D', '', regex=True))
-    vals_no0 = vals.str.lstrip('0')
-    vals_no0 = vals_no0.where(vals_no0 != "", "0")
-
-    a_no0 = (a.lstrip('0') or '0')
-    b_no0 = (b.lstrip('0') or '0')
+class RemessaIndex:
+    """
+    Índice de uma coluna REMESSA: forma canônica (só dígitos, sem '.0') e a mesma
+    sem zeros à esquerda → posições das linhas. A normalização roda uma vez por
+    carga e só sobre os valores distintos. Casar pela forma sem zeros cobre as
+    quatro comparações da busca antiga (dígitos e sem zeros, do alvo e da base).
+    """
 
-    mask = (vals.eq(a) | vals.eq(b) | vals_no0.eq(a_no0) | vals_no0.eq(b_no0))
+    def __init__(self, sr):
+        if not isinstance(sr, pd.Series):
+            sr = pd.Series(sr)
+        self.index = sr.index
+        codigos, distintos = pd.factorize(sr, use_na_sentinel=True)
+        self._distintos = distintos
+
+        digitos = (pd.Series(distintos, dtype=object).astype(str)
+                     .str.strip()
+                     .str.replace(r'\.0$', '', regex=True)
+                     .str.replace(r'\D', '', regex=True))
+        sem_zeros = digitos.str.lstrip('0')
+        sem_zeros = sem_zeros.where(sem_zeros != "", "0")
+
+        # valores nulos viram 'nan' → '' → '0', como no astype(str) da busca antiga
+        chave_por_codigo = np.append(sem_zeros.to_numpy(dtype=object), "0")
+        chaves = chave_por_codigo[codigos]
+        self._posicoes = {chave: pos for chave, pos in pd.Series(np.arange(len(sr))).groupby(chaves).indices.items()}
+        self._digitos = dict(zip(digitos.tolist(), sem_zeros.tolist()))
+        self._disponiveis = None
+
+    def posicoes(self, alvo):
+        a, b = _norm_remessa_tuple(alvo)
+        if a == "" and b == "":
+            return np.empty(0, dtype="int64")
+        return self._posicoes.get(b, np.empty(0, dtype="int64"))
+
+    def existe(self, alvo):
+        return len(self.posicoes(alvo)) > 0
+
+    def mascara(self, alvo):
+        mask = np.zeros(len(self.index), dtype=bool)
+        mask[self.posicoes(alvo)] = True
+        return pd.Series(mask, index=self.index)
+
+    def disponiveis(self):
+        """Valores distintos (não nulos) da coluna, ordenados."""
+        if self._disponiveis is None:
+            self._disponiveis = sorted(pd.Series(self._distintos, dtype=object).tolist(), key=str)
+        return self._disponiveis
 
-    mask = mask.reindex(sr.index).fillna(False).astype(bool)
-    return mask
+def _match_remessa_series(sr, alvo):
+    return RemessaIndex(sr).mascara(alvo)
 
 def converter_para_float_seguro(valor):
     if pd.isna(valor):
@@ -92,120 +222,752 @@ EXPECTED_COLS = [
     "UPDATED_AT","DELETED_AT","EXCLUIDO_POR_LOGIN"
 ]
 
-def _split_fix(parts, n):
-    """Garante exatamente n campos por linha."""
-    if len(parts) > n:
-        head = parts[:n-1]
-        tail = ";".join(parts[n-1:])
-        return head + [tail]
-    elif len(parts) < n:
-        return parts + [""] * (n - len(parts))
-    return parts
-
-def ler_csv_corretamente(csv_path, log=print):
-    """Lê o CSV alinhando header e linhas para EXACTAMENTE 17 colunas."""
-    for enc in ("utf-8-sig","utf-8","latin1","cp1252"):
+# Colunas a mais que o read_csv aceita por linha; o que passar da 17ª é juntado de volta
+# na última coluna, como o split antigo fazia com ';' sobrando no fim da linha. (Não dá
+# para usar usecols: com linhas de tamanhos diferentes o parser exige todas as colunas.)
+_FOLGA_COLUNAS_CSV = 16
+_EXTRAS_CSV = [f"_EXTRA_{i}" for i in range(_FOLGA_COLUNAS_CSV)]
+_NOMES_CSV = EXPECTED_COLS + _EXTRAS_CSV
+
+def _detectar_encoding(csv_path, tamanho_prefixo=64 * 1024):
+    """Escolhe o encoding pelo prefixo do arquivo, sem ler o CSV inteiro."""
+    with open(csv_path, "rb") as f:
+        prefixo = f.read(tamanho_prefixo)
+    for enc in ("utf-8-sig", "cp1252", "latin1"):
         try:
-            with open(csv_path, "r", encoding=enc, errors="replace") as f:
-                lines = [ln.rstrip("\r\n") for ln in f if ln.strip()]
-            break
-        except Exception:
+            codecs.getincrementaldecoder(enc)().decode(prefixo, final=False)
+            return enc
+        except UnicodeDecodeError:
             continue
-    else:
-        raise RuntimeError("Falha ao ler CSV com encodings testados.")
-
-    # encontra a linha do cabeçalho (a que contém 'ID' e 'REMESSA')
-    header_idx = None
-    for i, ln in enumerate(lines):
-        ps = ln.split(";")
-        if ("ID" in ps) and ("REMESSA" in ps):
-            header_idx = i
-            break
-    if header_idx is None:
-        header_idx = 0
-
-    header = _split_fix(lines[header_idx].split(";"), len(EXPECTED_COLS))
-    rows = []
-    for ln in lines[header_idx+1:]:
-        rows.append(_split_fix(ln.split(";"), len(EXPECTED_COLS)))
-
-    df = pd.DataFrame(rows, columns=EXPECTED_COLS, dtype=str)
-    df.columns = [c.strip() for c in df.columns]
+    raise RuntimeError("Falha ao ler CSV com encodings testados.")
+
+def _localizar_cabecalho(csv_path, encoding, max_linhas=200):
+    """
+    Offset (bytes) logo após a linha de cabeçalho (a que contém 'ID' e 'REMESSA').
+    Sem cabeçalho nas primeiras linhas, a primeira linha não vazia é tratada como tal.
+    """
+    pos = 0
+    fim_primeira = None
+    with open(csv_path, "rb") as f:
+        for _ in range(max_linhas):
+            raw = f.readline()
+            if not raw:
+                break
+            pos += len(raw)
+            ln = raw.decode(encoding, errors="replace").rstrip("\r\n")
+            if not ln.strip():
+                continue
+            if fim_primeira is None:
+                fim_primeira = pos
+            ps = ln.split(";")
+            if ("ID" in ps) and ("REMESSA" in ps):
+                return pos
+    return fim_primeira or 0
+
+def _fim_linhas_completas(csv_path):
+    """Offset (bytes) logo após a última quebra de linha; o que vem depois ainda está sendo escrito."""
+    with open(csv_path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        while pos > 0:
+            ini = max(0, pos - 64 * 1024)
+            f.seek(ini)
+            trecho = f.read(pos - ini)
+            i = trecho.rfind(b"\n")
+            if i >= 0:
+                return ini + i + 1
+            pos = ini
+    return 0
+
+class _TrechoArquivo(io.RawIOBase):
+    """Visão somente leitura de [inicio, fim) de um arquivo binário, para o read_csv."""
+
+    def __init__(self, f, inicio, fim=None):
+        super().__init__()
+        f.seek(inicio)
+        self._f = f
+        self._restante = None if fim is None else max(0, fim - inicio)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = len(buffer) if self._restante is None else min(len(buffer), self._restante)
+        dados = self._f.read(n)
+        buffer[:len(dados)] = dados
+        if self._restante is not None:
+            self._restante -= len(dados)
+        return len(dados)
+
+def iterar_csv_expedicao(csv_path, tamanho_bloco=50_000, encoding=None, inicio=None, fim=None, colunas=None):
+    """
+    Lê o CSV em streaming (read_csv com chunksize, a partir do fim do cabeçalho ou de
+    `inicio`, até `fim` se informado) e gera blocos DataFrame com as colunas pedidas
+    (por padrão EXATAMENTE as 17, como str). Só um bloco fica em memória por vez.
+    """
+    encoding = encoding or _detectar_encoding(csv_path)
+    if inicio is None:
+        inicio = _localizar_cabecalho(csv_path, encoding)
+    if fim is not None and fim <= inicio:
+        return
+    colunas = list(colunas or EXPECTED_COLS)
+
+    with open(csv_path, "rb") as f:
+        trecho = io.BufferedReader(_TrechoArquivo(f, inicio, fim))
+        try:
+            leitor = pd.read_csv(
+                trecho, sep=";", header=None, names=_NOMES_CSV, dtype=str,
+                na_filter=False, quoting=csv.QUOTE_NONE, skip_blank_lines=True,
+                encoding=encoding, encoding_errors="replace", chunksize=tamanho_bloco,
+            )
+            for bloco in leitor:
+                yield _bloco_csv(bloco, colunas)
+        except pd.errors.EmptyDataError:
+            return
+        except pd.errors.ParserError as e:
+            raise RuntimeError(f"Linha com mais de {len(_NOMES_CSV)} campos em {csv_path}: {e}") from e
+
+def _bloco_csv(bloco, colunas):
+    df = bloco[colunas].copy()
+    ultima = EXPECTED_COLS[-1]
+    if ultima in colunas:
+        com_extra = (bloco[_EXTRAS_CSV] != "").any(axis=1)
+        if com_extra.any():
+            # poucas linhas: junta os campos excedentes na última coluna
+            df.loc[com_extra, ultima] = bloco.loc[com_extra, [ultima, *_EXTRAS_CSV]].agg(";".join, axis=1)
     for c in ("UPDATED_AT","DELETED_AT","EXCLUIDO_POR_LOGIN"):
-        if c in df.columns:
+        if c in colunas:
             df[c] = df[c].str.replace(r";+$", "", regex=True).str.strip()
-    return df
+    return df.reset_index(drop=True)
 
-def carregar_base_expedicao_csv(base_dir: str, log=print):
+def ler_csv_corretamente(csv_path, log=print):
+    """Lê o CSV alinhando header e linhas para EXACTAMENTE 17 colunas."""
+    blocos = list(iterar_csv_expedicao(csv_path))
+    if not blocos:
+        return pd.DataFrame(columns=EXPECTED_COLS, dtype=str)
+    return pd.concat(blocos, ignore_index=True)
+
+def carregar_base_expedicao_csv(base_dir: str, log=print, incremental=False):
+    """
+    Base de expedição a partir do rastreabilidade.csv. Com `incremental=True`, só o
+    trecho acrescentado desde a última leitura é interpretado (ver
+    `_carregar_expedicao_incremental`).
+    """
     path_csv = os.path.join(base_dir, "rastreabilidade.csv")
     if not os.path.exists(path_csv):
         raise FileNotFoundError(f"'rastreabilidade.csv' não encontrado em: {path_csv}")
 
-    df_raw = ler_csv_corretamente(path_csv, log=log)
+    if incremental:
+        df = _carregar_expedicao_incremental(path_csv, log=log)
+    else:
+        df = ler_com_snapshot(path_csv, "csv:expedicao:v3", lambda: _montar_base_expedicao(path_csv, log=log), log=log)
 
-    col_remessa = "REMESSA"
-    col_item = "COD_ITEM"
-    col_chave = "COD_RASTREABILIDADE"
-    col_vol = "CASEWHENA.EXCLUIDO_POR_LOGINISNULLTHENA.VOLUMEELSE-1*A.VOLUMEEND"
+    log(f"[loader] CSV carregado OK: {df.shape[0]} linhas")
+    log(f"[loader] exemplos de remessas: {df['REMESSA'].drop_duplicates().head(5).tolist()}")
+    return df
 
+# colunas do CSV que a base compacta (e a detecção de retratações) usa
+_COLUNAS_CSV_COMPACTO = ["ID", "REMESSA", "COD_ITEM", EXPECTED_COLS[6], "COD_RASTREABILIDADE",
+                         "DELETED_AT", "EXCLUIDO_POR_LOGIN"]
+
+def _compactar_bloco_expedicao(df_raw):
+    """Converte um bloco cru de 17 colunas para as colunas usadas pelo simulador, já tipadas."""
+    col_vol = "CASEWHENA.EXCLUIDO_POR_LOGINISNULLTHENA.VOLUMEELSE-1*A.VOLUMEEND"
     df = pd.DataFrame({
-        "REMESSA": df_raw[col_remessa].astype(str).str.strip(),
-        "ITEM": df_raw[col_item].astype(str).str.strip(),
-        "COD_RASTREABILIDADE": df_raw[col_chave].astype(str).str.strip(),
-        "QUANTIDADE": pd.to_numeric(df_raw[col_vol].astype(str).str.replace(",", ".", regex=False),
-                                    errors="coerce").fillna(0.0)
+        "REMESSA": df_raw["REMESSA"].str.strip(),
+        "ITEM": df_raw["COD_ITEM"].str.strip(),
+        "COD_RASTREABILIDADE": df_raw["COD_RASTREABILIDADE"].str.strip(),
+        "QUANTIDADE": pd.to_numeric(df_raw[col_vol].str.replace(",", ".", regex=False),
+                                    errors="coerce").fillna(0.0),
+        "ID": df_raw["ID"].str.strip(),
     })
-    if "ID" in df_raw.columns:
-        df["ID"] = df_raw["ID"].astype(str).str.strip()
+    return df[(df["REMESSA"] != "") & (df["ITEM"] != "") & (df["COD_RASTREABILIDADE"] != "")]
 
-    df = df[(df["REMESSA"] != "") & (df["ITEM"] != "") & (df["COD_RASTREABILIDADE"] != "")]
+def _tipar_base_expedicao(df):
     df = df.reset_index(drop=True)
-
-    log(f"[loader] CSV carregado OK: {df.shape[0]} linhas")
-    log(f"[loader] exemplos de remessas: {df['REMESSA'].unique()[:5]}")
+    df["REMESSA"] = df["REMESSA"].astype("category")
+    df["ITEM"] = df["ITEM"].astype("category")
     return df
 
-def salvar_em_base_auxiliar(df_remessa, remessa, log_callback, fonte_dir):
-    caminho_aux = os.path.join(fonte_dir, "expedicao_edicoes.xlsx")
+def _deduplicar_ids(df):
+    """
+    Uma linha por ID: vale a última ocorrência no arquivo (a retratação com volume
+    negativo substitui a linha original). Linhas sem ID são mantidas todas.
+    """
+    repetida = df["ID"].ne("") & df.duplicated("ID", keep="last")
+    return df[~repetida.to_numpy()] if repetida.any() else df
+
+def _anexar_expedicao(df_cache, novos):
+    """
+    Acrescenta `novos` (já tipado) a `df_cache` sem refazer a tipagem do histórico:
+    REMESSA/ITEM são unidas com union_categoricals, com as categorias ordenadas
+    como o astype("category") da leitura completa.
+    """
+    if df_cache is None:
+        return novos
+    df = pd.concat([df_cache.drop(columns=["REMESSA", "ITEM"]), novos.drop(columns=["REMESSA", "ITEM"])],
+                   ignore_index=True)
+    for c in ("REMESSA", "ITEM"):
+        df[c] = union_categoricals([df_cache[c], novos[c]], sort_categories=True)
+    return df[novos.columns]
+
+_ESTADO_EXPEDICAO_INCREMENTAL = {}
+_TAM_AMOSTRA_INCREMENTAL = 64 * 1024
+# Acima disso as partes gravadas em disco são consolidadas numa só
+_MAX_PARTES_INCREMENTAL = 32
+
+def _amostras_arquivo(path, offset):
+    """Hashes do início do arquivo e do trecho logo antes de `offset`, para detectar reescrita."""
+    with open(path, "rb") as f:
+        inicio = f.read(min(offset, _TAM_AMOSTRA_INCREMENTAL))
+        f.seek(max(0, offset - 4096))
+        fim = f.read(offset - max(0, offset - 4096))
+    return hashlib.sha1(inicio).hexdigest(), hashlib.sha1(fim).hexdigest()
+
+def _estado_incremental_path(caminho_abs):
+    return os.path.join(CACHE_DIR, hashlib.sha1(f"{caminho_abs}|csv:incremental:v2".encode("utf-8")).hexdigest()[:20])
+
+def _ler_estado_incremental(caminho_abs):
+    """
+    Estado salvo em disco: o JSON com offset/max_id/amostras e as partes Feather
+    (uma por leitura da cauda), lidas mapeadas em memória e unidas de novo.
+    """
+    try:
+        import pyarrow.feather as feather
+        with open(_estado_incremental_path(caminho_abs) + ".json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        df = None
+        for arquivo in meta["partes"]:
+            parte = feather.read_table(arquivo, memory_map=True).to_pandas()
+            df = _anexar_expedicao(df, parte)
+        if df is None:
+            return None
+        # uma parte posterior pode ter reemitido um ID de parte anterior
+        meta["df"] = _deduplicar_ids(df).reset_index(drop=True)
+        for c in ("REMESSA", "ITEM"):
+            meta["df"][c] = meta["df"][c].cat.remove_unused_categories()
+        return meta
+    except Exception:
+        return None
+
+def _gravar_estado_incremental(caminho_abs, estado, novos, log=print):
+    """
+    Grava só a parte nova (`novos`) e atualiza o JSON. Com `novos=None`, ou
+    acumuladas partes demais, regrava o estado inteiro numa parte única.
+    """
     try:
-        if os.path.exists(caminho_aux):
+        import pyarrow.feather as feather
+        destino_base = _estado_incremental_path(caminho_abs)
+        pasta = destino_base + ".partes"
+        partes = list(estado.get("partes") or [])
+        if novos is None or len(partes) >= _MAX_PARTES_INCREMENTAL:
+            shutil.rmtree(pasta, ignore_errors=True)
+            partes, novos = [], estado["df"]
+        os.makedirs(pasta, exist_ok=True)
+        arquivo = os.path.join(pasta, f"{len(partes):05d}.feather")
+        feather.write_feather(novos.reset_index(drop=True), arquivo + ".tmp")
+        os.replace(arquivo + ".tmp", arquivo)
+        partes.append(arquivo)
+        estado["partes"] = partes
+        meta = {k: v for k, v in estado.items() if k != "df"}
+        with open(destino_base + ".json.tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(destino_base + ".json.tmp", destino_base + ".json")
+    except Exception as e:
+        log(f"[loader][incremental][warn] não foi possível gravar o estado: {e!r}")
+
+def _carregar_expedicao_incremental(path_csv, log=print):
+    """
+    Lê só a cauda acrescentada ao CSV desde a última ingestão (offset e maior ID
+    guardados em memória e em disco) e a anexa à base já tipada. A regra de IDs é a
+    mesma da leitura completa (`_deduplicar_ids`): a última ocorrência vale, então
+    uma linha reemitida na cauda, como a retratação com DELETED_AT/EXCLUIDO_POR_LOGIN,
+    substitui a linha em cache com o mesmo ID. Em disco só a parte nova é gravada.
+    Se o início do arquivo mudou (reexportação), volta à leitura completa.
+    """
+    caminho_abs = os.path.abspath(path_csv)
+    estado = _ESTADO_EXPEDICAO_INCREMENTAL.get(caminho_abs) or _ler_estado_incremental(caminho_abs)
+    tamanho = os.path.getsize(path_csv)
+    # uma última linha sem quebra ainda está sendo escrita: fica para a próxima leitura
+    fim = _fim_linhas_completas(path_csv)
+
+    if estado is not None:
+        if tamanho < estado["offset"] or list(_amostras_arquivo(path_csv, estado["offset"])) != list(estado["amostras"]):
+            log("[loader][incremental] CSV reescrito desde a última leitura → releitura completa")
+            estado = None
+        elif fim <= estado["offset"]:
+            log("[loader][incremental] nenhuma linha nova")
+            _ESTADO_EXPEDICAO_INCREMENTAL[caminho_abs] = estado
+            return estado["df"]
+
+    if estado is None:
+        encoding = _detectar_encoding(path_csv)
+        inicio = _localizar_cabecalho(path_csv, encoding)
+        df_cache = None
+        max_id = float("-inf")
+    else:
+        encoding = estado["encoding"]
+        inicio = estado["offset"]
+        df_cache = estado["df"]
+        max_id = estado["max_id"]
+
+    offset = max(inicio, fim)
+    partes = []
+    for bloco in iterar_csv_expedicao(path_csv, encoding=encoding, inicio=inicio, fim=offset,
+                                      colunas=_COLUNAS_CSV_COMPACTO):
+        compacto = _compactar_bloco_expedicao(bloco)
+        excluida = (bloco["DELETED_AT"] != "") | (bloco["EXCLUIDO_POR_LOGIN"] != "")
+        partes.append(compacto.assign(_EXCLUIDA=excluida.loc[compacto.index].to_numpy()))
+    if not partes:
+        partes = [_compactar_bloco_expedicao(pd.DataFrame(columns=EXPECTED_COLS, dtype=str)).assign(_EXCLUIDA=False)]
+    novos = _deduplicar_ids(pd.concat(partes, ignore_index=True))
+
+    # IDs que podem já estar no cache: numéricos até o maior ingerido e os não numéricos
+    ids_num = pd.to_numeric(novos["ID"], errors="coerce")
+    reemitidas = ((ids_num <= max_id) | (ids_num.isna() & novos["ID"].ne(""))).to_numpy()
+    if df_cache is not None and reemitidas.any():
+        no_cache = df_cache["ID"].isin(set(novos.loc[reemitidas, "ID"]))
+        if no_cache.any():
+            df_cache = df_cache[~no_cache.to_numpy()].reset_index(drop=True)
+            for c in ("REMESSA", "ITEM"):
+                df_cache[c] = df_cache[c].cat.remove_unused_categories()
+            log(f"[loader][incremental] {int(no_cache.sum())} linha(s) com ID já ingerido substituídas "
+                f"({int((reemitidas & novos['_EXCLUIDA'].to_numpy()).sum())} retratação(ões))")
+
+    novos = _tipar_base_expedicao(novos.drop(columns="_EXCLUIDA"))
+    df = _anexar_expedicao(df_cache, novos)
+    if ids_num.notna().any():
+        max_id = max(max_id, float(ids_num.max()))
+
+    partes_gravadas = None if estado is None else estado.get("partes")
+    estado = {
+        "encoding": encoding,
+        "offset": offset,
+        "max_id": max_id,
+        "amostras": list(_amostras_arquivo(path_csv, offset)),
+        "partes": partes_gravadas,
+        "df": df,
+    }
+    _ESTADO_EXPEDICAO_INCREMENTAL[caminho_abs] = estado
+    _gravar_estado_incremental(caminho_abs, estado, None if df_cache is None else novos, log=log)
+    log(f"[loader][incremental] {len(novos)} linha(s) lida(s) da cauda ({offset - inicio} bytes)")
+    return df
+
+def _montar_base_expedicao(path_csv, log=print):
+    partes = [_compactar_bloco_expedicao(bloco)
+              for bloco in iterar_csv_expedicao(path_csv, colunas=_COLUNAS_CSV_COMPACTO)]
+    if not partes:
+        partes = [_compactar_bloco_expedicao(pd.DataFrame(columns=EXPECTED_COLS, dtype=str))]
+    return _tipar_base_expedicao(_deduplicar_ids(pd.concat(partes, ignore_index=True)))
+
+COLUNAS_EDICOES = ["REMESSA", "ITEM", "QUANTIDADE", "CHAVE_PALETE", "COD_RASTREABILIDADE", "ID"]
+
+def _texto_edicao(v):
+    # o Excel devolve códigos como float quando a coluna tem vazios (123 → 123.0)
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    return str(v).strip()
+
+class EdicoesStore:
+    """
+    Base auxiliar de edições. A fonte da verdade, compartilhada entre as estações,
+    é o `expedicao_edicoes.xlsx` da pasta de Auditoria (OneDrive). Cada estação
+    trabalha numa cópia local em SQLite, fora da pasta sincronizada (o OneDrive
+    não respeita o lock do SQLite e pode subir o arquivo no meio de uma transação),
+    com índice pela remessa normalizada (sem zeros à esquerda, como no RemessaIndex).
+
+    A reconciliação é por remessa: as remessas salvas aqui e ainda não exportadas
+    ficam em `pendentes`. Quando a planilha muda (outra estação exportou), as demais
+    remessas são trazidas dela; as pendentes seguem com a versão local. A exportação
+    reconcilia de novo e só substitui a planilha se ela não mudou nesse meio tempo.
+    Duas estações editando a mesma remessa: vale a última exportação.
+    """
+
+    NOME_XLSX = "expedicao_edicoes.xlsx"
+    TENTATIVAS_EXPORTACAO = 3
+    _instancias = {}
+    _instancias_lock = threading.Lock()
+
+    def __init__(self, fonte_dir, exportar_xlsx=True, pasta_local=None):
+        self.fonte_dir = fonte_dir
+        self.caminho_xlsx = os.path.join(fonte_dir, self.NOME_XLSX)
+        pasta_local = pasta_local or os.path.join(CACHE_DIR, "edicoes")
+        chave = hashlib.sha1(os.path.abspath(fonte_dir).encode("utf-8")).hexdigest()[:20]
+        self.caminho_db = os.path.join(pasta_local, f"{chave}.sqlite")
+        self.exportar_xlsx = exportar_xlsx
+        self._lock = threading.Lock()
+        self._exportacao_pendente = False
+        self._exportando = False
+        self._log = print
+        self._inicializado = False
+
+    @classmethod
+    def de(cls, fonte_dir):
+        chave = os.path.abspath(fonte_dir)
+        with cls._instancias_lock:
+            if chave not in cls._instancias:
+                cls._instancias[chave] = cls(fonte_dir)
+            return cls._instancias[chave]
+
+    def _conectar(self):
+        """Conexão com a cópia local, já reconciliada com a planilha compartilhada."""
+        os.makedirs(os.path.dirname(self.caminho_db), exist_ok=True)
+        conn = sqlite3.connect(self.caminho_db, timeout=30)
+        with self._lock:
             try:
-                with pd.ExcelFile(caminho_aux) as xls:
-                    if "dado_exp" in xls.sheet_names:
-                        df_existente = pd.read_excel(xls, sheet_name="dado_exp")
-                        df_existente = df_existente[
-                            df_existente["REMESSA"].astype(str).str.replace(r"\.0$", "", regex=True) != str(remessa)
-                        ]
-                    else:
-                        df_existente = pd.DataFrame()
+                if not self._inicializado:
+                    self._criar_tabelas(conn)
+                self._sincronizar(conn)
+            except Exception:
+                # a leitura da planilha é tentada de novo na próxima conexão
+                conn.close()
+                raise
+            self._inicializado = True
+        return conn
+
+    @staticmethod
+    def _criar_tabelas(conn):
+        with conn:
+            # AUTOINCREMENT: rowid de linha apagada não é reaproveitado, então um rowid
+            # antigo nunca aponta para a linha que outra estação pôs no lugar
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS dado_exp (SEQ INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " REMESSA TEXT, REMESSA_NORM TEXT NOT NULL, ITEM TEXT, QUANTIDADE REAL,"
+                " CHAVE_PALETE TEXT, COD_RASTREABILIDADE TEXT, ID TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_dado_exp_remessa ON dado_exp (REMESSA_NORM)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor TEXT)")
+            # remessas alteradas nesta estação e ainda não exportadas, com a versão da alteração
+            conn.execute("CREATE TABLE IF NOT EXISTS pendentes (REMESSA_NORM TEXT PRIMARY KEY, versao INTEGER)")
+
+    def _assinatura_xlsx(self):
+        try:
+            st = os.stat(self.caminho_xlsx)
+        except FileNotFoundError:
+            return "ausente"
+        return f"{st.st_mtime_ns}:{st.st_size}"
+
+    @staticmethod
+    def _assinatura_sincronizada(conn):
+        linha = conn.execute("SELECT valor FROM meta WHERE chave = 'xlsx_assinatura'").fetchone()
+        return linha[0] if linha else None
+
+    def _ler_xlsx(self):
+        """Linhas da planilha compartilhada já preparadas (None se ela não existe ou não tem a aba)."""
+        if not os.path.exists(self.caminho_xlsx):
+            return None
+        try:
+            with pd.ExcelFile(self.caminho_xlsx) as xls:
+                if "dado_exp" not in xls.sheet_names:
+                    return None
+                df = pd.read_excel(xls, sheet_name="dado_exp")
+            return self._preparar(df) if "REMESSA" in df.columns else None
+        except Exception as e:
+            self._log(f"[edicoes][warn] não foi possível ler {self.NOME_XLSX}: {e}")
+            raise RuntimeError(f"Falha ao ler {self.NOME_XLSX}; a planilha não foi alterada.") from e
+
+    def _sincronizar(self, conn):
+        """
+        Traz da planilha as remessas que outra estação alterou desde a última leitura
+        ou exportação desta. Remessas pendentes aqui ficam como estão, e remessas
+        iguais nos dois lados não são regravadas (os rowids em edição continuam válidos).
+        """
+        assinatura = self._assinatura_xlsx()
+        if self._assinatura_sincronizada(conn) == assinatura:
+            return
+        df = self._ler_xlsx()
+        pendentes = {n for (n,) in conn.execute("SELECT REMESSA_NORM FROM pendentes")}
+
+        locais = defaultdict(Counter)
+        for norma, *valores in conn.execute(
+                f"SELECT REMESSA_NORM, {', '.join(COLUNAS_EDICOES)} FROM dado_exp"):
+            locais[norma][tuple(valores)] += 1
+        remotas = defaultdict(list)
+        for linha in ([] if df is None else self._linhas_sql(df)):
+            remotas[linha[1]].append(linha)
+
+        mudaram = [n for n in set(locais) | set(remotas)
+                   if n not in pendentes and locais.get(n, Counter()) != Counter(
+                       (l[0],) + l[2:] for l in remotas.get(n, []))]
+        with conn:
+            for norma in mudaram:
+                conn.execute("DELETE FROM dado_exp WHERE REMESSA_NORM = ?", (norma,))
+                self._executar_insercao(conn, remotas.get(norma, []))
+            conn.execute("INSERT OR REPLACE INTO meta (chave, valor) VALUES ('xlsx_assinatura', ?)", (assinatura,))
+        if mudaram:
+            self._log(f"[edicoes] {len(mudaram)} remessa(s) atualizada(s) a partir de {self.NOME_XLSX}")
+
+    @staticmethod
+    def _marcar_pendente(conn, norma):
+        conn.execute("INSERT OR REPLACE INTO pendentes (REMESSA_NORM, versao) VALUES (?, ?)",
+                     (norma, time.time_ns()))
+
+    @staticmethod
+    def _preparar(df):
+        df = df.copy()
+        if "CHAVE_PALETE" not in df.columns and "COD_RASTREABILIDADE" in df.columns:
+            df["CHAVE_PALETE"] = df["COD_RASTREABILIDADE"]
+        if "COD_RASTREABILIDADE" not in df.columns and "CHAVE_PALETE" in df.columns:
+            df["COD_RASTREABILIDADE"] = df["CHAVE_PALETE"]
+        if "ID" in df.columns:
+            df["ID"] = df["ID"].astype(str).str.strip()
+
+        df["REMESSA"] = df["REMESSA"].astype(str).str.replace(r"\.0$", "", regex=True)
+        df = df.dropna(subset=["ITEM"])
+        df = df[df["ITEM"] != ""]
+        df = df.drop_duplicates(subset=["REMESSA", "ITEM", "CHAVE_PALETE"], keep="last")
+        return df.reindex(columns=COLUNAS_EDICOES)
+
+    @staticmethod
+    def _linhas_sql(df):
+        """(REMESSA, REMESSA_NORM, ITEM, QUANTIDADE, CHAVE_PALETE, COD_RASTREABILIDADE, ID) de cada linha."""
+        if df.empty:
+            return []
+        normas = [_norm_remessa_tuple(r)[1] for r in df["REMESSA"].tolist()]
+        colunas = []
+        for c in COLUNAS_EDICOES:
+            valores = df[c].astype(object).where(df[c].notna(), None).tolist()
+            if c == "QUANTIDADE":
+                valores = [None if v is None else float(v) for v in valores]
+            else:
+                valores = [None if v is None else _texto_edicao(v) for v in valores]
+            colunas.append(valores)
+        return [(r[0], n) + tuple(r[1:]) for r, n in zip(zip(*colunas), normas)]
+
+    @staticmethod
+    def _executar_insercao(conn, linhas):
+        # roda dentro da transação de quem chama
+        conn.executemany(
+            "INSERT INTO dado_exp (REMESSA, REMESSA_NORM, ITEM, QUANTIDADE, CHAVE_PALETE, COD_RASTREABILIDADE, ID)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            linhas,
+        )
+        return len(linhas)
+
+    @classmethod
+    def _inserir(cls, conn, df):
+        return cls._executar_insercao(conn, cls._linhas_sql(df))
+
+    def salvar(self, df_remessa, remessa, log_callback=print):
+        """Substitui as linhas da remessa pelas de `df_remessa` numa única transação."""
+        self._log = log_callback
+        df = self._preparar(df_remessa)
+        norma = _norm_remessa_tuple(remessa)[1]
+        with closing(self._conectar()) as conn:
+            with conn:
+                conn.execute("DELETE FROM dado_exp WHERE REMESSA_NORM = ?", (norma,))
+                self._inserir(conn, df)
+                self._marcar_pendente(conn, norma)
+        self._agendar_exportacao()
+        return df
+
+    def aplicar(self, remessa, alteracoes, log_callback=print):
+        """
+        Grava só o delta de `alteracoes` (AlteracoesRemessa cujos ids são rowids desta
+        tabela): DELETE e UPDATE por rowid e INSERT das linhas novas, numa transação.
+        Se algum rowid não existe mais (a remessa veio atualizada de outra estação
+        depois de aberta), nada é gravado e levanta RuntimeError.
+        """
+        self._log = log_callback
+        if not alteracoes:
+            return 0
+        norma = _norm_remessa_tuple(remessa)[1]
+        novas = alteracoes.linhas_novas()
+        with closing(self._conectar()) as conn:
+            with conn:
+                esperadas = afetadas = 0
+                if alteracoes.removidas:
+                    esperadas += len(alteracoes.removidas)
+                    afetadas += conn.executemany("DELETE FROM dado_exp WHERE rowid = ? AND REMESSA_NORM = ?",
+                                                 [(int(rid), norma) for rid in alteracoes.removidas]).rowcount
+                for coluna, valores in alteracoes.alteradas.items():
+                    if not valores:
+                        continue
+                    # CHAVE_PALETE e COD_RASTREABILIDADE andam juntas, como em _preparar
+                    destinos = [coluna, "COD_RASTREABILIDADE"] if coluna == "CHAVE_PALETE" else [coluna]
+                    esperadas += len(valores)
+                    afetadas += conn.executemany(
+                        f"UPDATE dado_exp SET {', '.join(f'{c} = ?' for c in destinos)}"
+                        " WHERE rowid = ? AND REMESSA_NORM = ?",
+                        [(*[self._valor_sql(coluna, v)] * len(destinos), int(rid), norma) for rid, v in valores.items()],
+                    ).rowcount
+                if afetadas != esperadas:
+                    # sai do `with conn` com exceção: a transação é desfeita
+                    raise RuntimeError(f"Remessa {remessa} foi atualizada por outra estação; "
+                                       "reabra a remessa e refaça as alterações.")
+                if not novas.empty:
+                    self._inserir(conn, self._preparar(novas.assign(REMESSA=str(remessa))))
+                self._marcar_pendente(conn, norma)
+        self._agendar_exportacao()
+        return len(alteracoes)
+
+    @staticmethod
+    def _valor_sql(coluna, valor):
+        if valor is None or pd.isna(valor):
+            return None
+        return float(valor) if coluna == "QUANTIDADE" else _texto_edicao(valor)
+
+    def remover(self, remessa, log_callback=print):
+        self._log = log_callback
+        if not os.path.exists(self.caminho_db) and not os.path.exists(self.caminho_xlsx):
+            return 0
+        norma = _norm_remessa_tuple(remessa)[1]
+        with closing(self._conectar()) as conn:
+            with conn:
+                removidas = conn.execute("DELETE FROM dado_exp WHERE REMESSA_NORM = ?", (norma,)).rowcount
+                if removidas:
+                    self._marcar_pendente(conn, norma)
+        if removidas:
+            self._agendar_exportacao()
+        return removidas
+
+    def _consultar(self, where="", params=()):
+        if not os.path.exists(self.caminho_db) and not os.path.exists(self.caminho_xlsx):
+            return pd.DataFrame()
+        with closing(self._conectar()) as conn:
+            df = pd.read_sql_query(
+                f"SELECT rowid AS rowid, {', '.join(COLUNAS_EDICOES)} FROM dado_exp {where} ORDER BY rowid", conn,
+                params=params, index_col="rowid",
+            )
+        df.index.name = None
+        return df if not df.empty else pd.DataFrame()
+
+    def remessa(self, remessa):
+        """Linhas editadas da remessa, indexadas pelo rowid (DataFrame vazio se ela não foi editada)."""
+        a, b = _norm_remessa_tuple(remessa)
+        if a == "" and b == "":
+            return pd.DataFrame()
+        return self._consultar("WHERE REMESSA_NORM = ?", (b,))
+
+    def todos(self):
+        return self._consultar()
+
+    def _agendar_exportacao(self):
+        if not self.exportar_xlsx:
+            return
+        with self._lock:
+            self._exportacao_pendente = True
+            if self._exportando:
+                return
+            self._exportando = True
+        threading.Thread(target=self._rodar_exportacao, daemon=True).start()
+
+    def _rodar_exportacao(self):
+        # várias gravações seguidas resultam em uma única regravação da planilha
+        while True:
+            with self._lock:
+                if not self._exportacao_pendente:
+                    self._exportando = False
+                    return
+                self._exportacao_pendente = False
+            try:
+                self.exportar()
             except Exception as e:
-                log_callback(f"Erro ao ler arquivo existente, criando novo: {str(e)}")
-                df_existente = pd.DataFrame()
-        else:
-            df_existente = pd.DataFrame()
+                self._log(f"[edicoes][warn] exportação de {self.NOME_XLSX} não concluída: {e}")
+
+    def exportar(self):
+        """
+        Regrava a planilha compartilhada com a cópia local já reconciliada. Se outra
+        estação gravou a planilha enquanto esta montava a sua, reconcilia e tenta de
+        novo, em vez de sobrescrever o que a outra gravou.
+        """
+        for _ in range(self.TENTATIVAS_EXPORTACAO):
+            with closing(self._conectar()) as conn:
+                base = self._assinatura_sincronizada(conn)
+                pendentes = conn.execute("SELECT REMESSA_NORM, versao FROM pendentes").fetchall()
+                df = pd.read_sql_query(f"SELECT {', '.join(COLUNAS_EDICOES)} FROM dado_exp ORDER BY rowid", conn)
+            df = df.sort_values(by=["REMESSA", "ITEM"], kind="stable")
+            tmp = os.path.join(self.fonte_dir, f"~{os.getpid()}_{self.NOME_XLSX}")
+            try:
+                with pd.ExcelWriter(tmp, engine="openpyxl") as writer:
+                    df.to_excel(writer, sheet_name="dado_exp", index=False)
+                if self._assinatura_xlsx() != base:
+                    continue
+                os.replace(tmp, self.caminho_xlsx)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            with closing(sqlite3.connect(self.caminho_db, timeout=30)) as conn, conn:
+                conn.execute("INSERT OR REPLACE INTO meta (chave, valor) VALUES ('xlsx_assinatura', ?)",
+                             (self._assinatura_xlsx(),))
+                # alterações feitas durante a exportação continuam pendentes (versão diferente)
+                conn.executemany("DELETE FROM pendentes WHERE REMESSA_NORM = ? AND versao = ?", pendentes)
+            return
+        raise RuntimeError(f"{self.NOME_XLSX} mudou durante {self.TENTATIVAS_EXPORTACAO} tentativas de exportação")
 
-        df_remessa = df_remessa.copy()
-        if "CHAVE_PALETE" not in df_remessa.columns and "COD_RASTREABILIDADE" in df_remessa.columns:
-            df_remessa["CHAVE_PALETE"] = df_remessa["COD_RASTREABILIDADE"]
-        if "COD_RASTREABILIDADE" not in df_remessa.columns and "CHAVE_PALETE" in df_remessa.columns:
-            df_remessa["COD_RASTREABILIDADE"] = df_remessa["CHAVE_PALETE"]
-        if "ID" in df_remessa.columns:
-            df_remessa["ID"] = df_remessa["ID"].astype(str).str.strip()
 
-        df_remessa["REMESSA"] = df_remessa["REMESSA"].astype(str).str.replace(r"\.0$", "", regex=True)
-        df_remessa = df_remessa.dropna(subset=["ITEM"])
-        df_remessa = df_remessa[df_remessa["ITEM"] != ""]
+class AlteracoesRemessa:
+    """
+    Alterações pendentes de uma remessa em edição, por id de linha: linhas novas,
+    células alteradas (guardadas por coluna) e ids removidos. `aplicar` leva tudo a
+    um DataFrame de uma vez e o EdicoesStore grava só esse delta.
+    """
+
+    def __init__(self, colunas):
+        self.colunas = list(colunas)
+        self.novas = {}
+        self.alteradas = {c: {} for c in self.colunas}
+        self.removidas = set()
+
+    def __len__(self):
+        ids = set(self.novas) | self.removidas
+        for valores in self.alteradas.values():
+            ids.update(valores)
+        return len(ids)
 
-        df_remessa = df_remessa.drop_duplicates(subset=["REMESSA", "ITEM", "CHAVE_PALETE"], keep="last")
+    def __bool__(self):
+        return bool(self.novas or self.removidas or any(self.alteradas.values()))
 
-        df_atualizado = pd.concat([df_existente, df_remessa], ignore_index=True)
-        df_atualizado = df_atualizado.sort_values(by=["REMESSA", "ITEM"])
+    def inserir(self, rid, valores):
+        self.novas[rid] = {c: valores.get(c) for c in self.colunas}
+
+    def alterar(self, rid, coluna, valor):
+        if rid in self.novas:
+            self.novas[rid][coluna] = valor
+        else:
+            self.alteradas[coluna][rid] = valor
+
+    def remover(self, rid):
+        if rid in self.novas:
+            del self.novas[rid]
+        else:
+            self.removidas.add(rid)
+        for valores in self.alteradas.values():
+            valores.pop(rid, None)
 
-        with pd.ExcelWriter(caminho_aux, engine="openpyxl") as writer:
-            df_atualizado.to_excel(writer, sheet_name="dado_exp", index=False)
+    def linhas_novas(self):
+        return pd.DataFrame.from_dict(self.novas, orient="index", columns=self.colunas)
 
+    def aplicar(self, df):
+        """`df` (índice = id da linha) com as alterações: um drop, uma atribuição por coluna e um concat."""
+        df = df.drop(index=df.index.intersection(list(self.removidas)))
+        for coluna, valores in self.alteradas.items():
+            if valores:
+                serie = pd.Series(valores, dtype=df[coluna].dtype)
+                serie = serie[serie.index.isin(df.index)]
+                df.loc[serie.index, coluna] = serie
+        if not self.novas:
+            return df
+        return pd.concat([df, self.linhas_novas().astype(df.dtypes.to_dict())])
+
+def salvar_em_base_auxiliar(df_remessa, remessa, log_callback, fonte_dir):
+    try:
+        df_remessa = EdicoesStore.de(fonte_dir).salvar(df_remessa, remessa, log_callback)
         log_callback(f"Remessa {remessa} salva na base auxiliar. Total de itens: {len(df_remessa)}")
-        return df_atualizado
+        return df_remessa
+
+    except Exception as e:
+        log_callback(f"[ERRO AO SALVAR NA BASE AUXILIAR]: {str(e)}")
+        raise
+
+
+def salvar_alteracoes_base_auxiliar(remessa, alteracoes, log_callback, fonte_dir):
+    try:
+        novas, removidas = len(alteracoes.novas), len(alteracoes.removidas)
+        total = EdicoesStore.de(fonte_dir).aplicar(remessa, alteracoes, log_callback)
+        log_callback(f"Remessa {remessa} atualizada na base auxiliar: {total} linha(s) "
+                     f"({novas} nova(s), {removidas} removida(s), {total - novas - removidas} alterada(s))")
+        return total
 
     except Exception as e:
         log_callback(f"[ERRO AO SALVAR NA BASE AUXILIAR]: {str(e)}")
@@ -213,57 +975,40 @@ def salvar_em_base_auxiliar(df_remessa, remessa, log_callback, fonte_dir):
 
 
 def carregar_base_auxiliar(fonte_dir):
-    caminho_aux = os.path.join(fonte_dir, "expedicao_edicoes.xlsx")
     try:
-        if os.path.exists(caminho_aux):
-            with pd.ExcelFile(caminho_aux) as xls:
-                if "dado_exp" in xls.sheet_names:
-                    return pd.read_excel(xls, sheet_name="dado_exp")
-        return pd.DataFrame()
+        return EdicoesStore.de(fonte_dir).todos()
     except Exception as e:
         print(f"Erro ao carregar base auxiliar: {e}")
         return pd.DataFrame()
 
-def remover_remessa_base_auxiliar(remessa, fonte_dir, log_callback):
+def carregar_remessa_auxiliar(remessa, fonte_dir):
     try:
-        caminho_aux = os.path.join(fonte_dir, "expedicao_edicoes.xlsx")
-        if not os.path.exists(caminho_aux):
-            return
-
-        with pd.ExcelFile(caminho_aux) as xls:
-            if "dado_exp" in xls.sheet_names:
-                df = pd.read_excel(xls, sheet_name="dado_exp")
-                df = df[df["REMESSA"].astype(str) != str(remessa)]
-
-                with pd.ExcelWriter(caminho_aux, engine="openpyxl") as writer:
-                    df.to_excel(writer, sheet_name="dado_exp", index=False)
+        return EdicoesStore.de(fonte_dir).remessa(remessa)
+    except Exception as e:
+        print(f"Erro ao carregar remessa {remessa} da base auxiliar: {e}")
+        return pd.DataFrame()
 
-                log_callback(f"Remessa {remessa} removida da base auxiliar")
+def remover_remessa_base_auxiliar(remessa, fonte_dir, log_callback):
+    try:
+        if EdicoesStore.de(fonte_dir).remover(remessa, log_callback):
+            log_callback(f"Remessa {remessa} removida da base auxiliar")
     except Exception as e:
         log_callback(f"Erro ao remover remessa da base auxiliar: {e}")
 
 
-def obter_dados_remessa(remessa, df_expedicao, log_callback):
+def obter_dados_remessa(remessa, df_expedicao, log_callback, indice_remessas=None):
+    """`indice_remessas` é o RemessaIndex de df_expedicao, quando já montado com a base."""
     try:
-        caminho_aux = os.path.join(BASE_DIR_DOCS, "expedicao_edicoes.xlsx")
-        if os.path.exists(caminho_aux):
-            df_aux = pd.read_excel(caminho_aux, sheet_name="dado_exp")
-            if "CHAVE_PALETE" not in df_aux.columns and "COD_RASTREABILIDADE" in df_aux.columns:
-                df_aux["CHAVE_PALETE"] = df_aux["COD_RASTREABILIDADE"]
-
-            sr = df_aux['REMESSA'] if 'REMESSA' in df_aux.columns else pd.Series("", index=df_aux.index)
-            mask_aux = _match_remessa_series(sr, remessa)
-            df_filtrado_aux = df_aux.loc[mask_aux].copy()
-            if not df_filtrado_aux.empty:
-                log_callback(f"Remessa {remessa} encontrada na base auxiliar (edicoes)")
-                return df_filtrado_aux
-
-        sr_rem = df_expedicao['REMESSA'] if 'REMESSA' in df_expedicao.columns else pd.Series([], dtype=str, index=df_expedicao.index)
-        mask_ori = _match_remessa_series(sr_rem, remessa)
-        if not isinstance(mask_ori, pd.Series):
-            raise RuntimeError("match_remessa retornou objeto não-Series")
-
-        df_filtrado = df_expedicao.loc[mask_ori].copy()
+        df_filtrado_aux = carregar_remessa_auxiliar(remessa, BASE_DIR_DOCS)
+        if not df_filtrado_aux.empty:
+            log_callback(f"Remessa {remessa} encontrada na base auxiliar (edicoes)")
+            return df_filtrado_aux
+
+        if indice_remessas is None:
+            sr_rem = df_expedicao['REMESSA'] if 'REMESSA' in df_expedicao.columns else pd.Series([], dtype=str, index=df_expedicao.index)
+            indice_remessas = RemessaIndex(sr_rem)
+
+        df_filtrado = df_expedicao.iloc[indice_remessas.posicoes(remessa)].copy()
 
         if not df_filtrado.empty:
             if "CHAVE_PALETE" not in df_filtrado.columns and "COD_RASTREABILIDADE" in df_filtrado.columns:
@@ -395,8 +1140,8 @@ def carregar_base_fisica(base_dir_docs: str, log=print):
         raise FileNotFoundError(f"Arquivo não encontrado: {path}")
 
     try:
-        df_bf  = pd.read_excel(path, sheet_name="BASE FISICA")
-        df_fam = pd.read_excel(path, sheet_name="BASE_FAMILIA")
+        df_bf  = ler_excel_cache(path, "BASE FISICA", log=log)
+        df_fam = ler_excel_cache(path, "BASE_FAMILIA", log=log)
     except Exception as e:
         log(f"[BASE_FISICA][erro] Falha ao ler planilha: {e!r}")
         raise
@@ -437,93 +1182,200 @@ def _to_frac(x) -> float:
     return v/100.0 if v > 1.0 else v
 
 
-def calculo_sobrepeso_fixo(sku, df_base_fisica, df_sku, peso_base_liq, log_callback):
+class SkuCatalog:
+    """
+    Cadastro de SKUs compilado uma vez a partir de `dado_sku`, `BASE FISICA` e
+    `BASE_FAMILIA`. A escolha das colunas (aliases) e a normalização dos códigos
+    acontecem na montagem; as consultas são buscas em dict, com a mesma ordem de
+    precedência das buscas antigas (coluna principal, alternativas, primeira linha).
+    """
+
+    COLS_COD = ["COD_PRODUTO","CODIGO_PRODUTO","CÓDIGO PRODUTO","CÓD_PRODUTO","COD_PROD"]
+    COLS_COD_ALT = ["CODIGO_PRODUTO","CÓDIGO PRODUTO","CÓD_PRODUTO","COD_PROD"]
+    COLS_PESO_BRU = ["QTDE_PESO_BRU","PESO_BRUTO_CAIXA","PESO_BRUTO","PESO_BRU"]
+    COLS_PESO_LIQ = ["QTDE_PESO_LIQ","PESO_LIQ_CAIXA","PESO_LIQ","PESO_LIQUIDO"]
+    COLS_UNIDADE = ["DESC_UNID_MEDID","UNIDADE","UNID_MEDIDA"]
+    COLS_SP_KG = ["SOBRE PESO","SOBREPESO","SOBRE_PESO","SOBRE PESO (KG)","SOBREPESO_KG","SOBRE_PESO_FIXO"]
+    COLS_SP_PERC = ["DIF (%)","DIF%","DIF_PERC","SOBRE PESO (%)","SOBREPESO_%"]
+    COLS_MEDIA = ["MEDIA","MÉDIA"]
+    COLS_PESO_SAP = ["PESO SAP","PESO_SAP","PESO_SAP_KG","PESO SAP (KG)"]
+    ORIGENS_SP = ("dado_sku", "base_fisica")
+
+    def __init__(self, df_sku, df_base_fisica=None, df_base_familia=None):
+        self.col_cod = None
+        self.pesos = None
+        self._pesos = {}
+        if df_sku is not None and not df_sku.empty:
+            self._indexar_pesos(df_sku)
+
+        self._sp = {
+            "dado_sku": self._indexar_sp(df_sku),
+            "base_fisica": self._indexar_sp(df_base_fisica),
+        }
+
+        self.col_cod_familia = None
+        self.col_familia = None
+        self.erro_familia = None
+        self.linhas_familia = 0
+        self._familias = {}
+        if df_base_familia is not None:
+            self._indexar_familias(df_base_familia)
+
+        self.registros = self._montar_registros()
+
+    def _indexar_pesos(self, df_sku):
+        col_cod = _pick_col_flex(df_sku, self.COLS_COD)
+        if not col_cod:
+            return
+        self.col_cod = col_cod
+        col_pbru = _pick_col_flex(df_sku, self.COLS_PESO_BRU)
+        col_pliq = _pick_col_flex(df_sku, self.COLS_PESO_LIQ)
+        col_un = _pick_col_flex(df_sku, self.COLS_UNIDADE)
+        p_bruto = df_sku[col_pbru].map(converter_para_float_seguro) if col_pbru else pd.Series(0.0, index=df_sku.index)
+        p_liq = df_sku[col_pliq].map(converter_para_float_seguro) if col_pliq else pd.Series(0.0, index=df_sku.index)
+        unidade = df_sku[col_un] if col_un else pd.Series(None, index=df_sku.index, dtype=object)
+
+        partes = []
+        for c in [col_cod] + [c for c in self.COLS_COD_ALT if c in df_sku.columns]:
+            partes.append(pd.DataFrame({
+                "sku_norm": df_sku[c].astype(str).str.replace(r"\D", "", regex=True),
+                "p_bruto": p_bruto.astype(float),
+                "p_liq": p_liq.astype(float),
+                "unidade": unidade.astype(object),
+                "coluna": c,
+            }))
+        self.pesos = (pd.concat(partes, ignore_index=True)
+                        .drop_duplicates(subset="sku_norm", keep="first")
+                        .set_index("sku_norm"))
+        self._pesos = dict(zip(
+            self.pesos.index.tolist(),
+            zip(self.pesos["p_bruto"].tolist(), self.pesos["p_liq"].tolist(),
+                self.pesos["unidade"].tolist(), self.pesos["coluna"].tolist()),
+        ))
+
+    def _indexar_sp(self, df):
+        """Primeira linha de cada código → (sp_kg, sp_perc, media, peso_sap); None onde a coluna não existe."""
+        if df is None or df.empty:
+            return {}
+        col_sku = _pick_col_flex(df, self.COLS_COD)
+        if not col_sku:
+            return {}
+        chaves = df[col_sku].astype(str).str.replace(r"\D", "", regex=True)
+        primeiras = (~chaves.duplicated(keep="first")).to_numpy()
+        sub = df.loc[primeiras]
+        n = len(sub)
+
+        col_kg = _pick_col_flex(df, self.COLS_SP_KG)
+        col_perc = _pick_col_flex(df, self.COLS_SP_PERC)
+        col_med = _pick_col_flex(df, self.COLS_MEDIA)
+        col_sap = _pick_col_flex(df, self.COLS_PESO_SAP)
+        sp_kg = sub[col_kg].map(converter_para_float_seguro).tolist() if col_kg else [None] * n
+        sp_perc = sub[col_perc].map(_to_frac).tolist() if col_perc else [None] * n
+        if col_med and col_sap:
+            media = sub[col_med].map(converter_para_float_seguro).tolist()
+            peso_sap = sub[col_sap].map(converter_para_float_seguro).tolist()
+        else:
+            media = peso_sap = [None] * n
+        return dict(zip(chaves[primeiras].tolist(), zip(sp_kg, sp_perc, media, peso_sap)))
+
+    def _indexar_familias(self, df_base_familia):
+        try:
+            col_cod, col_fam = _pick_family_column(df_base_familia)
+        except Exception as e:
+            self.erro_familia = e
+            return
+        self.col_cod_familia, self.col_familia = col_cod, col_fam
+        cods = df_base_familia[col_cod].map(_norm_digits).tolist()
+        fams = df_base_familia[col_fam].astype(str).str.upper().str.strip().tolist()
+        for cod, fam in zip(cods, fams):
+            if cod == "":
+                continue
+            self.linhas_familia += 1
+            if cod not in self._familias:
+                self._familias[cod] = fam
+
+    def _montar_registros(self):
+        vazio = {"peso_bruto": None, "peso_liq": None, "unidade": None, "sp_kg": None, "sp_perc": None,
+                 "media": None, "peso_sap": None, "origem_sp": None, "familia": None}
+        registros = {}
+        for chave, (pb, pl, un, _col) in self._pesos.items():
+            registros[chave] = dict(vazio, peso_bruto=pb, peso_liq=pl, unidade=un)
+        for origem in self.ORIGENS_SP:
+            for chave, (kg, perc, med, sap) in self._sp[origem].items():
+                if kg is None and perc is None and med is None:
+                    continue
+                reg = registros.setdefault(chave, dict(vazio))
+                if reg["origem_sp"] is None:
+                    reg.update(sp_kg=kg, sp_perc=perc, media=med, peso_sap=sap, origem_sp=origem)
+        for chave, reg in registros.items():
+            reg["familia"] = self._familias.get(chave)
+        return registros
+
+    def __len__(self):
+        return len(self.registros)
+
+    def registro(self, sku):
+        return self.registros.get(_norm_sku(sku))
+
+    def pesos_unitarios(self, sku):
+        """(peso_bruto, peso_liq, unidade, coluna_do_codigo) ou None se o SKU não está em dado_sku."""
+        return self._pesos.get(_norm_sku(sku))
+
+    def sobrepeso_cadastrado(self, sku):
+        """Para cada origem, na ordem de consulta: (origem, valores ou None se o SKU não consta)."""
+        chave = _norm_sku(sku)
+        return [(origem, self._sp[origem].get(chave)) for origem in self.ORIGENS_SP]
+
+    def familia(self, sku):
+        return self._familias.get(_norm_digits(sku))
+
+    @property
+    def familias(self):
+        return self._familias
+
+
+def calculo_sobrepeso_fixo(sku, df_base_fisica, df_sku, peso_base_liq):
+    """`df_sku` pode ser o DataFrame ou um SkuCatalog já montado (aí df_base_fisica é ignorado)."""
     try:
-        sku_norm = _norm_sku(sku)
         pb = converter_para_float_seguro(peso_base_liq) or 0.0
+        catalogo = df_sku if isinstance(df_sku, SkuCatalog) else SkuCatalog(df_sku, df_base_fisica)
 
-        cols_sku = ["COD_PRODUTO","CODIGO_PRODUTO","CÓDIGO PRODUTO","CÓD_PRODUTO","COD_PROD"]
-        cols_sp_kg = ["SOBRE PESO","SOBREPESO","SOBRE_PESO","SOBRE PESO (KG)","SOBREPESO_KG","SOBRE_PESO_FIXO"]
-        cols_sp_perc = ["DIF (%)","DIF%","DIF_PERC","SOBRE PESO (%)","SOBREPESO_%"]
-        cols_media = ["MEDIA","MÉDIA"]
-        cols_peso_sap = ["PESO SAP","PESO_SAP","PESO_SAP_KG","PESO SAP (KG)"]
-
-        def _match_df(df):
-            if df is None or df.empty:
-                return None
-            col_sku = _pick_col_flex(df, cols_sku)
-            if not col_sku:
-                return None
-            serie_cod_norm = df[col_sku].astype(str).str.replace(r"\D", "", regex=True)
-            hit = df.loc[serie_cod_norm == sku_norm]
-            return hit if not hit.empty else None
-
-        def _read_sp_kg(row):
-            col = _pick_col_flex(row, cols_sp_kg)
-            if not col:
-                return None
-            v = converter_para_float_seguro(row.iloc[0][col])
-            return v if v is not None else None  
-
-        def _read_sp_perc(row):
-            col = _pick_col_flex(row, cols_sp_perc)
-            if not col:
-                return None
-            raw = row.iloc[0][col]
-            frac = _to_frac(raw) 
-            return frac if frac is not None else None
-
-        def _read_media_peso_sap(row):
-            cmed = _pick_col_flex(row, cols_media)
-            csap = _pick_col_flex(row, cols_peso_sap)
-            if not (cmed and csap):
-                return None, None
-            med = converter_para_float_seguro(row.iloc[0][cmed])
-            sap = converter_para_float_seguro(row.iloc[0][csap])
-            return med, sap
-
-        for origem, df in (("dado_sku", df_sku), ("base_fisica", df_base_fisica)):
-            hit = _match_df(df)
-            log_callback(f"[fixo/{origem}] match={'1' if hit is not None else '0'}")
-            if hit is None:
+        for origem, valores in catalogo.sobrepeso_cadastrado(sku):
+            logger.debug("[fixo/%s] match=%d", origem, valores is not None)
+            if valores is None:
                 continue
-            spkg = _read_sp_kg(hit)
+            spkg, p, med, sap = valores
             if spkg is not None:
                 perc = 0.0
-                p = _read_sp_perc(hit)
                 if p is not None:
                     perc = float(p)
                 elif pb and pb > 0:
-                    med, sap = _read_media_peso_sap(hit)
                     base_ref = sap if sap and sap > 0 else pb
                     perc = float(max(0.0, (spkg / base_ref))) if base_ref else 0.0
-                log_callback(f"[fixo/{origem}] SKU {sku} → SOBRE PESO (kg)={spkg:.3f} | perc≈{perc:.4%}")
+                logger.debug("[fixo/%s] SKU %s → SOBRE PESO (kg)=%.3f | perc≈%.4f%%", origem, sku, spkg, perc * 100)
                 return float(perc), float(spkg)
 
-            p = _read_sp_perc(hit)
             if p is not None:
                 perc = float(p)
                 ajuste = float((pb or 0.0) * perc)
-                med, sap = _read_media_peso_sap(hit)
                 if med is not None and sap is not None:
                     ajuste = max(0.0, float(med - sap))
                     if sap and sap > 0:
                         perc = ajuste / float(sap)
-                log_callback(f"[fixo/{origem}] SKU {sku} → perc={perc:.4%} | ajuste≈{ajuste:.3f} kg (pb={pb:.3f})")
+                logger.debug("[fixo/%s] SKU %s → perc=%.4f%% | ajuste≈%.3f kg (pb=%.3f)", origem, sku, perc * 100, ajuste, pb)
                 return float(perc), float(ajuste)
 
-            med, sap = _read_media_peso_sap(hit)
             if med is not None and sap is not None:
                 ajuste = max(0.0, float(med - sap))
                 perc = (ajuste / float(sap)) if sap and sap > 0 else 0.0
-                log_callback(f"[fixo/{origem}] SKU {sku} → med={med} sap={sap} -> ajuste={ajuste:.3f} kg | perc={perc:.4%}")
+                logger.debug("[fixo/%s] SKU %s → med=%s sap=%s -> ajuste=%.3f kg | perc=%.4f%%", origem, sku, med, sap, ajuste, perc * 100)
                 return float(perc), float(ajuste)
 
-        log_callback(f"[fixo] SKU {sku} sem cadastro (dado_sku/base_fisica).")
+        logger.debug("[fixo] SKU %s sem cadastro (dado_sku/base_fisica).", sku)
         return 0.0, 0.0
 
     except Exception as e:
-        log_callback(f"[fixo][erro] SKU {sku}: {type(e).__name__}: {e}")
+        logger.error("[fixo][erro] SKU %s: %s: %s", sku, type(e).__name__, e)
         return 0.0, 0.0
 
 def _norm_str(x):
@@ -560,152 +1412,388 @@ def _coerce_dt(dt):
         return pd.to_datetime(dt, dayfirst=True, errors="coerce")
     except Exception:
         return pd.NaT
-def processar_sobrepeso(chave_pallet, sku, peso_base_liq, 
-                        df_sap, df_sobrepeso_real, df_base_fisica, df_sku, log_callback):
+
+def _janela_producao(dt_prod, h_ini, h_fim):
+    """Janela [dt_ini, dt_fim] do pallet no dia de produção, entre as horas de criação e modificação."""
+    if h_ini is None and h_fim is not None:
+        h_ini = h_fim
+    if h_fim is None and h_ini is not None:
+        h_fim = h_ini
+    if h_ini is None: h_ini = 0
+    if h_fim is None: h_fim = h_ini
+
+    if pd.isna(dt_prod):
+        return pd.NaT, pd.NaT, h_ini, h_fim
+    dt_ini = pd.Timestamp(dt_prod.date()) + pd.Timedelta(hours=int(h_ini))
+    dt_fim = pd.Timestamp(dt_prod.date()) + pd.Timedelta(hours=int(h_fim), minutes=59, seconds=59)
+    return dt_ini, dt_fim, h_ini, h_fim
+
+class PalletIndex:
+    """
+    Índice da base SAP por chave de pallet normalizada. Montado uma vez por carga
+    do SAP: a busca por chave vira um acesso a dict e o custo por item deixa de
+    depender do tamanho da base.
+    """
+
+    COLS_CHAVE = ["Chave Pallet", "CHAVE_PALETE", "CHAVE_PALLET", "CHAVE_PALETE "]
+    COLS_LOTE = ["Lote", "LOTE", "Lote de produção", "LOTE_PROD"]
+    COLS_DATA = ["Data de produção", "DATA_PRODUCAO", "Data de Fabricação", "DATA FABRICACAO"]
+    COLS_HORA_INI = ["Hora de criação", "HORA_CRIACAO", "Hora Criação"]
+    COLS_HORA_FIM = ["Hora de modificação", "HORA_MODIFICACAO", "Hora Modificação"]
+    TAM_PREFIXO = 6
+
+    def __init__(self, df_sap: pd.DataFrame):
+        self.df_sap = df_sap
+        self.col_chave = next((c for c in self.COLS_CHAVE if c in df_sap.columns), None)
+        self.cols_lote = [c for c in self.COLS_LOTE if c in df_sap.columns]
+        self.cols_data = [c for c in self.COLS_DATA if c in df_sap.columns]
+        self.cols_hora_ini = [c for c in self.COLS_HORA_INI if c in df_sap.columns]
+        self.cols_hora_fim = [c for c in self.COLS_HORA_FIM if c in df_sap.columns]
+
+        self._posicoes = {}
+        self._prefixos = {}
+        self._registros = {}
+        if self.col_chave is None:
+            return
+
+        brutas = df_sap[self.col_chave]
+        normalizadas = brutas.astype(str).str.replace(r"\s+", "", regex=True)
+
+        # primeira ocorrência de cada chave, como o .iloc[0] da busca antiga
+        primeiras = ~normalizadas.duplicated(keep="first").to_numpy()
+        self._posicoes = dict(zip(normalizadas.to_numpy()[primeiras].tolist(),
+                                  np.flatnonzero(primeiras).tolist()))
+
+        # até 2 chaves por prefixo, para as sugestões quando a chave não existe
+        prefixos = normalizadas.str[:self.TAM_PREFIXO]
+        amostra = pd.DataFrame({"prefixo": prefixos.to_numpy(), "chave": brutas.to_numpy()})
+        for prefixo, chave in amostra.groupby("prefixo", sort=False).head(2).itertuples(index=False):
+            self._prefixos.setdefault(prefixo, []).append(chave)
+
+    def __len__(self):
+        return len(self._posicoes)
+
+    def __contains__(self, chave_norm):
+        return chave_norm in self._posicoes
+
+    def recorte(self, chaves_norm):
+        """
+        PalletIndex só com as chaves pedidas (a primeira ocorrência de cada) e as
+        colunas que `localizar` lê, para mandar a outros processos. As sugestões do
+        recorte só conhecem essas chaves.
+        """
+        posicoes = sorted({self._posicoes[c] for c in chaves_norm if c in self._posicoes})
+        if self.col_chave is None:
+            return PalletIndex(self.df_sap.iloc[0:0])
+        colunas = list(dict.fromkeys([self.col_chave] + self.cols_lote + self.cols_data
+                                     + self.cols_hora_ini + self.cols_hora_fim))
+        return PalletIndex(self.df_sap.iloc[posicoes][colunas].reset_index(drop=True))
+
+    def sugestoes(self, chave_norm, limite=2):
+        """Chaves da base que começam com os mesmos 6 primeiros caracteres."""
+        return list(self._prefixos.get(chave_norm[:self.TAM_PREFIXO], []))[:limite]
+
+    def localizar(self, chave_norm):
+        """
+        Devolve um dict com lote, linha_coluna, data de produção e horas de
+        criação/modificação do pallet, ou None se a chave não está no SAP.
+        """
+        pos = self._posicoes.get(chave_norm)
+        if pos is None:
+            return None
+        registro = self._registros.get(pos)
+        if registro is None:
+            registro = self._montar_registro(self.df_sap.iloc[pos])
+            self._registros[pos] = registro
+        return registro
+
+    def tabela(self, chaves_norm):
+        """
+        Resolve um lote de chaves de uma vez: DataFrame alinhado à entrada com
+        encontrado, linha_coluna, dt_ini e dt_fim. Cada chave distinta é
+        resolvida uma única vez.
+        """
+        chaves = pd.Series(chaves_norm, dtype=object).reset_index(drop=True)
+        unicas = pd.unique(chaves)
+        linhas = []
+        for chave in unicas:
+            registro = self.localizar(chave)
+            if registro is None:
+                linhas.append((chave, False, "", pd.NaT, pd.NaT))
+                continue
+            dt_ini, dt_fim, _, _ = _janela_producao(registro["data_producao"], registro["h_ini"], registro["h_fim"])
+            linhas.append((chave, True, registro["linha_coluna"], dt_ini, dt_fim))
+        resolvidas = pd.DataFrame(linhas, columns=["chave_norm", "encontrado", "linha_coluna", "dt_ini", "dt_fim"])
+        return chaves.to_frame("chave_norm").merge(resolvidas, on="chave_norm", how="left")
+
+    def _montar_registro(self, pallet_info):
+        cand_lote = None
+        for c in self.cols_lote:
+            cand_lote = pallet_info.get(c)
+            if pd.notna(cand_lote):
+                break
+        lote = _norm_str(cand_lote)
+        linha_coluna = "L" + lote[-3:] if lote else ""
+        if linha_coluna in ["LB06", "LB07"]:
+            linha_coluna = "LB06/07"
+
+        cand_data = None
+        for c in self.cols_data:
+            cand_data = pallet_info.get(c)
+            if pd.notna(cand_data):
+                break
+
+        h_ini = None
+        h_fim = None
+        for c in self.cols_hora_ini:
+            h_ini = _safe_hour(pallet_info.get(c))
+            if h_ini is not None:
+                break
+        for c in self.cols_hora_fim:
+            h_fim = _safe_hour(pallet_info.get(c))
+            if h_fim is not None:
+                break
+
+        return {
+            "lote": lote,
+            "linha_coluna": linha_coluna,
+            "data_bruta": cand_data,
+            "data_producao": _coerce_dt(cand_data),
+            "h_ini": h_ini,
+            "h_fim": h_fim,
+        }
+
+class SobrepesoIndex:
+    """
+    Aba SOBREPESO carregada uma vez em forma colunar: timestamps int64 ordenados
+    e, por coluna de linha (LB06/07, L001...), somas e contagens acumuladas.
+    A média de uma janela [dt_ini, dt_fim] sai de dois searchsorted, em O(log n).
+    """
+
+    def __init__(self, df_sobrepeso_real: pd.DataFrame):
+        self.colunas = list(df_sobrepeso_real.columns)
+        self.tem_datahora = "DataHora" in df_sobrepeso_real.columns
+        self._ts = np.empty(0, dtype="int64")
+        self._somas = {}
+        self._contagens = {}
+        self.dt_min = pd.NaT
+        self.dt_max = pd.NaT
+        if not self.tem_datahora:
+            return
+
+        datahora = df_sobrepeso_real["DataHora"]
+        if not pd.api.types.is_datetime64_any_dtype(datahora):
+            datahora = pd.to_datetime(datahora, dayfirst=True, errors="coerce")
+            logger.debug("[real] Convertemos 'DataHora' para datetime.")
+
+        validos = datahora.notna().to_numpy()
+        ts = datahora.to_numpy(dtype="datetime64[ns]")[validos].astype("int64")
+        ordem = np.argsort(ts, kind="stable")
+        self._ts = ts[ordem]
+        if len(self._ts):
+            self.dt_min = pd.Timestamp(self._ts[0])
+            self.dt_max = pd.Timestamp(self._ts[-1])
+
+        for col in self.colunas:
+            if col == "DataHora":
+                continue
+            vals = pd.to_numeric(df_sobrepeso_real[col], errors="coerce").to_numpy(dtype="float64")[validos][ordem]
+            ok = ~np.isnan(vals)
+            self._somas[col] = np.concatenate(([0.0], np.cumsum(np.where(ok, vals, 0.0))))
+            self._contagens[col] = np.concatenate(([0], np.cumsum(ok, dtype="int64")))
+
+    @classmethod
+    def _vazio(cls):
+        return cls(pd.DataFrame())
+
+    def gravar_feather(self, destino_base):
+        """
+        Grava os vetores (timestamps, somas e contagens acumuladas) em Feather sem
+        compressão, que `ler_feather` mapeia em memória sem copiar.
+        """
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        linhas = list(self._somas)
+        meta = {"colunas": json.dumps(self.colunas, default=str), "linhas": json.dumps(linhas, default=str),
+                "tem_datahora": json.dumps(self.tem_datahora)}
+        acumulados = pa.table({f"{tipo}_{i}": vetor for i, c in enumerate(linhas)
+                               for tipo, vetor in (("soma", self._somas[c]), ("contagem", self._contagens[c]))})
+        feather.write_feather(acumulados.replace_schema_metadata(meta), destino_base + ".acumulados.feather",
+                              compression="uncompressed")
+        feather.write_feather(pa.table({"ts": self._ts}), destino_base + ".ts.feather", compression="uncompressed")
+
+    @classmethod
+    def ler_feather(cls, destino_base):
+        import pyarrow.feather as feather
+
+        def vetor(coluna):
+            if coluna.num_chunks == 1:
+                return coluna.chunk(0).to_numpy(zero_copy_only=True)
+            return coluna.to_numpy()
+
+        acumulados = feather.read_table(destino_base + ".acumulados.feather", memory_map=True)
+        meta = acumulados.schema.metadata
+        indice = cls._vazio()
+        indice.colunas = json.loads(meta[b"colunas"])
+        indice.tem_datahora = json.loads(meta[b"tem_datahora"])
+        for i, c in enumerate(json.loads(meta[b"linhas"])):
+            indice._somas[c] = vetor(acumulados.column(f"soma_{i}"))
+            indice._contagens[c] = vetor(acumulados.column(f"contagem_{i}"))
+        indice._ts = vetor(feather.read_table(destino_base + ".ts.feather", memory_map=True).column("ts"))
+        if len(indice._ts):
+            indice.dt_min = pd.Timestamp(int(indice._ts[0]))
+            indice.dt_max = pd.Timestamp(int(indice._ts[-1]))
+        return indice
+
+    def __contains__(self, linha_coluna):
+        return linha_coluna in self._somas
+
+    def _limites(self, dt_ini, dt_fim):
+        i = int(np.searchsorted(self._ts, pd.Timestamp(dt_ini).value, side="left"))
+        j = int(np.searchsorted(self._ts, pd.Timestamp(dt_fim).value, side="right"))
+        return i, max(i, j)
+
+    def linhas_na_janela(self, dt_ini, dt_fim):
+        if pd.isna(dt_ini) or pd.isna(dt_fim):
+            return 0
+        i, j = self._limites(dt_ini, dt_fim)
+        return j - i
+
+    def media(self, linha_coluna, dt_ini, dt_fim):
+        """
+        Média bruta (em %) da coluna na janela, com a mesma regra do filtro antigo:
+        0.0 para janela vazia e NaN quando a janela só tem valores não numéricos.
+        """
+        return float(self.medias([linha_coluna], [dt_ini], [dt_fim])[0])
+
+    def medias(self, linhas_coluna, dts_ini, dts_fim):
+        """Versão vetorizada de `media`; linhas sem coluna na base retornam NaN."""
+        linhas_coluna = np.asarray(linhas_coluna, dtype=object)
+        ini = pd.to_datetime(pd.Series(dts_ini, dtype=object)).to_numpy(dtype="datetime64[ns]")
+        fim = pd.to_datetime(pd.Series(dts_fim, dtype=object)).to_numpy(dtype="datetime64[ns]")
+        janela_ok = ~(np.isnat(ini) | np.isnat(fim))
+
+        resultado = np.full(len(linhas_coluna), np.nan)
+        for linha_coluna in pd.unique(linhas_coluna):
+            sel = linhas_coluna == linha_coluna
+            if linha_coluna not in self._somas:
+                continue
+            resultado[sel & ~janela_ok] = 0.0
+            sel &= janela_ok
+            if not sel.any():
+                continue
+            i = np.searchsorted(self._ts, ini[sel].astype("int64"), side="left")
+            j = np.maximum(i, np.searchsorted(self._ts, fim[sel].astype("int64"), side="right"))
+            somas = self._somas[linha_coluna]
+            contagens = self._contagens[linha_coluna]
+            n = contagens[j] - contagens[i]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                media = (somas[j] - somas[i]) / n
+            resultado[sel] = np.where(j == i, 0.0, np.where(n == 0, np.nan, media))
+        return resultado
+
+def processar_sobrepeso(chave_pallet, sku, peso_base_liq,
+                        df_sap, df_sobrepeso_real, df_base_fisica, df_sku):
+    """
+    `df_sap` e `df_sobrepeso_real` podem ser os DataFrames ou um PalletIndex /
+    SobrepesoIndex já montados, e `df_sku` um SkuCatalog; quem processa vários
+    itens deve passar os índices para não reindexar as bases a cada item.
+    """
     peso_base_liq = float(peso_base_liq or 0)
     sp = 0.0
     origem_sp = "não encontrado"
     ajuste_sp = 0.0
 
     chave_norm = _norm_chave(chave_pallet)
-    log_callback(f"[item] sku={sku} | chave={chave_norm} | peso_liq≈{peso_base_liq:.2f} kg")
+    logger.debug("[item] sku=%s | chave=%s | peso_liq≈%.2f kg", sku, chave_norm, peso_base_liq)
 
     try:
-        sap_col = None
-        for c in ["Chave Pallet", "CHAVE_PALETE", "CHAVE_PALLET", "CHAVE_PALETE "]:
-            if c in df_sap.columns:
-                sap_col = c
-                break
+        pallets = df_sap if isinstance(df_sap, PalletIndex) else PalletIndex(df_sap)
+        sobrepeso = (df_sobrepeso_real if isinstance(df_sobrepeso_real, SobrepesoIndex)
+                     else SobrepesoIndex(df_sobrepeso_real))
+        sap_col = pallets.col_chave
         if sap_col is None:
-            log_callback("[real] df_sap sem coluna de chave ('Chave Pallet' / 'CHAVE_PALETE').")
+            logger.warning("[real] df_sap sem coluna de chave ('Chave Pallet' / 'CHAVE_PALETE').")
         else:
-            col_norm = df_sap[sap_col].astype(str).str.replace(r"\s+", "", regex=True)
-            mask = col_norm.eq(chave_norm)
+            registro = pallets.localizar(chave_norm)
 
-            found = int(mask.sum())
-            log_callback(f"[real] Busca chave no SAP: col='{sap_col}' | encontrados={found}")
+            found = 0 if registro is None else 1
+            logger.debug("[real] Busca chave no SAP: col='%s' | encontrados=%d", sap_col, found)
             if found == 0:
-                sug = df_sap.loc[col_norm.str.contains(chave_norm[:6], na=False)].head(2).get(sap_col, [])
-                log_callback(f"[real] Nenhuma linha com a chave exata. Sugestões (mesmos 6 primeiros): {list(sug)}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("[real] Nenhuma linha com a chave exata. Sugestões (mesmos 6 primeiros): %s",
+                                 list(pallets.sugestoes(chave_norm)))
             else:
-                pallet_info = df_sap.loc[mask].iloc[0]
-
-                cand_lote = None
-                for c in ["Lote", "LOTE", "Lote de produção", "LOTE_PROD"]:
-                    if c in df_sap.columns:
-                        cand_lote = pallet_info.get(c)
-                        if pd.notna(cand_lote):
-                            break
-                lote = _norm_str(cand_lote)
-                linha_coluna = "L" + lote[-3:] if lote else ""
-                if linha_coluna in ["LB06", "LB07"]:
-                    linha_coluna = "LB06/07"
-                log_callback(f"[real] Lote='{lote}' → linha_coluna='{linha_coluna}'")
-
-                cand_data = None
-                for c in ["Data de produção", "DATA_PRODUCAO", "Data de Fabricação", "DATA FABRICACAO"]:
-                    if c in df_sap.columns:
-                        cand_data = pallet_info.get(c)
-                        if pd.notna(cand_data):
-                            break
-                dt_prod = _coerce_dt(cand_data)
-                h_ini = None
-                h_fim = None
-                for c in ["Hora de criação", "HORA_CRIACAO", "Hora Criação"]:
-                    if c in df_sap.columns:
-                        h_ini = _safe_hour(pallet_info.get(c))
-                        if h_ini is not None:
-                            break
-                for c in ["Hora de modificação", "HORA_MODIFICACAO", "Hora Modificação"]:
-                    if c in df_sap.columns:
-                        h_fim = _safe_hour(pallet_info.get(c))
-                        if h_fim is not None:
-                            break
-                if h_ini is None and h_fim is not None:
-                    h_ini = h_fim
-                if h_fim is None and h_ini is not None:
-                    h_fim = h_ini
-                if dt_prod is pd.NaT:
-                    log_callback(f"[real][warn] Data de produção inválida para a chave. Valor bruto='{cand_data}'")
-                if h_ini is None: h_ini = 0
-                if h_fim is None: h_fim = h_ini
+                lote = registro["lote"]
+                linha_coluna = registro["linha_coluna"]
+                logger.debug("[real] Lote='%s' → linha_coluna='%s'", lote, linha_coluna)
 
-                if pd.isna(dt_prod):
-                    dt_ini = pd.NaT
-                    dt_fim = pd.NaT
-                else:
-                    dt_ini = pd.Timestamp(dt_prod.date()) + pd.Timedelta(hours=int(h_ini))
-                    dt_fim = pd.Timestamp(dt_prod.date()) + pd.Timedelta(hours=int(h_fim), minutes=59, seconds=59)
+                cand_data = registro["data_bruta"]
+                dt_prod = registro["data_producao"]
+                if dt_prod is pd.NaT:
+                    logger.warning("[real][warn] Data de produção inválida para a chave %s. Valor bruto='%s'", chave_norm, cand_data)
+                dt_ini, dt_fim, h_ini, h_fim = _janela_producao(dt_prod, registro["h_ini"], registro["h_fim"])
 
-                log_callback(f"[real] janela: dt_ini='{dt_ini}' dt_fim='{dt_fim}' (h_ini={h_ini}, h_fim={h_fim})")
+                logger.debug("[real] janela: dt_ini='%s' dt_fim='%s' (h_ini=%s, h_fim=%s)", dt_ini, dt_fim, h_ini, h_fim)
 
-                if "DataHora" not in df_sobrepeso_real.columns:
-                    log_callback("[real][erro] df_sobrepeso_real não possui coluna 'DataHora'.")
+                if not sobrepeso.tem_datahora:
+                    logger.error("[real][erro] df_sobrepeso_real não possui coluna 'DataHora'.")
                 elif not linha_coluna:
-                    log_callback("[real][erro] Não foi possível derivar 'linha_coluna' a partir do lote.")
+                    logger.warning("[real][erro] Não foi possível derivar 'linha_coluna' a partir do lote '%s'.", lote)
                 else:
-                    if not pd.api.types.is_datetime64_any_dtype(df_sobrepeso_real["DataHora"]):
-                        try:
-                            df_sobrepeso_real = df_sobrepeso_real.copy()
-                            df_sobrepeso_real["DataHora"] = pd.to_datetime(
-                                df_sobrepeso_real["DataHora"], dayfirst=True, errors="coerce"
-                            )
-                            log_callback("[real] Convertemos 'DataHora' para datetime.")
-                        except Exception as e:
-                            log_callback(f"[real][erro] Falha ao converter 'DataHora': {e}")
-
                     if pd.isna(dt_ini) or pd.isna(dt_fim):
-                        df_sp_filtro = df_sobrepeso_real.iloc[0:0] 
-                        log_callback("[real][warn] dt_ini/dt_fim inválidos → filtro vazio.")
-                    else:
-                        df_sp_filtro = df_sobrepeso_real[
-                            (df_sobrepeso_real["DataHora"] >= dt_ini) &
-                            (df_sobrepeso_real["DataHora"] <= dt_fim)
-                        ]
+                        logger.warning("[real][warn] dt_ini/dt_fim inválidos → filtro vazio.")
 
-                    log_callback(f"[real] linhas na janela: {len(df_sp_filtro)} "
-                                 f"(DataHora min={df_sobrepeso_real['DataHora'].min()}, max={df_sobrepeso_real['DataHora'].max()})")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("[real] linhas na janela: %d (DataHora min=%s, max=%s)",
+                                     sobrepeso.linhas_na_janela(dt_ini, dt_fim), sobrepeso.dt_min, sobrepeso.dt_max)
 
-                    col_ok = linha_coluna in df_sp_filtro.columns
+                    col_ok = linha_coluna in sobrepeso
                     if not col_ok:
-                        log_callback(f"[real][erro] Coluna '{linha_coluna}' NÃO existe em df_sobrepeso_real. "
-                                     f"Cols disp: {list(df_sp_filtro.columns)}")
+                        logger.warning("[real][erro] Coluna '%s' NÃO existe em df_sobrepeso_real. Cols disp: %s",
+                                       linha_coluna, sobrepeso.colunas)
                     else:
-                        sp_vals = pd.to_numeric(df_sp_filtro[linha_coluna], errors="coerce")
-                        media_raw = float(sp_vals.mean()) if len(sp_vals) else 0.0
+                        media_raw = sobrepeso.media(linha_coluna, dt_ini, dt_fim)
                         media_sp = media_raw / 100.0
 
-                        log_callback(f"[real] média({linha_coluna}) bruta={media_raw:.6f} → usada={media_sp:.6f}")
+                        logger.debug("[real] média(%s) bruta=%.6f → usada=%.6f", linha_coluna, media_raw, media_sp)
 
                         if media_sp > 0 and peso_base_liq > 0:
                             sp = media_sp
                             origem_sp = "real"
                             ajuste_sp = peso_base_liq * sp
-                            log_callback(f"[real][OK] sp={sp:.4f} ajuste≈{ajuste_sp:.2f} kg")
+                            logger.debug("[real][OK] sp=%.4f ajuste≈%.2f kg", sp, ajuste_sp)
                         else:
-                            log_callback("[real] média<=0 ou peso_base_liq<=0 → fallback fixo")
+                            logger.debug("[real] média<=0 ou peso_base_liq<=0 → fallback fixo")
 
     except Exception as e:
-        log_callback(f"[real][exceção] sku={sku} chave={chave_norm} -> {e}")
+        logger.error("[real][exceção] sku=%s chave=%s -> %s", sku, chave_norm, e)
 
     if sp == 0:
-        sp_frac, ajuste_fixo_kg = calculo_sobrepeso_fixo(sku, df_base_fisica, df_sku, peso_base_liq, log_callback)
+        return _sobrepeso_fixo_adotado(sku, peso_base_liq, df_base_fisica, df_sku)
+
+    return float(sp), origem_sp, float(ajuste_sp)
 
-        if (sp_frac is None or sp_frac == 0) and ajuste_fixo_kg and peso_base_liq > 0:
-            sp_frac = float(ajuste_fixo_kg) / float(peso_base_liq)
+def _sobrepeso_fixo_adotado(sku, peso_base_liq, df_base_fisica, df_sku):
+    """Fallback do sobrepeso real: cadastro fixo do SKU → (sp, origem, ajuste_kg)."""
+    sp, origem_sp, ajuste_sp = 0.0, "não encontrado", 0.0
+    sp_frac, ajuste_fixo_kg = calculo_sobrepeso_fixo(sku, df_base_fisica, df_sku, peso_base_liq)
 
-        if (sp_frac or 0) > 0 or (ajuste_fixo_kg or 0) > 0:
-            sp = float(sp_frac or 0.0)
-            origem_sp = "fixo"
-            ajuste_sp = float(ajuste_fixo_kg or 0.0)
-            if sp == 0 and peso_base_liq > 0:
-                sp = ajuste_sp / float(peso_base_liq)
-            if ajuste_sp == 0 and peso_base_liq > 0 and sp > 0:
-                ajuste_sp = float(peso_base_liq) * float(sp)
+    if (sp_frac is None or sp_frac == 0) and ajuste_fixo_kg and peso_base_liq > 0:
+        sp_frac = float(ajuste_fixo_kg) / float(peso_base_liq)
 
-            log_callback(f"[fixo] adotado sp={sp:.4f} ajuste≈{ajuste_sp:.2f} kg")
-        else:
-            log_callback("[sp] não encontrado (real/fixo).")
+    if (sp_frac or 0) > 0 or (ajuste_fixo_kg or 0) > 0:
+        sp = float(sp_frac or 0.0)
+        origem_sp = "fixo"
+        ajuste_sp = float(ajuste_fixo_kg or 0.0)
+        if sp == 0 and peso_base_liq > 0:
+            sp = ajuste_sp / float(peso_base_liq)
+        if ajuste_sp == 0 and peso_base_liq > 0 and sp > 0:
+            ajuste_sp = float(peso_base_liq) * float(sp)
+
+        logger.debug("[fixo] adotado sp=%.4f ajuste≈%.2f kg", sp, ajuste_sp)
+    else:
+        logger.debug("[sp] %s não encontrado (real/fixo).", sku)
 
     if sp <= 0 and origem_sp != "fixo":
         sp, origem_sp, ajuste_sp = 0.0, "não encontrado", 0.0
@@ -721,7 +1809,6 @@ def calcular_peso_final(
     df_sap,
     df_sobrepeso_real,
     df_base_fisica,
-    log_callback,
     skus_nao_mapeados=None,
 ):
     if skus_nao_mapeados is None:
@@ -733,13 +1820,18 @@ def calcular_peso_final(
     try:
         remessa_num = int(remessa_num)
     except ValueError:
-        log_callback("Remessa inválida.")
+        logger.error("Remessa inválida: %r", remessa_num)
         return None
 
     df_remessa = df_remessa.copy()
     df_remessa["QUANTIDADE"] = df_remessa["QUANTIDADE"].apply(converter_para_float_seguro)
     df_remessa = df_remessa.drop_duplicates(subset=["ID","ITEM", "QUANTIDADE", "CHAVE_PALETE"], keep="last")
-    log_callback(f"[remessa] {remessa_num} | linhas após dedup: {len(df_remessa)}")
+    logger.info("[remessa] %s | linhas após dedup: %d", remessa_num, len(df_remessa))
+
+    pallets = df_sap if isinstance(df_sap, PalletIndex) else PalletIndex(df_sap)
+    sobrepeso = (df_sobrepeso_real if isinstance(df_sobrepeso_real, SobrepesoIndex)
+                 else SobrepesoIndex(df_sobrepeso_real))
+    catalogo = df_sku if isinstance(df_sku, SkuCatalog) else SkuCatalog(df_sku, df_base_fisica)
 
     peso_base_total_bruto = 0.0
     peso_base_total_liq = 0.0
@@ -752,66 +1844,41 @@ def calcular_peso_final(
         chave = str(row["CHAVE_PALETE"]).strip()
 
         if not sku or qtd <= 0:
-            log_callback(f"[linha {i}] ignorada (sku vazio ou qtd<=0): sku='{sku}' qtd={qtd}")
+            logger.debug("[linha %d] ignorada (sku vazio ou qtd<=0): sku='%s' qtd=%s", i, sku, qtd)
             continue
 
         sku_norm = _norm_sku(str(sku))
-        log_callback(f"[fixo][procura] SKU alvo: {sku} (norm={sku_norm})")
-        col_cod = _pick_col_flex(
-            df_sku,
-            ["COD_PRODUTO","CODIGO_PRODUTO","CÓDIGO PRODUTO","CÓD_PRODUTO","COD_PROD"]
-        )
-        if not col_cod:
-            log_callback(f"[linha {i}] Coluna de código de produto não encontrada em df_sku.")
+        logger.debug("[fixo][procura] SKU alvo: %s (norm=%s)", sku, sku_norm)
+        if not catalogo.col_cod:
+            logger.error("[linha %d] Coluna de código de produto não encontrada em df_sku.", i)
             continue
+
+        pesos_sku = catalogo.pesos_unitarios(sku_norm)
+        if pesos_sku is None:
+            skus_nao_mapeados.add(str(sku))
+            logger.warning("[linha %d] WARN: SKU '%s' não encontrado em df_sku. Assumindo pesos 0.", i, sku)
+            p_bruto = p_liq = 0.0
         else:
-            serie_cod_norm = df_sku[col_cod].astype(str).str.replace(r"\D", "", regex=True)
-            mask = serie_cod_norm == sku_norm
-            df_sku_filtrado = df_sku[mask]
-
-            if df_sku_filtrado.empty:
-                achou = False
-                for c in ["CODIGO_PRODUTO","CÓDIGO PRODUTO","CÓD_PRODUTO","COD_PROD"]:
-                    if c in df_sku.columns:
-                        s2 = df_sku[c].astype(str).str.replace(r"\D", "", regex=True)
-                        df_try = df_sku.loc[s2 == sku_norm]
-                        if not df_try.empty:
-                            df_sku_filtrado = df_try
-                            achou = True
-                            log_callback(f"[linha {i}] Fallback: SKU encontrado via coluna '{c}'.")
-                            break
-
-                if not achou:
-                    skus_nao_mapeados.add(str(sku))
-                    log_callback(f"[linha {i}] WARN: SKU '{sku}' não encontrado em df_sku. Assumindo pesos 0.")
-                    p_bruto = p_liq = 0.0
-                else:
-                    row_sku = df_sku_filtrado.iloc[0]
-                    col_pbru = _pick_col_flex(df_sku_filtrado, ["QTDE_PESO_BRU","PESO_BRUTO_CAIXA","PESO_BRUTO","PESO_BRU"])
-                    col_pliq = _pick_col_flex(df_sku_filtrado, ["QTDE_PESO_LIQ","PESO_LIQ_CAIXA","PESO_LIQ","PESO_LIQUIDO"])
-                    p_bruto = converter_para_float_seguro(row_sku[col_pbru]) if col_pbru else 0.0
-                    p_liq   = converter_para_float_seguro(row_sku[col_pliq]) if col_pliq else 0.0
-            else:
-                row_sku = df_sku_filtrado.iloc[0]
-                col_pbru = _pick_col_flex(df_sku_filtrado, ["QTDE_PESO_BRU","PESO_BRUTO_CAIXA","PESO_BRUTO","PESO_BRU"])
-                col_pliq = _pick_col_flex(df_sku_filtrado, ["QTDE_PESO_LIQ","PESO_LIQ_CAIXA","PESO_LIQ","PESO_LIQUIDO"])
-                p_bruto = converter_para_float_seguro(row_sku[col_pbru]) if col_pbru else 0.0
-                p_liq   = converter_para_float_seguro(row_sku[col_pliq]) if col_pliq else 0.0
+            p_bruto, p_liq, _unidade, col_encontrada = pesos_sku
+            if col_encontrada != catalogo.col_cod:
+                logger.debug("[linha %d] Fallback: SKU encontrado via coluna '%s'.", i, col_encontrada)
 
         peso_bruto = p_bruto * qtd if p_bruto > 0 else 0.0
         peso_liq   = p_liq   * qtd if p_liq   > 0 else 0.0
 
-        log_callback(f"[linha {i}] sku={sku} qtd={qtd} chave={chave} | unit(bruto={p_bruto}, liq={p_liq}) | base(bruto≈{peso_bruto:.2f}, liq≈{peso_liq:.2f})")
+        logger.debug("[linha %d] sku=%s qtd=%s chave=%s | unit(bruto=%s, liq=%s) | base(bruto≈%.2f, liq≈%.2f)",
+                     i, sku, qtd, chave, p_bruto, p_liq, peso_bruto, peso_liq)
 
         sp, origem_sp, ajuste_sp = processar_sobrepeso(
-            chave, sku, peso_liq, df_sap, df_sobrepeso_real, df_base_fisica, df_sku, log_callback
+            chave, sku, peso_liq, pallets, sobrepeso, df_base_fisica, catalogo
         )
 
         peso_base_total_bruto += peso_bruto
         peso_base_total_liq   += peso_liq
         sp_total += ajuste_sp
 
-        log_callback(f"[linha {i}] SP={sp:.4f} ({origem_sp}) | ajuste≈{ajuste_sp:.2f} kg | acumulados: base_bruto≈{peso_base_total_bruto:.2f} kg, SP≈{sp_total:.2f} kg")
+        logger.debug("[linha %d] SP=%.4f (%s) | ajuste≈%.2f kg | acumulados: base_bruto≈%.2f kg, SP≈%.2f kg",
+                     i, sp, origem_sp, ajuste_sp, peso_base_total_bruto, sp_total)
 
         itens_detalhados.append({
             "sku": sku,
@@ -822,13 +1889,156 @@ def calcular_peso_final(
         })
 
     peso_com_sobrepeso = peso_base_total_bruto + sp_total
-    log_callback(f"[total] base_bruto≈{peso_base_total_bruto:.2f} kg | SP≈{sp_total:.2f} kg | com_SP≈{peso_com_sobrepeso:.2f} kg")
+    logger.info("[total] base_bruto≈%.2f kg | SP≈%.2f kg | com_SP≈%.2f kg",
+                peso_base_total_bruto, sp_total, peso_com_sobrepeso)
+
+    peso_total_com_paletes = peso_com_sobrepeso + (qtd_paletes * 22.0) + peso_veiculo_vazio
+    logger.info("[total] +paletes(%s×22) +veículo(%s) => final≈%.2f kg",
+                qtd_paletes, peso_veiculo_vazio, peso_total_com_paletes)
+
+    media_sp_geral = (sum(item["sp"] for item in itens_detalhados) / len(itens_detalhados)) if itens_detalhados else 0.0
+    logger.info("[total] média(sp)=%.4f em %d itens", media_sp_geral, len(itens_detalhados))
+
+    return (
+        peso_base_total_bruto,
+        sp_total,
+        peso_com_sobrepeso,
+        peso_total_com_paletes,
+        media_sp_geral,
+        itens_detalhados
+    )
+
+def _resolver_itens_remessa(df_linhas, df_sku, pallets, sobrepeso, df_base_fisica, skus_nao_mapeados):
+    """
+    Resolve todas as linhas de uma vez: pesos do SKU num join, janela do pallet via
+    PalletIndex, médias da janela agrupadas por linha de produção e o fallback fixo
+    calculado uma vez por (SKU, peso líquido). Devolve um DataFrame com uma linha
+    por item válido, na ordem de entrada; `linha` é a posição do item em df_linhas.
+    """
+    linhas = pd.DataFrame({
+        "linha": np.arange(len(df_linhas)),
+        "sku": df_linhas["ITEM"].astype(str).str.strip().to_numpy(),
+        "qtd": df_linhas["QUANTIDADE"].map(converter_para_float_seguro).to_numpy(dtype=float),
+        "chave_pallet": df_linhas["CHAVE_PALETE"].astype(str).str.strip().to_numpy(),
+    })
+
+    validas = (linhas["sku"] != "") & (linhas["qtd"] > 0)
+    if not validas.all():
+        logger.info("[lote] %d linha(s) ignorada(s) (sku vazio ou qtd<=0)", int((~validas).sum()))
+    linhas = linhas.loc[validas].reset_index(drop=True)
+
+    catalogo = df_sku if isinstance(df_sku, SkuCatalog) else SkuCatalog(df_sku, df_base_fisica)
+    if catalogo.pesos is None:
+        logger.error("[lote] Coluna de código de produto não encontrada em df_sku.")
+        return linhas.iloc[0:0].assign(peso_bruto=0.0, peso_liq=0.0, sp=0.0, origem="", ajuste_sp=0.0)
+
+    linhas["sku_norm"] = linhas["sku"].str.replace(r"\D", "", regex=True)
+    linhas = linhas.join(catalogo.pesos[["p_bruto", "p_liq"]], on="sku_norm")
+    nao_mapeados = linhas["p_bruto"].isna()
+    if nao_mapeados.any():
+        skus_nao_mapeados.update(linhas.loc[nao_mapeados, "sku"].tolist())
+        logger.warning("[lote] WARN: SKUs não encontrados em df_sku (pesos 0): %s",
+                       sorted(set(linhas.loc[nao_mapeados, "sku"])))
+    p_bruto = linhas["p_bruto"].fillna(0.0).to_numpy()
+    p_liq = linhas["p_liq"].fillna(0.0).to_numpy()
+    qtd = linhas["qtd"].to_numpy(dtype=float)
+    linhas["peso_bruto"] = np.where(p_bruto > 0, p_bruto * qtd, 0.0)
+    linhas["peso_liq"] = np.where(p_liq > 0, p_liq * qtd, 0.0)
+
+    janelas = pallets.tabela(linhas["chave_pallet"].str.replace(r"\s+", "", regex=True).to_numpy())
+    if sobrepeso.tem_datahora:
+        medias = sobrepeso.medias(janelas["linha_coluna"].to_numpy(), janelas["dt_ini"], janelas["dt_fim"])
+    else:
+        medias = np.full(len(linhas), np.nan)
+    media_sp = medias / 100.0
+    peso_liq = linhas["peso_liq"].to_numpy()
+    with np.errstate(invalid="ignore"):
+        real = janelas["encontrado"].to_numpy(dtype=bool) & (media_sp > 0) & (peso_liq > 0)
+
+    linhas["sp"] = np.where(real, media_sp, 0.0)
+    linhas["origem"] = np.where(real, "real", "não encontrado")
+    linhas["ajuste_sp"] = np.where(real, peso_liq * np.where(real, media_sp, 0.0), 0.0)
+
+    pendentes = linhas.loc[~real, ["sku", "peso_liq"]]
+    if not pendentes.empty:
+        fixos = {
+            (sku, pb): _sobrepeso_fixo_adotado(sku, pb, df_base_fisica, catalogo)
+            for sku, pb in pendentes.drop_duplicates().itertuples(index=False)
+        }
+        resolvidos = [fixos[chave] for chave in pendentes.itertuples(index=False, name=None)]
+        linhas.loc[~real, ["sp", "origem", "ajuste_sp"]] = pd.DataFrame(
+            resolvidos, index=pendentes.index, columns=["sp", "origem", "ajuste_sp"])
+
+    logger.info("[lote] %d itens resolvidos | origem: %s", len(linhas), linhas["origem"].value_counts().to_dict())
+    return linhas
+
+def calcular_peso_final_lote(
+    remessa_num,
+    peso_veiculo_vazio,
+    qtd_paletes,
+    df_remessa,
+    df_sku,
+    df_sap,
+    df_sobrepeso_real,
+    df_base_fisica,
+    skus_nao_mapeados=None,
+):
+    """
+    Mesmo contrato e mesmo retorno de `calcular_peso_final`, mas resolvendo a
+    remessa inteira em lote (sem iterrows). Logs por linha ficam no cálculo
+    linha a linha, que continua disponível para diagnóstico.
+    """
+    if skus_nao_mapeados is None:
+        skus_nao_mapeados = set()
+
+    peso_veiculo_vazio = converter_para_float_seguro(peso_veiculo_vazio)
+    qtd_paletes = converter_para_float_seguro(qtd_paletes)
+
+    try:
+        remessa_num = int(remessa_num)
+    except ValueError:
+        logger.error("Remessa inválida: %r", remessa_num)
+        return None
+
+    df_remessa = df_remessa.copy()
+    df_remessa["QUANTIDADE"] = df_remessa["QUANTIDADE"].apply(converter_para_float_seguro)
+    df_remessa = df_remessa.drop_duplicates(subset=["ID","ITEM", "QUANTIDADE", "CHAVE_PALETE"], keep="last")
+    logger.info("[remessa] %s | linhas após dedup: %d", remessa_num, len(df_remessa))
+
+    pallets = df_sap if isinstance(df_sap, PalletIndex) else PalletIndex(df_sap)
+    sobrepeso = (df_sobrepeso_real if isinstance(df_sobrepeso_real, SobrepesoIndex)
+                 else SobrepesoIndex(df_sobrepeso_real))
+
+    itens = _resolver_itens_remessa(df_remessa, df_sku, pallets, sobrepeso, df_base_fisica,
+                                    skus_nao_mapeados)
+
+    # somas na ordem das linhas, como o acumulado do laço original
+    peso_base_total_bruto = float(sum(itens["peso_bruto"].tolist(), 0.0))
+    sp_total = float(sum(itens["ajuste_sp"].tolist(), 0.0))
+    itens_detalhados = [
+        {
+            "sku": sku,
+            "chave_pallet": chave,
+            "sp": round(float(sp), 4),
+            "ajuste_sp": round(float(ajuste), 2),
+            "origem": origem,
+        }
+        for sku, chave, sp, ajuste, origem in zip(
+            itens["sku"].tolist(), itens["chave_pallet"].tolist(), itens["sp"].tolist(),
+            itens["ajuste_sp"].tolist(), itens["origem"].tolist()
+        )
+    ]
+
+    peso_com_sobrepeso = peso_base_total_bruto + sp_total
+    logger.info("[total] base_bruto≈%.2f kg | SP≈%.2f kg | com_SP≈%.2f kg",
+                peso_base_total_bruto, sp_total, peso_com_sobrepeso)
 
     peso_total_com_paletes = peso_com_sobrepeso + (qtd_paletes * 22.0) + peso_veiculo_vazio
-    log_callback(f"[total] +paletes({qtd_paletes}×22) +veículo({peso_veiculo_vazio}) => final≈{peso_total_com_paletes:.2f} kg")
+    logger.info("[total] +paletes(%s×22) +veículo(%s) => final≈%.2f kg",
+                qtd_paletes, peso_veiculo_vazio, peso_total_com_paletes)
 
     media_sp_geral = (sum(item["sp"] for item in itens_detalhados) / len(itens_detalhados)) if itens_detalhados else 0.0
-    log_callback(f"[total] média(sp)={media_sp_geral:.4f} em {len(itens_detalhados)} itens")
+    logger.info("[total] média(sp)=%.4f em %d itens", media_sp_geral, len(itens_detalhados))
 
     return (
         peso_base_total_bruto,
@@ -894,6 +2104,79 @@ def _coerce_float(x, default=0.0):
         return default
 
 
+def _taxas_tabela_por_familia(familias, df_sp_tab):
+    """Linha da tabela de sobrepeso para o conjunto de famílias da carga → (família, (+), (-))."""
+    familia_detectada = "MIX"
+    row = pd.DataFrame()
+    if len(familias) == 1:
+        fam = list(familias)[0]
+        is_biscoito = "BISCOITO" in fam or "CRACKER" in fam  
+        is_massa = "MASSA" in fam or "MACARR" in fam         
+        if is_biscoito:
+            familia_detectada = "BISCOITO"
+            row = df_sp_tab.loc[df_sp_tab.index.astype(str).str.contains("BISCOITO", case=False, regex=False)]
+            logger.debug("[TAB] Família detectada: BISCOITO (buscando linha em df_sobrepeso_tabela).")
+        elif is_massa:
+            familia_detectada = "MASSA"
+            row = df_sp_tab.loc[df_sp_tab.index.astype(str).str.contains("MASSA", case=False, regex=False)]
+            logger.debug("[TAB] Família detectada: MASSA (buscando linha em df_sobrepeso_tabela).")
+        else:
+            familia_detectada = fam
+            row = df_sp_tab.loc[df_sp_tab.index.astype(str).str.contains(fam, case=False, regex=False)]
+            logger.debug("[TAB] Família detectada: '%s' (buscando linha correspondente).", fam)
+        if row.empty:
+            logger.warning("[WARN] Não achei linha para família '%s' em df_sobrepeso_tabela. Fallback para MIX.", familia_detectada)
+            familia_detectada = "MIX"
+    else:
+        if len(familias) == 0:
+            logger.debug("[FAM] Nenhuma família encontrada para os SKUs → Fallback MIX.")
+        else:
+            logger.debug("[FAM] Famílias múltiplas detectadas (%d): %s → MIX.", len(familias), sorted(familias))
+        familia_detectada = "MIX"
+
+    if row.empty:
+        row = df_sp_tab.loc[df_sp_tab.index.astype(str).str.contains("MIX", case=False, regex=False)]
+        if row.empty:
+            logger.error("[ERRO] df_sobrepeso_tabela não contém entrada para 'MIX'. Usando defaults 0.02/0.01.")
+            media_positiva_tab = 0.02
+            media_negativa_tab = 0.01
+        else:
+            if "(+)" in row.columns and "(-)" in row.columns:
+                media_positiva_tab = _coerce_float(row.iloc[0]["(+)"], default=0.02)
+                media_negativa_tab = _coerce_float(row.iloc[0]["(-)"], default=0.01)
+            else:
+                cand_pos = [c for c in row.columns if str(c).strip().upper() in ["(+)", "+", "POS", "POSITIVO", "SOBREPOS_POS", "SOBREPOS+"]]
+                cand_neg = [c for c in row.columns if str(c).strip().upper() in ["(-)", "-", "NEG", "NEGATIVO", "SOBREPOS_NEG", "SOBREPOS-"]]
+                col_pos = cand_pos[0] if cand_pos else None
+                col_neg = cand_neg[0] if cand_neg else None
+                if (col_pos is None) or (col_neg is None):
+                    logger.error("[ERRO] Colunas '(+)'/'(-)' não encontradas para MIX. Usando defaults 0.02/0.01.")
+                    media_positiva_tab = 0.02
+                    media_negativa_tab = 0.01
+                else:
+                    media_positiva_tab = _coerce_float(row.iloc[0][col_pos], default=0.02)
+                    media_negativa_tab = _coerce_float(row.iloc[0][col_neg], default=0.01)
+    else:
+        if "(+)" in row.columns and "(-)" in row.columns:
+            media_positiva_tab = _coerce_float(row.iloc[0]["(+)"], default=0.02)
+            media_negativa_tab = _coerce_float(row.iloc[0]["(-)"], default=0.01)
+        else:
+            cand_pos = [c for c in row.columns if str(c).strip().upper() in ["(+)", "+", "POS", "POSITIVO", "SOBREPOS_POS", "SOBREPOS+"]]
+            cand_neg = [c for c in row.columns if str(c).strip().upper() in ["(-)", "-", "NEG", "NEGATIVO", "SOBREPOS_NEG", "SOBREPOS-"]]
+            col_pos = cand_pos[0] if cand_pos else None
+            col_neg = cand_neg[0] if cand_neg else None
+            if (col_pos is None) or (col_neg is None):
+                logger.error("[ERRO] Colunas de sobrepeso '(+)'/'(-)' não encontradas na linha da família '%s'. "
+                             "Usando defaults 0.02/0.01.", familia_detectada)
+                media_positiva_tab = 0.02
+                media_negativa_tab = 0.01
+            else:
+                media_positiva_tab = _coerce_float(row.iloc[0][col_pos], default=0.02)
+                media_negativa_tab = _coerce_float(row.iloc[0][col_neg], default=0.01)
+
+    return familia_detectada, media_positiva_tab, media_negativa_tab
+
+
 def calcular_limites_sobrepeso_por_quantidade(
     dados,
     itens_detalhados,
@@ -902,7 +2185,6 @@ def calcular_limites_sobrepeso_por_quantidade(
     df_sku,
     df_remessa,
     df_fracao,
-    log_callback
 ):
     total_quantidade = 0.0
     quantidade_com_sp_real = 0.0
@@ -910,27 +2192,30 @@ def calcular_limites_sobrepeso_por_quantidade(
     ponderador_neg = 0.0
     familia_detectada = "MIX"
 
-    try:
-        col_cod, col_fam = _pick_family_column(df_base_familia)
-    except Exception as e:
-        log_callback(f"[ERRO] Base família sem colunas esperadas: {e}. Forçando MIX.")
-        col_cod, col_fam = None, None
-
-    if col_cod and col_fam:
-        df_fam = df_base_familia[[col_cod, col_fam]].copy()
-        df_fam["_COD_NORM_"] = df_fam[col_cod].map(_norm_digits)
-        df_fam["_FAM_NORM_"] = df_fam[col_fam].astype(str).str.upper().str.strip()
-        df_fam = df_fam[df_fam["_COD_NORM_"] != ""]
-        log_callback(f"[DEBUG] Base família normalizada: linhas={len(df_fam)}, col_cod='{col_cod}', col_fam='{col_fam}'.")
-    else:
-        df_fam = pd.DataFrame(columns=["_COD_NORM_", "_FAM_NORM_"])
+    catalogo = df_sku if isinstance(df_sku, SkuCatalog) else SkuCatalog(None, df_base_familia=df_base_familia)
+    if catalogo.erro_familia is not None:
+        logger.warning("[ERRO] Base família sem colunas esperadas: %s. Forçando MIX.", catalogo.erro_familia)
+    elif catalogo.col_familia:
+        logger.debug("[DEBUG] Base família normalizada: linhas=%s, col_cod='%s', col_fam='%s'.",
+                     catalogo.linhas_familia, catalogo.col_cod_familia, catalogo.col_familia)
 
     df_sp_tab, sp_index_source = _ensure_df_sobrepeso_index(df_sobrepeso_tabela)
-    log_callback(f"[DEBUG] df_sobrepeso_tabela preparado (fonte_index='{sp_index_source}', indice_name='{df_sp_tab.index.name}'), linhas={len(df_sp_tab)}.")
+    logger.debug("[DEBUG] df_sobrepeso_tabela preparado (fonte_index='%s', indice_name='%s'), linhas=%d.",
+                 sp_index_source, df_sp_tab.index.name, len(df_sp_tab))
 
     agrupado_por_sku = defaultdict(list)
     for item in itens_detalhados:
-        agrupado_por_sku[item.get("sku")] = agrupado_por_sku[item.get("sku")] + [item]
+        agrupado_por_sku[item.get("sku")].append(item)
+
+    # quantidades somadas uma vez por chave de pallet / SKU normalizado
+    qtd_por_chave = None
+    qtd_por_sku = None
+    if (df_fracao is not None) and (not df_fracao.empty) and ("chave_pallete" in df_fracao.columns):
+        qtd_por_chave = (pd.to_numeric(df_fracao["qtd"], errors="coerce").fillna(0)
+                           .groupby(df_fracao["chave_pallete"].astype(str).to_numpy()).sum().to_dict())
+    elif (df_remessa is not None) and (not df_remessa.empty) and ("ITEM" in df_remessa.columns) and ("QUANTIDADE" in df_remessa.columns):
+        qtd_por_sku = (pd.to_numeric(df_remessa["QUANTIDADE"], errors="coerce").fillna(0)
+                         .groupby(df_remessa["ITEM"].astype(str).map(_norm_digits).to_numpy()).sum().to_dict())
 
     for sku, itens in agrupado_por_sku.items():
         qtd_total = 0.0
@@ -943,15 +2228,12 @@ def calcular_limites_sobrepeso_por_quantidade(
             sp = _coerce_float(item.get("sp", 0.0), default=0.0)
             chave = _to_str(item.get("chave_pallet", ""))
 
-            if (df_fracao is not None) and (not df_fracao.empty) and ("chave_pallete" in df_fracao.columns):
-                mask_frac = df_fracao["chave_pallete"].astype(str).eq(chave)
-                qtd = pd.to_numeric(df_fracao.loc[mask_frac, "qtd"], errors="coerce").fillna(0).sum()
+            if qtd_por_chave is not None:
+                qtd = qtd_por_chave.get(chave, 0)
+            elif qtd_por_sku is not None:
+                qtd = qtd_por_sku.get(_norm_digits(sku), 0)
             else:
-                if (df_remessa is not None) and (not df_remessa.empty) and ("ITEM" in df_remessa.columns) and ("QUANTIDADE" in df_remessa.columns):
-                    mask_rem = df_remessa["ITEM"].astype(str).map(_norm_digits).eq(_norm_digits(sku))
-                    qtd = pd.to_numeric(df_remessa.loc[mask_rem, "QUANTIDADE"], errors="coerce").fillna(0).sum()
-                else:
-                    qtd = 0.0
+                qtd = 0.0
 
             qtd_total += qtd
 
@@ -967,118 +2249,60 @@ def calcular_limites_sobrepeso_por_quantidade(
         ponderador_pos += ponderador_pos_local
         ponderador_neg += ponderador_neg_local
 
-        log_callback(f"[SKU] sku='{sku}' qtd_total={qtd_total:.3f} qtd_real={qtd_real:.3f} "
-                     f"pond_pos_local={ponderador_pos_local:.3f} pond_neg_local={ponderador_neg_local:.3f}")
+        logger.debug("[SKU] sku='%s' qtd_total=%.3f qtd_real=%.3f pond_pos_local=%.3f pond_neg_local=%.3f",
+                     sku, qtd_total, qtd_real, ponderador_pos_local, ponderador_neg_local)
 
     proporcao_sp_real = (quantidade_com_sp_real / total_quantidade) if total_quantidade > 0 else 0.0
-    log_callback(f"[AGREGADO] Total_qtde={total_quantidade:.3f} Qtde_com_SP_Real={quantidade_com_sp_real:.3f} "
-                 f"Proporção_SP_Real={proporcao_sp_real:.2%}")
+    logger.info("[AGREGADO] Total_qtde=%.3f Qtde_com_SP_Real=%.3f Proporção_SP_Real=%.2f%%",
+                total_quantidade, quantidade_com_sp_real, proporcao_sp_real * 100)
 
     familias = set()
-    if not df_fam.empty:
+    if catalogo.familias:
         for sku in agrupado_por_sku.keys():
             sku_norm = _norm_digits(sku)
-            fam_rows = df_fam.loc[df_fam["_COD_NORM_"] == sku_norm, "_FAM_NORM_"]
-            if fam_rows.empty:
-                log_callback(f"[FAM] SKU '{sku}' (norm='{sku_norm}') sem família mapeada na base.")
+            fam_val = catalogo.familia(sku)
+            if fam_val is None:
+                logger.debug("[FAM] SKU '%s' (norm='%s') sem família mapeada na base.", sku, sku_norm)
             else:
-                fam_val = str(fam_rows.iloc[0]).upper().strip()
                 familias.add(fam_val)
-                log_callback(f"[FAM] SKU '{sku}' (norm='{sku_norm}') → família='{fam_val}'.")
+                logger.debug("[FAM] SKU '%s' (norm='%s') → família='%s'.", sku, sku_norm, fam_val)
     else:
-        log_callback("[FAM] df_base_familia vazio ou sem colunas esperadas. Só MIX possível agora.")
-
-    row = pd.DataFrame()
-    if len(familias) == 1:
-        fam = list(familias)[0]
-        is_biscoito = "BISCOITO" in fam or "CRACKER" in fam  
-        is_massa = "MASSA" in fam or "MACARR" in fam         
-        if is_biscoito:
-            familia_detectada = "BISCOITO"
-            row = df_sp_tab.loc[df_sp_tab.index.astype(str).str.contains("BISCOITO", case=False, regex=False)]
-            log_callback("[TAB] Família detectada: BISCOITO (buscando linha em df_sobrepeso_tabela).")
-        elif is_massa:
-            familia_detectada = "MASSA"
-            row = df_sp_tab.loc[df_sp_tab.index.astype(str).str.contains("MASSA", case=False, regex=False)]
-            log_callback("[TAB] Família detectada: MASSA (buscando linha em df_sobrepeso_tabela).")
-        else:
-            familia_detectada = fam
-            row = df_sp_tab.loc[df_sp_tab.index.astype(str).str.contains(fam, case=False, regex=False)]
-            log_callback(f"[TAB] Família detectada: '{fam}' (buscando linha correspondente).")
-        if row.empty:
-            log_callback(f"[WARN] Não achei linha para família '{familia_detectada}' em df_sobrepeso_tabela. Fallback para MIX.")
-            familia_detectada = "MIX"
-    else:
-        if len(familias) == 0:
-            log_callback("[FAM] Nenhuma família encontrada para os SKUs → Fallback MIX.")
-        else:
-            log_callback(f"[FAM] Famílias múltiplas detectadas ({len(familias)}): {sorted(familias)} → MIX.")
-        familia_detectada = "MIX"
+        logger.warning("[FAM] df_base_familia vazio ou sem colunas esperadas. Só MIX possível agora.")
 
-    if row.empty:
-        row = df_sp_tab.loc[df_sp_tab.index.astype(str).str.contains("MIX", case=False, regex=False)]
-        if row.empty:
-            log_callback("[ERRO] df_sobrepeso_tabela não contém entrada para 'MIX'. Usando defaults 0.02/0.01.")
-            media_positiva_tab = 0.02
-            media_negativa_tab = 0.01
-        else:
-            if "(+)" in row.columns and "(-)" in row.columns:
-                media_positiva_tab = _coerce_float(row.iloc[0]["(+)"], default=0.02)
-                media_negativa_tab = _coerce_float(row.iloc[0]["(-)"], default=0.01)
-            else:
-                cand_pos = [c for c in row.columns if str(c).strip().upper() in ["(+)", "+", "POS", "POSITIVO", "SOBREPOS_POS", "SOBREPOS+"]]
-                cand_neg = [c for c in row.columns if str(c).strip().upper() in ["(-)", "-", "NEG", "NEGATIVO", "SOBREPOS_NEG", "SOBREPOS-"]]
-                col_pos = cand_pos[0] if cand_pos else None
-                col_neg = cand_neg[0] if cand_neg else None
-                if (col_pos is None) or (col_neg is None):
-                    log_callback(f"[ERRO] Colunas '(+)'/'(-)' não encontradas para MIX. Usando defaults 0.02/0.01.")
-                    media_positiva_tab = 0.02
-                    media_negativa_tab = 0.01
-                else:
-                    media_positiva_tab = _coerce_float(row.iloc[0][col_pos], default=0.02)
-                    media_negativa_tab = _coerce_float(row.iloc[0][col_neg], default=0.01)
-    else:
-        if "(+)" in row.columns and "(-)" in row.columns:
-            media_positiva_tab = _coerce_float(row.iloc[0]["(+)"], default=0.02)
-            media_negativa_tab = _coerce_float(row.iloc[0]["(-)"], default=0.01)
-        else:
-            cand_pos = [c for c in row.columns if str(c).strip().upper() in ["(+)", "+", "POS", "POSITIVO", "SOBREPOS_POS", "SOBREPOS+"]]
-            cand_neg = [c for c in row.columns if str(c).strip().upper() in ["(-)", "-", "NEG", "NEGATIVO", "SOBREPOS_NEG", "SOBREPOS-"]]
-            col_pos = cand_pos[0] if cand_pos else None
-            col_neg = cand_neg[0] if cand_neg else None
-            if (col_pos is None) or (col_neg is None):
-                log_callback(f"[ERRO] Colunas de sobrepeso '(+)'/'(-)' não encontradas na linha da família '{familia_detectada}'. Usando defaults 0.02/0.01.")
-                media_positiva_tab = 0.02
-                media_negativa_tab = 0.01
-            else:
-                media_positiva_tab = _coerce_float(row.iloc[0][col_pos], default=0.02)
-                media_negativa_tab = _coerce_float(row.iloc[0][col_neg], default=0.01)
+    familia_detectada, media_positiva_tab, media_negativa_tab = _taxas_tabela_por_familia(
+        familias, df_sp_tab
+    )
 
     if proporcao_sp_real >= 0.9 and quantidade_com_sp_real > 0:
         media_positiva = (ponderador_pos / quantidade_com_sp_real) if ponderador_pos > 0 else media_positiva_tab
         media_negativa = (ponderador_neg / quantidade_com_sp_real) if ponderador_neg > 0 else media_negativa_tab
         origem_taxa = "REAL"
-        log_callback("[REGRA] >=90% com SP Real → usando médias ponderadas do realizado.")
+        logger.info("[REGRA] >=90% com SP Real → usando médias ponderadas do realizado.")
     else:
         media_positiva = media_positiva_tab
         media_negativa = media_negativa_tab
         origem_taxa = "TABELA"
-        log_callback("[REGRA] <90% com SP Real → usando tabela por família.")
+        logger.info("[REGRA] <90% com SP Real → usando tabela por família.")
 
-    log_callback(f"[RESULT] Origem={origem_taxa} | Família='{familia_detectada}' | Sobrepeso (+)={media_positiva:.4f} | (-)={media_negativa:.4f}")
+    logger.info("[RESULT] Origem=%s | Família='%s' | Sobrepeso (+)=%.4f | (-)=%.4f",
+                origem_taxa, familia_detectada, media_positiva, media_negativa)
 
     return media_positiva, media_negativa, proporcao_sp_real, familia_detectada
 
 
 
+def tabela_sobrepeso_padrao():
+    """Limites de sobrepeso (+)/(-) por tipo de carga usados no formulário."""
+    dados_tabela = {'(+)': [0.02, 0.005, 0.04], '(-)': [0.01, 0.01, 0.01]}
+    index = ['CARGA COM MIX', 'EXCLUSIVO MASSAS', 'EXCLUSIVO BISCOITOS']
+    return pd.DataFrame(dados_tabela, index=index)
+
 def preencher_formulario_com_openpyxl(path_copia, dados, itens_detalhados, log_callback, df_sku, df_remessa, df_fracao):
     try:
-        dados_tabela = {'(+)': [0.02, 0.005, 0.04], '(-)': [0.01, 0.01, 0.01]}
-        index = ['CARGA COM MIX', 'EXCLUSIVO MASSAS', 'EXCLUSIVO BISCOITOS']
-        df_sobrepeso_tabela = pd.DataFrame(dados_tabela, index=index)
+        df_sobrepeso_tabela = tabela_sobrepeso_padrao()
 
         sp_pos, sp_neg, proporcao_sp_real, familia_detectada = calcular_limites_sobrepeso_por_quantidade(
-            dados, itens_detalhados, df_base_familia, df_sobrepeso_tabela, df_sku, df_remessa, df_fracao, log_callback
+            dados, itens_detalhados, df_base_familia, df_sobrepeso_tabela, df_sku, df_remessa, df_fracao
         )
 
         wb = load_workbook(path_copia)
@@ -1136,18 +2360,19 @@ def gerar_relatorio_diferenca(remessa_num, peso_final_balança, peso_veiculo_vaz
         pasta_destino = os.path.join(pasta_excel, "Analise_divergencia")
         os.makedirs(pasta_destino, exist_ok=True)
 
-        skus = df_remessa["ITEM"].unique()
+        catalogo = df_sku if isinstance(df_sku, SkuCatalog) else SkuCatalog(df_sku)
+        codigos, skus = pd.factorize(df_remessa["ITEM"])
+        qtd_por_sku = df_remessa["QUANTIDADE"].groupby(codigos).sum()
         dados_relatorio = []
         peso_base_total_liq = 0.0
 
-        for sku in skus:
-            qtd = converter_para_float_seguro(df_remessa[df_remessa["ITEM"] == sku]["QUANTIDADE"].sum())
-            df_sku_filtrado = df_sku[df_sku["COD_PRODUTO"] == sku]
-            if df_sku_filtrado.empty:
+        for i, sku in enumerate(skus):
+            qtd = converter_para_float_seguro(qtd_por_sku.get(i, 0))
+            pesos_sku = catalogo.pesos_unitarios(sku)
+            if pesos_sku is None:
                 continue
 
-            unidade = df_sku_filtrado.iloc[0]["DESC_UNID_MEDID"]
-            peso_unit_liq = converter_para_float_seguro(df_sku_filtrado.iloc[0]["QTDE_PESO_LIQ"])
+            _p_bruto, peso_unit_liq, unidade, _col = pesos_sku
             peso_total_liq = converter_para_float_seguro(peso_unit_liq * qtd)
             peso_base_total_liq += peso_total_liq
 
@@ -1244,15 +2469,428 @@ def gerar_relatorio_diferenca(remessa_num, peso_final_balança, peso_veiculo_vaz
         log_callback(f"Erro ao gerar relatório de divergência: {str(e)}")
         raise
 
+def _norm_digits_series(sr):
+    """`_norm_digits` aplicado uma vez por valor distinto da série."""
+    codigos, distintos = pd.factorize(sr, use_na_sentinel=True)
+    normas = np.array([_norm_digits(v) for v in distintos] + [""], dtype=object)
+    return pd.Series(normas[codigos], index=sr.index)
+
+COLUNAS_RESUMO_FILA = [
+    "Remessa", "Status", "Itens", "SKUs", "Pallets", "Peso Base (kg)", "Sobrepeso (kg)",
+    "Peso c/ SP (kg)", "Peso Estimado (kg)", "Média SP", "SP (+)", "SP (-)",
+    "Limite Superior (kg)", "Limite Inferior (kg)", "Família", "% SP Real", "Origem Taxa",
+]
+
+def _coletar_fila(remessas, bases):
+    """Situação de cada remessa pedida e as linhas das encontradas (com a coluna _REMESSA_)."""
+    status = {}
+    partes = []
+    for remessa in remessas:
+        try:
+            remessa = int(remessa)
+        except (TypeError, ValueError):
+            status[remessa] = "remessa inválida"
+            continue
+        if remessa in status:
+            continue
+        df_rem = obter_dados_remessa(remessa, bases.df_expedicao, lambda _msg: None,
+                                     indice_remessas=bases.remessas)
+        if df_rem.empty:
+            status[remessa] = "não encontrada"
+            continue
+        status[remessa] = "ok"
+        partes.append(df_rem.reindex(columns=["ID", "ITEM", "QUANTIDADE", "CHAVE_PALETE"])
+                            .astype({"ITEM": object})
+                            .assign(_REMESSA_=remessa))
+    linhas = (pd.concat(partes, ignore_index=True) if partes
+              else pd.DataFrame(columns=["ID", "ITEM", "QUANTIDADE", "CHAVE_PALETE", "_REMESSA_"]))
+    return list(status.items()), linhas
+
+def _resumir_fila(status, linhas, catalogo, pallets, sobrepeso, df_base_fisica, peso_vazio,
+                  skus_nao_mapeados):
+    """
+    Resumo das remessas de `status` ([(remessa, situação)]) a partir das suas linhas.
+    Cada remessa só depende das próprias linhas, então o resultado não muda ao
+    dividir a fila em partes.
+    """
+    if linhas.empty:
+        return (pd.DataFrame([{"Remessa": r, "Status": st} for r, st in status])
+                  .reindex(columns=COLUNAS_RESUMO_FILA)
+                  .astype({"Itens": "Int64", "SKUs": "Int64", "Pallets": "Int64"}))
+
+    linhas = linhas.copy()
+    # limites: quantidade por SKU sobre as linhas da remessa sem dedup, como no formulário
+    qtd_limites = (pd.to_numeric(linhas["QUANTIDADE"], errors="coerce").fillna(0)
+                     .groupby([linhas["_REMESSA_"], _norm_digits_series(linhas["ITEM"].astype(str))]).sum())
+
+    linhas["QUANTIDADE"] = linhas["QUANTIDADE"].apply(converter_para_float_seguro)
+    linhas = linhas.drop_duplicates(subset=["_REMESSA_", "ID", "ITEM", "QUANTIDADE", "CHAVE_PALETE"], keep="last")
+    linhas = linhas.reset_index(drop=True)
+
+    itens = _resolver_itens_remessa(linhas, catalogo, pallets, sobrepeso,
+                                    df_base_fisica, skus_nao_mapeados)
+    itens["remessa"] = linhas["_REMESSA_"].to_numpy()[itens["linha"].to_numpy()]
+    itens["sp_form"] = itens["sp"].astype(float).round(4)
+
+    chave_qtd = pd.MultiIndex.from_arrays([itens["remessa"], _norm_digits_series(itens["sku"])])
+    qtd = qtd_limites.reindex(chave_qtd).fillna(0).to_numpy()
+    sp = itens["sp_form"].to_numpy()
+    real = (itens["origem"] == "real").to_numpy()
+    itens["qtd_total"] = qtd
+    itens["qtd_real"] = np.where(real, qtd, 0.0)
+    itens["pond_pos"] = np.where(real & (sp > 0), sp * qtd, 0.0)
+    itens["pond_neg"] = np.where(real & (sp < 0), np.abs(sp) * qtd, 0.0)
+
+    por_remessa = itens.groupby("remessa", sort=False).agg(
+        itens=("sku", "size"),
+        peso_base=("peso_bruto", "sum"),
+        sp_total=("ajuste_sp", "sum"),
+        media_sp=("sp_form", "mean"),
+        qtd_total=("qtd_total", "sum"),
+        qtd_real=("qtd_real", "sum"),
+        pond_pos=("pond_pos", "sum"),
+        pond_neg=("pond_neg", "sum"),
+    )
+    skus_por_remessa = linhas.groupby("_REMESSA_", sort=False)["ITEM"].nunique()
+    pallets_por_remessa = (linhas.loc[linhas["CHAVE_PALETE"].notna()]
+                                 .groupby("_REMESSA_", sort=False)["CHAVE_PALETE"].nunique())
+    skus_itens = itens.drop_duplicates(subset=["remessa", "sku"]).groupby("remessa", sort=False)["sku"].agg(list)
+
+    df_sp_tab, _ = _ensure_df_sobrepeso_index(tabela_sobrepeso_padrao())
+
+    registros = []
+    for remessa, situacao in status:
+        reg = {"Remessa": remessa, "Status": situacao}
+        if situacao != "ok":
+            registros.append(reg)
+            continue
+        agg = por_remessa.loc[remessa] if remessa in por_remessa.index else None
+        peso_base = float(agg["peso_base"]) if agg is not None else 0.0
+        sp_total = float(agg["sp_total"]) if agg is not None else 0.0
+        pallets = int(pallets_por_remessa.get(remessa, 0))
+        peso_com_sp = peso_base + sp_total
+        peso_estimado = peso_com_sp + pallets * 22.0 + float(peso_vazio or 0.0)
+
+        qtd_total = float(agg["qtd_total"]) if agg is not None else 0.0
+        qtd_real = float(agg["qtd_real"]) if agg is not None else 0.0
+        proporcao = (qtd_real / qtd_total) if qtd_total > 0 else 0.0
+        familias = {f for f in (catalogo.familia(sku) for sku in skus_itens.get(remessa, [])) if f is not None}
+        familia, pos_tab, neg_tab = _taxas_tabela_por_familia(familias, df_sp_tab)
+        if proporcao >= 0.9 and qtd_real > 0:
+            sp_pos = (float(agg["pond_pos"]) / qtd_real) if agg["pond_pos"] > 0 else pos_tab
+            sp_neg = (float(agg["pond_neg"]) / qtd_real) if agg["pond_neg"] > 0 else neg_tab
+            origem_taxa = "REAL"
+        else:
+            sp_pos, sp_neg, origem_taxa = pos_tab, neg_tab, "TABELA"
+
+        reg.update({
+            "Status": situacao if agg is not None else "sem itens válidos",
+            "Itens": int(agg["itens"]) if agg is not None else 0,
+            "SKUs": int(skus_por_remessa.get(remessa, 0)),
+            "Pallets": pallets,
+            "Peso Base (kg)": peso_base,
+            "Sobrepeso (kg)": sp_total,
+            "Peso c/ SP (kg)": peso_com_sp,
+            "Peso Estimado (kg)": peso_estimado,
+            "Média SP": float(agg["media_sp"]) if agg is not None else 0.0,
+            "SP (+)": sp_pos,
+            "SP (-)": sp_neg,
+            "Limite Superior (kg)": peso_estimado * (1 + sp_pos),
+            "Limite Inferior (kg)": peso_estimado * (1 - sp_neg),
+            "Família": familia,
+            "% SP Real": proporcao,
+            "Origem Taxa": origem_taxa,
+        })
+        registros.append(reg)
+
+    return (pd.DataFrame(registros).reindex(columns=COLUNAS_RESUMO_FILA)
+              .astype({"Itens": "Int64", "SKUs": "Int64", "Pallets": "Int64"}))
+
+def simular_fila_remessas(remessas, bases, peso_vazio=0.0, log=print):
+    """
+    Pré-simula uma fila de remessas com as bases do snapshot `bases` (BasesSnapshot).
+    Os itens de todas as remessas são resolvidos juntos, num único
+    `_resolver_itens_remessa`, e pesos, limites (+)/(-) e família são agregados por
+    remessa com as mesmas regras de `calcular_peso_final_lote` e
+    `calcular_limites_sobrepeso_por_quantidade`. A quantidade de pallets é a de
+    chaves distintas da remessa. Devolve um DataFrame com uma linha por remessa
+    (colunas de COLUNAS_RESUMO_FILA), na ordem pedida.
+    """
+    inicio = time.time()
+    status, linhas = _coletar_fila(remessas, bases)
+    skus_nao_mapeados = set()
+    resumo = _resumir_fila(status, linhas, bases.catalogo, bases.pallets, bases.sobrepeso,
+                           bases.df_base_fisica, peso_vazio, skus_nao_mapeados)
+    _log_fim_fila(resumo, skus_nao_mapeados, inicio, log)
+    return resumo
+
+def _log_fim_fila(resumo, skus_nao_mapeados, inicio, log):
+    if skus_nao_mapeados:
+        log(f"[fila] SKUs sem cadastro em dado_sku (pesos 0): {sorted(skus_nao_mapeados)}")
+    ok = int((resumo["Status"] == "ok").sum())
+    if ok == 0:
+        log(f"[fila] nenhuma das {len(resumo)} remessas foi encontrada.")
+        return
+    log(f"[fila] {ok}/{len(resumo)} remessas simuladas "
+        f"({int(resumo['Itens'].fillna(0).sum())} itens) em {time.time() - inicio:.1f}s")
+
+# --- execução paralela: os índices são montados uma vez, no processo principal ---
+
+_BASES_WORKER = None
+
+def _exportar_bases_fila(bases, linhas, destino_dir):
+    """
+    Prepara o que os processos da fila recebem: o SkuCatalog já montado, o
+    PalletIndex recortado às chaves da fila e o SobrepesoIndex gravado em Feather
+    para ser mapeado em memória (sem cópia) por todos os processos.
+    """
+    chaves = pd.unique(linhas["CHAVE_PALETE"].astype(str).str.strip().str.replace(r"\s+", "", regex=True))
+    destino_sobrepeso = os.path.join(destino_dir, "sobrepeso")
+    bases.sobrepeso.gravar_feather(destino_sobrepeso)
+    return bases.catalogo, bases.pallets.recorte(chaves), destino_sobrepeso
+
+def _iniciar_worker_fila(catalogo, pallets, destino_sobrepeso):
+    global _BASES_WORKER
+    # com o SkuCatalog, o cálculo fixo não consulta df_base_fisica
+    _BASES_WORKER = (catalogo, pallets, SobrepesoIndex.ler_feather(destino_sobrepeso), None)
+
+def _resumir_fila_worker(status, linhas, peso_vazio):
+    catalogo, pallets, sobrepeso, df_base_fisica = _BASES_WORKER
+    skus_nao_mapeados = set()
+    resumo = _resumir_fila(status, linhas, catalogo, pallets, sobrepeso, df_base_fisica,
+                           peso_vazio, skus_nao_mapeados)
+    return resumo, skus_nao_mapeados
+
+def simular_fila_remessas_paralelo(remessas, bases, workers, peso_vazio=0.0, log=print):
+    """
+    Mesmo resultado de `simular_fila_remessas`, com a fila dividida em blocos
+    contíguos entre `workers` processos. Nenhum processo remonta índice: recebem o
+    catálogo e o recorte do PalletIndex prontos e mapeiam os vetores do
+    SobrepesoIndex do mesmo arquivo Feather. Os blocos são juntados na ordem da fila.
+    Sem pyarrow, a fila roda num processo só.
+    """
+    if workers is None or workers <= 1:
+        return simular_fila_remessas(remessas, bases, peso_vazio=peso_vazio, log=log)
+    try:
+        import pyarrow.feather
+    except ImportError:
+        log("[fila] pyarrow indisponível: simulando num processo só")
+        return simular_fila_remessas(remessas, bases, peso_vazio=peso_vazio, log=log)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    inicio = time.time()
+    status, linhas = _coletar_fila(remessas, bases)
+    n_blocos = max(1, min(len(status), workers * 4))
+    tamanho = -(-len(status) // n_blocos)
+    blocos = [status[i:i + tamanho] for i in range(0, len(status), tamanho)]
+    log(f"[fila] {len(status)} remessas em {len(blocos)} bloco(s) para {workers} processo(s)")
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    destino_dir = tempfile.mkdtemp(prefix="fila_", dir=CACHE_DIR)
+    try:
+        compartilhado = _exportar_bases_fila(bases, linhas, destino_dir)
+        por_remessa = linhas.groupby("_REMESSA_", sort=False).indices
+        with ProcessPoolExecutor(max_workers=workers, initializer=_iniciar_worker_fila,
+                                 initargs=compartilhado) as executor:
+            futuros = []
+            for bloco in blocos:
+                posicoes = [por_remessa[r] for r, st in bloco if r in por_remessa]
+                linhas_bloco = (linhas.iloc[np.concatenate(posicoes)].reset_index(drop=True)
+                                if posicoes else linhas.iloc[0:0])
+                futuros.append(executor.submit(_resumir_fila_worker, bloco, linhas_bloco, peso_vazio))
+            partes = [f.result() for f in futuros]
+    finally:
+        shutil.rmtree(destino_dir, ignore_errors=True)
+
+    resumo = pd.concat([p for p, _ in partes], ignore_index=True)
+    skus_nao_mapeados = set().union(*(s for _, s in partes))
+    _log_fim_fila(resumo, skus_nao_mapeados, inicio, log)
+    return resumo
+
+def salvar_resumo_fila(resumo, destino, log=print):
+    """Grava o resumo da fila em .xlsx (aba 'fila') ou, para outra extensão, em CSV com ';'."""
+    pasta = os.path.dirname(destino)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+    if destino.lower().endswith(".xlsx"):
+        resumo.to_excel(destino, sheet_name="fila", index=False)
+    else:
+        resumo.to_csv(destino, sep=";", decimal=",", index=False, encoding="utf-8-sig")
+    log(f"[fila] resumo salvo em: {destino}")
+    return destino
+
+def caminho_resumo_fila_padrao():
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    return os.path.join(os.environ["USERPROFILE"], "Downloads", f"fila_remessas_{timestamp}.xlsx")
+
+# maior intervalo 'A-B' aceito na fila; acima disso é quase sempre erro de digitação
+MAX_REMESSAS_INTERVALO = 5000
+
+def interpretar_fila_remessas(texto, max_intervalo=MAX_REMESSAS_INTERVALO):
+    """
+    Lê remessas separadas por espaço, vírgula, ';' ou quebra de linha; 'A-B' vira o
+    intervalo de A a B (inclusive). Devolve a lista na ordem informada, sem repetir.
+    Levanta ValueError para um token que não é remessa nem intervalo, ou para um
+    intervalo com mais de `max_intervalo` remessas.
+    """
+    remessas = []
+    for token in re.split(r"[\s,;]+", str(texto).strip()):
+        if not token:
+            continue
+        m = re.fullmatch(r"(\d+)\s*-\s*(\d+)", token)
+        if m:
+            ini, fim = int(m.group(1)), int(m.group(2))
+            if fim < ini:
+                ini, fim = fim, ini
+            if fim - ini + 1 > max_intervalo:
+                raise ValueError(f"intervalo '{token}' tem {fim - ini + 1} remessas (máximo {max_intervalo})")
+            remessas.extend(range(ini, fim + 1))
+        elif re.fullmatch(r"\d+(\.0*)?", token):
+            # remessas coladas do Excel podem vir como 8001234.0
+            remessas.append(int(float(token)))
+        else:
+            raise ValueError(f"remessa inválida: '{token}'")
+    return list(dict.fromkeys(remessas))
+
+class BasesSnapshot:
+    """
+    Fotografia imutável das bases de referência e dos índices derivados. O cálculo
+    só lê destes objetos; um refresh cria um snapshot novo em vez de alterar este.
+    """
+
+    def __init__(self, df_expedicao, df_sap, df_sobrepeso_real, df_base_fisica, df_base_familia,
+                 df_sku, assinaturas, log=print):
+        self.df_expedicao = df_expedicao
+        self.df_sap = df_sap
+        self.df_sobrepeso_real = df_sobrepeso_real
+        self.df_base_fisica = df_base_fisica
+        self.df_base_familia = df_base_familia
+        self.df_sku = df_sku
+        self.remessas = RemessaIndex(df_expedicao["REMESSA"])
+        self.catalogo = SkuCatalog(df_sku, df_base_fisica, df_base_familia)
+        self.pallets = PalletIndex(df_sap)
+        self.sobrepeso = SobrepesoIndex(df_sobrepeso_real)
+        self.assinaturas = assinaturas
+        self.carregado_em = datetime.now()
+
+class BaseRegistry:
+    """
+    Dono das bases de referência (expedição, SAP, SOBREPESO, simulador) e dos seus
+    índices. Carrega uma vez, recarrega em segundo plano no Refresh ou quando algum
+    arquivo muda, e entrega ao processamento o snapshot vigente.
+    """
+
+    def __init__(self, base_dir_docs, base_dir_aud, log=print):
+        self.base_dir_docs = base_dir_docs
+        self.base_dir_aud = base_dir_aud
+        self.log = log
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._thread = None
+
+    def arquivos(self):
+        return {
+            "expedicao": os.path.join(self.base_dir_aud, "rastreabilidade.csv"),
+            "sap": os.path.join(self.base_dir_docs, "base_sap.xlsx"),
+            "sobrepeso": os.path.join(self.base_dir_docs, "Base_sobrepeso_real.xlsx"),
+            "simulador": os.path.join(self.base_dir_docs, "SIMULADOR_BALANÇA_LIMPO_2.xlsx"),
+        }
+
+    def _assinaturas(self):
+        assinaturas = {}
+        for nome, path in self.arquivos().items():
+            try:
+                assinaturas[nome] = _assinatura_arquivo(path)
+            except OSError:
+                assinaturas[nome] = None
+        return assinaturas
+
+    def carregar(self):
+        """Lê todas as bases (via snapshots locais), monta os índices e publica o novo snapshot."""
+        log = self.log
+        arquivos = self.arquivos()
+        assinaturas = self._assinaturas()
+        inicio = time.time()
+
+        df_expedicao = carregar_base_expedicao_csv(self.base_dir_aud, log=log, incremental=True)
+        df_base_fisica, df_base_familia = carregar_base_fisica(self.base_dir_docs, log=log)
+        df_sku = ler_excel_cache(arquivos["simulador"], "dado_sku", log=log)
+        df_sap = ler_excel_cache(arquivos["sap"], "Sheet1", log=log)
+        df_sobrepeso_real = ler_excel_cache(arquivos["sobrepeso"], "SOBREPESO", log=log)
+
+        snapshot = BasesSnapshot(df_expedicao, df_sap, df_sobrepeso_real, df_base_fisica,
+                                 df_base_familia, df_sku, assinaturas, log=log)
+        with self._lock:
+            self._snapshot = snapshot
+        log(f"[bases] carregadas em {time.time() - inicio:.1f}s | expedição={len(df_expedicao)} "
+            f"sap={len(df_sap)} pallets={len(snapshot.pallets)} skus={len(snapshot.catalogo)} "
+            f"sobrepeso={len(df_sobrepeso_real)}")
+        return snapshot
+
+    def snapshot(self):
+        """Snapshot vigente; carrega de forma síncrona só na primeira vez."""
+        with self._lock:
+            snapshot = self._snapshot
+        return snapshot if snapshot is not None else self.carregar()
+
+    def houve_alteracao(self):
+        with self._lock:
+            snapshot = self._snapshot
+        return snapshot is None or snapshot.assinaturas != self._assinaturas()
+
+    def atualizando(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def atualizar_async(self, ao_terminar=None):
+        """
+        Recarrega em thread própria; o snapshot anterior segue valendo até o novo
+        ficar pronto. `ao_terminar(snapshot, erro)` é chamado na thread de carga.
+        """
+        if self.atualizando():
+            self.log("[bases] atualização já em andamento.")
+            return False
+
+        def _rodar():
+            try:
+                snapshot = self.carregar()
+                erro = None
+            except Exception as e:
+                snapshot, erro = None, e
+                self.log(f"[bases][erro] falha ao atualizar: {e!r}")
+            if ao_terminar:
+                ao_terminar(snapshot, erro)
+
+        self._thread = threading.Thread(target=_rodar, daemon=True)
+        self._thread.start()
+        return True
+
 ctk.set_appearance_mode("dark")
 ctk.set_default_color_theme("green")
 
+class _LinhaGrade:
+    """Widgets de uma linha visível da grade de edição; `pos` é a linha de dados_remessa exibida nela."""
+
+    def __init__(self, sku, qtd, chave):
+        self.sku = sku
+        self.qtd = qtd
+        self.chave = chave
+        self.excluir = None
+        self.pos = None
+
+    @property
+    def widgets(self):
+        return (self.sku, self.qtd, self.chave, self.excluir)
+
 class EdicaoRemessaFrame(ctk.CTkFrame):
+    LINHAS_VISIVEIS = 12
+    COLUNAS_DADOS = ["ITEM", "QUANTIDADE", "CHAVE_PALETE", "ID"]
+
     def __init__(self, master, df_expedicao, log_callback, app, *args, **kwargs):
         super().__init__(master, *args, **kwargs)
         self.fonte_dir = BASE_DIR_AUD
         self.remessa_editada = False
-        self.df_expedicao_original = df_expedicao.dropna(subset=["ITEM"]).copy()
+        self.df_expedicao_original = df_expedicao.dropna(subset=["ITEM"]).astype({"ITEM": object})
         # garante alias
         if "CHAVE_PALETE" not in self.df_expedicao_original.columns and "COD_RASTREABILIDADE" in self.df_expedicao_original.columns:
             self.df_expedicao_original["CHAVE_PALETE"] = self.df_expedicao_original["COD_RASTREABILIDADE"]
@@ -1262,8 +2900,24 @@ class EdicaoRemessaFrame(ctk.CTkFrame):
             .str.strip()
             .str.replace(r"\.0$", "", regex=True)
         )
-
-        self.dados_remessa = pd.DataFrame(columns=["ITEM", "QUANTIDADE", "CHAVE_PALETE"])
+        self.indice_remessas = RemessaIndex(self.df_expedicao_original["REMESSA"])
+
+        self.dados_remessa = pd.DataFrame(columns=self.COLUNAS_DADOS)
+        self._base_remessa = self.dados_remessa
+        self.alteracoes = AlteracoesRemessa(self.COLUNAS_DADOS)
+        self._remessa_carregada = None
+        self._proximo_id = 0
+        self._linhas_manuais = set()
+        self._visao = np.empty(0, dtype=np.intp)
+        self._topo = 0
+        self._totais_sku = {}
+        self._contagem_sku = {}
+        self._total_itens = 0
+        self._total_qtd = 0.0
+        self._textos_totais = None
+        self._rotulos_sku = {}
+        self._skus_exibidos = set()
+        self._filtro_totais = ""
 
         self.frame_superior = ctk.CTkFrame(self)
         self.frame_superior.pack(fill="x", padx=10, pady=(10, 0))
@@ -1304,8 +2958,7 @@ class EdicaoRemessaFrame(ctk.CTkFrame):
 
         self.frame_horizontal = ctk.CTkFrame(self)
         self.frame_horizontal.pack(fill="x", padx=10, pady=5)
-        self.tabela_frame = ctk.CTkScrollableFrame(self.frame_horizontal, height=350)
-        self.tabela_frame.pack(side="left", fill="both", expand=True, padx=(0, 5))
+        self._montar_grade()
 
         self.totals_center_frame = ctk.CTkFrame(self.frame_horizontal, width=150, fg_color="#1a1a1a")
         self.totals_center_frame.pack(side="left", fill="y", padx=5)
@@ -1343,50 +2996,117 @@ class EdicaoRemessaFrame(ctk.CTkFrame):
 
     def adicionar_linha(self):
         try:
-            df_nova = pd.DataFrame([{'ITEM': '', 'QUANTIDADE': 0, 'CHAVE_PALETE': None}])
-            self.dados_remessa = pd.concat([self.dados_remessa, df_nova], ignore_index=True)
+            novo = self._proximo_id
+            self._proximo_id += 1
+            valores = {'ITEM': '', 'QUANTIDADE': 0.0, 'CHAVE_PALETE': None, 'ID': None}
+            self.dados_remessa.loc[novo] = [valores[c] for c in self.COLUNAS_DADOS]
+            self.alteracoes.inserir(novo, valores)
+            self._linhas_manuais.add(novo)
+            self._topo = len(self.dados_remessa)
             self.renderizar_tabela()
-            self.tabela_frame._parent_canvas.yview_moveto(1.0)
             self.label_status.configure(text="Nova linha adicionada - preencha os dados", text_color="blue")
             self.log_callback("Nova linha adicionada para edição manual")
         except Exception as e:
             self.log_callback(f"Erro ao adicionar linha: {str(e)}")
             self.label_status.configure(text=f"Erro ao adicionar linha: {str(e)}", text_color="red")
 
-    def atualizar_totais_sku(self, filtro=""):
-        for w in self.sku_totals_scroll.winfo_children():
-            w.destroy()
-        filtro = filtro.lower().strip()
-        skus_totais = {}
-        for entry_sku, entry_qtd, _ in getattr(self, "entry_widgets", []):
-            sku = entry_sku.get() if entry_sku else getattr(entry_qtd, "sku_associado", "")
+    def _dados_visao(self):
+        return self.dados_remessa.iloc[self._visao]
+
+    @staticmethod
+    def _sku_texto(valor):
+        return str(valor) if pd.notna(valor) else ""
+
+    def _recalcular_totais(self):
+        """Totais da visão inteira (carga, filtro); daí em diante as edições só aplicam deltas."""
+        visao = self._dados_visao()
+        skus = visao["ITEM"].where(visao["ITEM"].notna(), "").astype(str)
+        qtd = visao["QUANTIDADE"].map(converter_para_float_seguro)
+        com_sku = (skus != "").to_numpy()
+        grupos = qtd[com_sku].groupby(skus[com_sku])
+        self._totais_sku = grupos.sum().to_dict()
+        self._contagem_sku = grupos.size().to_dict()
+        self._total_itens = int(com_sku.sum())
+        self._total_qtd = float(qtd.sum())
+
+    def _aplicar_delta_totais(self, sku_antes, qtd_antes, sku_depois, qtd_depois):
+        """Troca a contribuição de uma linha da visão (sku, qtd) nos totais, em O(1)."""
+        alterados = []
+        for sku, qtd, sinal in ((sku_antes, qtd_antes, -1), (sku_depois, qtd_depois, 1)):
             if not sku:
                 continue
-            qtd = converter_para_float_seguro(entry_qtd.get())
-            skus_totais[sku] = skus_totais.get(sku, 0) + qtd
-        skus_filtrados = {k: v for k, v in skus_totais.items() if filtro in str(k).lower()}
-        for sku, total in sorted(skus_filtrados.items(), key=lambda x: str(x[0])):
-            linha = ctk.CTkLabel(self.sku_totals_scroll, text=f"{sku} = {self.format_number(total)}", anchor="w")
-            linha.pack(fill="x", padx=6, pady=1)
+            self._totais_sku[sku] = self._totais_sku.get(sku, 0.0) + sinal * qtd
+            self._contagem_sku[sku] = self._contagem_sku.get(sku, 0) + sinal
+            if self._contagem_sku[sku] <= 0:
+                del self._totais_sku[sku], self._contagem_sku[sku]
+            self._total_itens += sinal
+            alterados.append(sku)
+        self._total_qtd += qtd_depois - qtd_antes
+        self._exibir_totais_gerais()
+
+        for sku in alterados:
+            visivel = sku in self._totais_sku and self._filtro_totais in sku.lower()
+            if visivel != (sku in self._skus_exibidos):
+                # SKU entrou ou saiu da lista: reposiciona só esse rótulo
+                self.atualizar_totais_sku(self._filtro_totais)
+                return
+            if visivel:
+                self._escrever_rotulo_sku(sku)
+
+    def _exibir_totais_gerais(self):
+        textos = (str(self._total_itens), self.format_number(round(self._total_qtd, 6)))
+        if textos != self._textos_totais:
+            self.total_itens_value.configure(text=textos[0])
+            self.total_qtd_value.configure(text=textos[1])
+            self._textos_totais = textos
+
+    def _escrever_rotulo_sku(self, sku):
+        texto = f"{sku} = {self.format_number(round(self._totais_sku[sku], 6))}"
+        rotulo = self._rotulos_sku.get(sku)
+        if rotulo is None:
+            rotulo = self._rotulos_sku[sku] = ctk.CTkLabel(self.sku_totals_scroll, text=texto, anchor="w")
+        elif rotulo.cget("text") != texto:
+            rotulo.configure(text=texto)
+        return rotulo
+
+    def atualizar_totais_sku(self, filtro=""):
+        """
+        Acerta os rótulos de `sku_totals_scroll` com os totais atuais: rótulos de SKUs
+        que continuam na lista só mudam se o texto mudou, os que saem são escondidos
+        e os que entram são encaixados na posição ordenada.
+        """
+        self._filtro_totais = filtro.lower().strip()
+        desejados = sorted((s for s in self._totais_sku if self._filtro_totais in s.lower()), key=str)
+
+        for sku in [s for s in self._rotulos_sku if s not in self._totais_sku]:
+            self._rotulos_sku.pop(sku).destroy()
+            self._skus_exibidos.discard(sku)
+        for sku in self._skus_exibidos - set(desejados):
+            self._rotulos_sku[sku].pack_forget()
+
+        seguinte = None
+        for sku in reversed(desejados):
+            rotulo = self._escrever_rotulo_sku(sku)
+            if sku not in self._skus_exibidos:
+                if seguinte is None:
+                    rotulo.pack(fill="x", padx=6, pady=1)
+                else:
+                    rotulo.pack(fill="x", padx=6, pady=1, before=seguinte)
+            seguinte = rotulo
+        self._skus_exibidos = set(desejados)
 
     def update_totals(self, event=None):
-        total_itens = 0
-        total_qtd = 0.0
-        for entry_sku, entry_qtd, _ in getattr(self, "entry_widgets", []):
-            sku = entry_sku.get() if entry_sku else getattr(entry_qtd, "sku_associado", "")
-            if sku:
-                total_itens += 1
-            total_qtd += converter_para_float_seguro(entry_qtd.get())
-        self.total_itens_value.configure(text=str(total_itens))
-        self.total_qtd_value.configure(text=self.format_number(total_qtd))
-        self.atualizar_totais_sku()
+        self._recalcular_totais()
+        self._exibir_totais_gerais()
+        self.atualizar_totais_sku(self.filtro_sku_totais.get())
 
     def remessa_existe_na_base(self, remessa, df_base):
+        if isinstance(df_base, RemessaIndex):
+            return df_base.existe(remessa)
         if df_base.empty or 'REMESSA' not in df_base.columns:
             return False
         try:
-            mask = _match_remessa_series(df_base['REMESSA'], remessa)
-            return bool(mask.any())
+            return RemessaIndex(df_base['REMESSA']).existe(remessa)
         except Exception as e:
             self.log_callback(f"Erro ao verificar remessa: {str(e)}")
             return False
@@ -1400,42 +3120,41 @@ class EdicaoRemessaFrame(ctk.CTkFrame):
 
         try:
             self.log_callback(f"Verificando base auxiliar para remessa {remessa}...")
-            df_base_auxiliar = carregar_base_auxiliar(self.fonte_dir)
-
-            df_filtrado = pd.DataFrame()
+            df_filtrado = carregar_remessa_auxiliar(remessa, self.fonte_dir)
             self.remessa_editada = False
 
-            if not df_base_auxiliar.empty:
-                mask_aux = _match_remessa_series(df_base_auxiliar['REMESSA'], remessa)
-                if mask_aux.any():
-                    self.remessa_editada = True
-                    self.label_status.configure(
-                        text="ATENÇÃO: Esta remessa já foi editada anteriormente!",
-                        text_color="orange"
-                    )
-                    self.log_callback(f"Remessa {remessa} encontrada na base auxiliar - carregando dados editados")
-                    df_filtrado = df_base_auxiliar.loc[mask_aux]
-                else:
-                    self.log_callback(f"Remessa {remessa} não encontrada na base auxiliar - buscando na base original")
+            if not df_filtrado.empty:
+                self.remessa_editada = True
+                self.label_status.configure(
+                    text="ATENÇÃO: Esta remessa já foi editada anteriormente!",
+                    text_color="orange"
+                )
+                self.log_callback(f"Remessa {remessa} encontrada na base auxiliar - carregando dados editados")
             else:
-                self.log_callback("Base auxiliar vazia ou não encontrada - buscando na base original")
+                self.log_callback(f"Remessa {remessa} não encontrada na base auxiliar - buscando na base original")
 
             if df_filtrado.empty:
                 self.log_callback(f"Buscando remessa {remessa} na base original...")
-                mask_ori = _match_remessa_series(self.df_expedicao_original['REMESSA'], remessa)
-                df_filtrado = self.df_expedicao_original.loc[mask_ori].dropna(subset=['ITEM']).copy()
+                posicoes = self.indice_remessas.posicoes(remessa)
+                df_filtrado = self.df_expedicao_original.iloc[posicoes].dropna(subset=['ITEM']).copy()
                 if df_filtrado.empty:
                     self.log_callback("Remessa não encontrado em nenhuma base!")
                     self.label_status.configure(text="Remessa não encontrada em nenhuma base!", text_color="red")
                     return
 
+            if not self.remessa_editada:
+                # ids da base auxiliar são os rowids dela; da base original, só posições
+                df_filtrado = df_filtrado.reset_index(drop=True)
             colunas_unicas = ['ITEM', 'QUANTIDADE', 'CHAVE_PALETE','ID']
-            df_sem_duplicatas = df_filtrado.drop_duplicates(subset=colunas_unicas)
+            df_sem_duplicatas = df_filtrado.reindex(columns=colunas_unicas).drop_duplicates(subset=colunas_unicas)
+            self._definir_dados(df_sem_duplicatas, remessa)
             if len(df_filtrado) != len(df_sem_duplicatas):
                 duplicatas = len(df_filtrado) - len(df_sem_duplicatas)
+                if self.remessa_editada:
+                    for rid in df_filtrado.index.difference(df_sem_duplicatas.index):
+                        self.alteracoes.remover(rid)
                 self.log_callback(f"Removidas {duplicatas} linhas duplicadas automaticamente.")
 
-            self.dados_remessa = df_sem_duplicatas[['ITEM', 'QUANTIDADE', 'CHAVE_PALETE']].copy()
             self.renderizar_tabela()
 
         except Exception as e:
@@ -1444,35 +3163,34 @@ class EdicaoRemessaFrame(ctk.CTkFrame):
             self.label_status.configure(text=error_msg, text_color="red")
             self.log_callback(f"Traceback completo: {traceback.format_exc()}")
 
-
-    def salvar_alteracoes_antes_filtro(self):
-        if not hasattr(self, "entry_widgets") or not self.entry_widgets:
-            return
-        try:
-            for entry_sku, entry_qtd, entry_chave in self.entry_widgets:
-                original_idx = getattr(entry_qtd, "original_idx", None)
-                if original_idx is None or original_idx not in self.dados_remessa.index:
-                    continue
-                sku = entry_sku.get() if entry_sku else getattr(entry_qtd, "sku_associado", "")
-                qtd = converter_para_float_seguro(entry_qtd.get())
-                chave = entry_chave.get()
-                self.dados_remessa.at[original_idx, "ITEM"] = sku or None
-                self.dados_remessa.at[original_idx, "QUANTIDADE"] = qtd
-                self.dados_remessa.at[original_idx, "CHAVE_PALETE"] = chave or None
-            self.log_callback("Alterações salvas antes de aplicar filtros")
-        except Exception as e:
-            self.log_callback(f"Erro ao salvar alterações antes de filtrar: {str(e)}")
+    def _definir_dados(self, df, remessa=None):
+        """
+        Troca a remessa em edição. O índice de `df` é o id de cada linha e vira a chave
+        das alterações; `_base_remessa` guarda o estado carregado, ao qual elas se aplicam.
+        """
+        df = df.reindex(columns=self.COLUNAS_DADOS)
+        df = df.astype({"ITEM": object, "CHAVE_PALETE": object, "ID": object})
+        df["QUANTIDADE"] = df["QUANTIDADE"].map(converter_para_float_seguro).astype(float)
+        self.dados_remessa = df
+        self._base_remessa = df.copy()
+        self.alteracoes = AlteracoesRemessa(self.COLUNAS_DADOS)
+        self._remessa_carregada = remessa
+        self._proximo_id = int(df.index.max()) + 1 if len(df) else 0
+        self._linhas_manuais = set()
+        self._topo = 0
 
     def filtrar_dados(self):
-        self.salvar_alteracoes_antes_filtro()
         filtro_chave = self.filtro_chave.get().strip().lower()
         filtro_sku = self.filtro_sku.get().strip().lower()
-        df_filtrado = self.dados_remessa.copy()
+        mascara = np.ones(len(self.dados_remessa), dtype=bool)
         if filtro_chave:
-            df_filtrado = df_filtrado[df_filtrado["CHAVE_PALETE"].fillna("").astype(str).str.lower().str.contains(filtro_chave)]
+            mascara &= (self.dados_remessa["CHAVE_PALETE"].fillna("").astype(str).str.lower()
+                        .str.contains(filtro_chave, regex=False).to_numpy())
         if filtro_sku:
-            df_filtrado = df_filtrado[df_filtrado["ITEM"].astype(str).str.lower().str.contains(filtro_sku)]
-        self.renderizar_tabela(df_filtrado)
+            mascara &= (self.dados_remessa["ITEM"].fillna("").astype(str).str.lower()
+                        .str.contains(filtro_sku, regex=False).to_numpy())
+        self._topo = 0
+        self.renderizar_tabela(np.flatnonzero(mascara))
 
     def salvar_alteracoes(self):
         try:
@@ -1481,24 +3199,34 @@ class EdicaoRemessaFrame(ctk.CTkFrame):
                 self.log_callback("Nenhuma remessa selecionada para salvar")
                 return
 
-            df_completo = pd.DataFrame(columns=["ITEM", "QUANTIDADE", "CHAVE_PALETE"])
-            for entry_sku, entry_qtd, entry_chave in self.entry_widgets:
-                sku = entry_sku.get() if entry_sku else getattr(entry_qtd, "sku_associado", "")
-                if not sku:
-                    continue
-                qtd = converter_para_float_seguro(entry_qtd.get())
-                chave = entry_chave.get() or None
-                df_completo = pd.concat([df_completo, pd.DataFrame([{"ITEM": str(sku).strip(), "QUANTIDADE": qtd, "CHAVE_PALETE": (str(chave).strip() if chave else None)}])], ignore_index=True)
+            df_completo = self.alteracoes.aplicar(self._base_remessa)
+            # linhas sem SKU e repetidas (mesmo SKU e chave, como na base auxiliar) saem como remoções
+            itens = df_completo["ITEM"].where(df_completo["ITEM"].notna(), "").astype(str).str.strip()
+            chaves = df_completo["CHAVE_PALETE"].where(df_completo["CHAVE_PALETE"].notna(), "").astype(str).str.strip()
+            descartar = (itens == "") | pd.DataFrame({"i": itens, "c": chaves}).duplicated(keep="last")
+            for rid in df_completo.index[descartar.to_numpy()]:
+                self.alteracoes.remover(rid)
+            df_completo = df_completo.loc[~descartar.to_numpy()]
 
             if df_completo.empty:
                 self.label_status.configure(text="Nenhum dado válido para salvar!", text_color="orange")
                 return
 
-            df_completo["REMESSA"] = remessa
-            df_completo = df_completo.drop_duplicates(subset=["ITEM", "CHAVE_PALETE","ID"], keep="last")
-            salvar_em_base_auxiliar(df_completo, remessa, self.log_callback, self.fonte_dir)
+            mesma_remessa = (self._remessa_carregada is not None
+                             and _norm_remessa_tuple(self._remessa_carregada)[1] == _norm_remessa_tuple(remessa)[1])
+            if self.remessa_editada and mesma_remessa:
+                salvar_alteracoes_base_auxiliar(remessa, self.alteracoes, self.log_callback, self.fonte_dir)
+            else:
+                df_completo = df_completo.assign(
+                    ITEM=itens.loc[df_completo.index],
+                    CHAVE_PALETE=chaves.loc[df_completo.index].where(chaves.loc[df_completo.index] != "", None),
+                    REMESSA=remessa,
+                )
+                salvar_em_base_auxiliar(df_completo, remessa, self.log_callback, self.fonte_dir)
 
-            self.dados_remessa = df_completo[["ITEM", "QUANTIDADE", "CHAVE_PALETE"]].copy()
+            # relê da base auxiliar para que os ids passem a ser os rowids gravados
+            self.remessa_editada = True
+            self._definir_dados(carregar_remessa_auxiliar(remessa, self.fonte_dir), remessa)
             self.renderizar_tabela()
             self.label_status.configure(text=f"Alterações salvas! Itens: {len(df_completo)}", text_color="green")
             self.log_callback(f"Remessa {remessa} salva com {len(df_completo)} itens")
@@ -1507,74 +3235,245 @@ class EdicaoRemessaFrame(ctk.CTkFrame):
             self.label_status.configure(text=f"Erro ao salvar: {str(e)}", text_color="red")
             self.log_callback(f"[ERRO] Ao salvar: {traceback.format_exc()}")
 
-    def renderizar_tabela(self, df_filtrado=None):
-        for widget in self.tabela_frame.winfo_children():
-            widget.destroy()
-        df_exibicao = (df_filtrado.copy() if df_filtrado is not None else self.dados_remessa.copy()).drop_duplicates(subset=["ITEM", "QUANTIDADE", "CHAVE_PALETE","ID"], keep="last")
-        if df_exibicao.empty:
-            self.log_callback("Nenhum dado para exibir.")
-            return
+    # --- grade virtualizada: LINHAS_VISIVEIS linhas de widgets, revinculadas ao rolar ---
+
+    def _montar_grade(self):
+        container = ctk.CTkFrame(self.frame_horizontal, height=350)
+        container.pack(side="left", fill="both", expand=True, padx=(0, 5))
+        self.scroll_tabela = ctk.CTkScrollbar(container, command=self._rolar_tabela)
+        self.scroll_tabela.pack(side="right", fill="y")
+        self.tabela_frame = ctk.CTkFrame(container, fg_color="transparent")
+        self.tabela_frame.pack(side="left", fill="both", expand=True)
+        self.tabela_frame.grid_columnconfigure((0, 1, 2), weight=1)
+        self.tabela_frame.bind("<MouseWheel>", self._rolar_com_mouse)
+        self.tabela_frame.bind("<Button-4>", self._rolar_com_mouse)
+        self.tabela_frame.bind("<Button-5>", self._rolar_com_mouse)
 
-        self.entry_widgets = []
         headers = ["SKU", "Quantidade", "Chave Pallet", "Ações"]
         for col, header in enumerate(headers):
             ctk.CTkLabel(self.tabela_frame, text=header, font=("Arial", 12, "bold")).grid(row=0, column=col, padx=10, pady=5, sticky="ew")
 
-        for display_row, (idx, row) in enumerate(df_exibicao.iterrows(), start=1):
-            try:
-                sku = str(row["ITEM"]) if pd.notna(row["ITEM"]) else ""
-                qtd = str(row["QUANTIDADE"]) if pd.notna(row["QUANTIDADE"]) else "0"
-                chave = str(row["CHAVE_PALETE"]) if pd.notna(row["CHAVE_PALETE"]) else ""
-
-                if sku == "":
-                    entry_sku = ctk.CTkEntry(self.tabela_frame, placeholder_text="Digite o SKU", fg_color="#2a2a4a", border_color="#4a4a7a")
-                    entry_sku.insert(0, sku)
-                    entry_sku.grid(row=display_row, column=0, padx=10, pady=2, sticky="ew")
-                else:
-                    ctk.CTkLabel(self.tabela_frame, text=sku).grid(row=display_row, column=0, padx=10, pady=2, sticky="w")
-                    entry_sku = None
-
-                entry_qtd = ctk.CTkEntry(self.tabela_frame)
-                entry_qtd.insert(0, qtd)
-                entry_qtd.grid(row=display_row, column=1, padx=10, pady=2, sticky="ew")
-                entry_qtd.sku_associado = entry_sku.get() if entry_sku else sku
-                entry_qtd.original_idx = idx
-                entry_qtd.bind("<KeyRelease>", self.update_totals)
-
-                entry_chave = ctk.CTkEntry(self.tabela_frame)
-                entry_chave.insert(0, chave)
-                entry_chave.grid(row=display_row, column=2, padx=10, pady=2, sticky="ew")
-                entry_chave.original_idx = idx
-
-                botao_excluir = ctk.CTkButton(self.tabela_frame, text="🗑", width=30, command=lambda idx=idx: self.remover_linha(idx), fg_color="#d44646", hover_color="#a33535")
-                botao_excluir.grid(row=display_row, column=3, padx=5, pady=2)
-
-                if entry_sku:
-                    entry_sku.bind("<KeyRelease>", lambda e, entry_qtd=entry_qtd: setattr(entry_qtd, "sku_associado", e.widget.get()))
-                    self.entry_widgets.append((entry_sku, entry_qtd, entry_chave))
-                else:
-                    self.entry_widgets.append((None, entry_qtd, entry_chave))
-            except Exception as e:
-                self.log_callback(f"Erro ao renderizar linha {idx}: {str(e)}")
-                continue
+        self._linhas_grade = []
+        for display_row in range(1, self.LINHAS_VISIVEIS + 1):
+            linha = _LinhaGrade(
+                ctk.CTkEntry(self.tabela_frame, placeholder_text="Digite o SKU"),
+                ctk.CTkEntry(self.tabela_frame),
+                ctk.CTkEntry(self.tabela_frame),
+            )
+            linha.excluir = ctk.CTkButton(self.tabela_frame, text="🗑", width=30, command=lambda linha=linha: self._remover_linha_grade(linha), fg_color="#d44646", hover_color="#a33535")
+            linha.sku.grid(row=display_row, column=0, padx=10, pady=2, sticky="ew")
+            linha.qtd.grid(row=display_row, column=1, padx=10, pady=2, sticky="ew")
+            linha.chave.grid(row=display_row, column=2, padx=10, pady=2, sticky="ew")
+            linha.excluir.grid(row=display_row, column=3, padx=5, pady=2)
+
+            linha.sku.bind("<KeyRelease>", lambda e, linha=linha: self._editar_celula(linha, "ITEM"))
+            linha.qtd.bind("<KeyRelease>", lambda e, linha=linha: self._editar_celula(linha, "QUANTIDADE"))
+            linha.chave.bind("<KeyRelease>", lambda e, linha=linha: self._editar_celula(linha, "CHAVE_PALETE"))
+            for widget in linha.widgets:
+                widget.bind("<MouseWheel>", self._rolar_com_mouse)
+                widget.bind("<Button-4>", self._rolar_com_mouse)
+                widget.bind("<Button-5>", self._rolar_com_mouse)
+                widget.grid_remove()
+            self._linhas_grade.append(linha)
+
+        self._cores_sku_fixo = (self._linhas_grade[0].sku.cget("fg_color"), self._linhas_grade[0].sku.cget("border_color"))
+
+    def _rolar_tabela(self, acao, valor, unidade=None):
+        if acao == "moveto":
+            self._topo = int(round(float(valor) * len(self._visao)))
+        else:
+            passo = int(float(valor))
+            self._topo += passo * self.LINHAS_VISIVEIS if unidade == "pages" else passo
+        self._exibir_visao()
+
+    def _rolar_com_mouse(self, event):
+        self._topo += -3 if (event.num == 4 or event.delta > 0) else 3
+        self._exibir_visao()
+        return "break"
+
+    @staticmethod
+    def _preencher_entry(entry, texto, editavel=True):
+        entry.configure(state="normal")
+        entry.delete(0, "end")
+        if texto:
+            entry.insert(0, texto)
+        if not editavel:
+            entry.configure(state="disabled")
+
+    def _vincular_linha(self, linha, pos):
+        linha.pos = pos
+        item, qtd, chave = (self.dados_remessa.iat[pos, c] for c in range(3))
+        sku = str(item) if pd.notna(item) else ""
+        editavel = sku == "" or self.dados_remessa.index[pos] in self._linhas_manuais
+        self._preencher_entry(linha.sku, sku, editavel)
+        if editavel:
+            linha.sku.configure(fg_color="#2a2a4a", border_color="#4a4a7a")
+        else:
+            linha.sku.configure(fg_color=self._cores_sku_fixo[0], border_color=self._cores_sku_fixo[1])
+        self._preencher_entry(linha.qtd, str(qtd) if pd.notna(qtd) else "0")
+        self._preencher_entry(linha.chave, str(chave) if pd.notna(chave) else "")
+
+    def _exibir_visao(self):
+        """Revincula as linhas de widgets à janela [_topo, _topo + LINHAS_VISIVEIS) da visão."""
+        total = len(self._visao)
+        self._topo = max(0, min(self._topo, total - self.LINHAS_VISIVEIS))
+        for k, linha in enumerate(self._linhas_grade):
+            i = self._topo + k
+            if i < total:
+                self._vincular_linha(linha, int(self._visao[i]))
+                for widget in linha.widgets:
+                    widget.grid()
+            else:
+                linha.pos = None
+                for widget in linha.widgets:
+                    widget.grid_remove()
+        if total:
+            self.scroll_tabela.set(self._topo / total, min(1.0, (self._topo + self.LINHAS_VISIVEIS) / total))
+        else:
+            self.scroll_tabela.set(0.0, 1.0)
 
+    def _editar_celula(self, linha, coluna):
+        if linha.pos is None:
+            return
+        entry = {"ITEM": linha.sku, "QUANTIDADE": linha.qtd, "CHAVE_PALETE": linha.chave}[coluna]
+        texto = entry.get().strip()
+        valor = converter_para_float_seguro(texto) if coluna == "QUANTIDADE" else (texto or None)
+        atual = self.dados_remessa.iat[linha.pos, self.COLUNAS_DADOS.index(coluna)]
+        if coluna == "QUANTIDADE":
+            atual = converter_para_float_seguro(atual)
+        else:
+            atual = None if pd.isna(atual) else (str(atual).strip() or None)
+        # <KeyRelease> também dispara com Tab, setas e Shift: sem mudança, nada a registrar
+        if atual == valor:
+            return
+        sku_antes = self._sku_texto(self.dados_remessa.iat[linha.pos, 0])
+        qtd_antes = converter_para_float_seguro(self.dados_remessa.iat[linha.pos, 1])
+        self.dados_remessa.iat[linha.pos, self.COLUNAS_DADOS.index(coluna)] = valor
+        self.alteracoes.alterar(self.dados_remessa.index[linha.pos], coluna, valor)
+        if coluna != "CHAVE_PALETE":
+            self._aplicar_delta_totais(sku_antes, qtd_antes,
+                                       self._sku_texto(self.dados_remessa.iat[linha.pos, 0]),
+                                       converter_para_float_seguro(self.dados_remessa.iat[linha.pos, 1]))
+
+    def _remover_linha_grade(self, linha):
+        if linha.pos is not None:
+            self.remover_linha(self.dados_remessa.index[linha.pos])
+
+    def limpar_tabela(self):
+        self._definir_dados(pd.DataFrame(columns=self.COLUNAS_DADOS))
+        self._visao = np.empty(0, dtype=np.intp)
+        self._exibir_visao()
+        self.update_totals()
+
+    def renderizar_tabela(self, posicoes=None):
+        """Mostra as linhas `posicoes` de dados_remessa (todas, por padrão); só os widgets visíveis existem."""
+        if posicoes is None:
+            posicoes = np.arange(len(self.dados_remessa))
+        self._visao = np.asarray(posicoes, dtype=np.intp)
+        if not len(self._visao):
+            self.log_callback("Nenhum dado para exibir.")
+        self._exibir_visao()
         self.update_totals()
 
     def remover_linha(self, index):
         try:
             if not self.dados_remessa.empty and index in self.dados_remessa.index:
+                pos = self.dados_remessa.index.get_loc(index)
+                na_visao = bool((self._visao == pos).any())
+                sku = self._sku_texto(self.dados_remessa.iat[pos, 0])
+                qtd = converter_para_float_seguro(self.dados_remessa.iat[pos, 1])
                 self.dados_remessa = self.dados_remessa.drop(index)
-                self.renderizar_tabela()
+                self.alteracoes.remover(index)
+                self._linhas_manuais.discard(index)
+                self._visao = self._visao[self._visao != pos]
+                self._visao[self._visao > pos] -= 1
+                self._exibir_visao()
+                if na_visao:
+                    self._aplicar_delta_totais(sku, qtd, "", 0.0)
                 self.label_status.configure(text="Linha removida com sucesso!", text_color="green")
                 self.log_callback(f"Linha {index} removida da remessa {self.remessa_var.get()}")
-                self.update_totals()
             else:
                 self.log_callback(f"Índice inválido para remoção: {index}")
         except Exception as e:
             self.log_callback(f"Erro ao remover linha: {str(e)}")
             self.label_status.configure(text=f"Erro ao remover linha: {str(e)}", text_color="red")
 
+class FilaRemessasFrame(ctk.CTkFrame):
+    def __init__(self, master, app, *args, **kwargs):
+        super().__init__(master, *args, **kwargs)
+        self.app = app
+        self.peso_vazio_var = StringVar(value="0")
+
+        topo = ctk.CTkFrame(self)
+        topo.pack(fill="x", padx=10, pady=(10, 5))
+        ctk.CTkLabel(topo, text="Fila de Remessas", font=("Arial", 14, "bold")).pack(side="left", padx=5)
+        self.botao_simular = ctk.CTkButton(topo, text="▶ Simular Fila", command=self.simular, width=150, fg_color="#2aa745")
+        self.botao_simular.pack(side="right", padx=5)
+
+        form = ctk.CTkFrame(self)
+        form.pack(fill="x", padx=10, pady=5)
+        ctk.CTkLabel(form, text="Remessas (uma por linha, separadas por vírgula ou intervalos 8001240-8001250):").pack(anchor="w", padx=5)
+        self.texto_remessas = ctk.CTkTextbox(form, height=90)
+        self.texto_remessas.pack(fill="x", padx=5, pady=(0, 5))
+        ctk.CTkLabel(form, text="Peso Veículo Vazio (kg):").pack(anchor="w", padx=5)
+        ctk.CTkEntry(form, textvariable=self.peso_vazio_var, width=150).pack(anchor="w", padx=5, pady=(0, 5))
+
+        self.label_status = ctk.CTkLabel(self, text="", font=("Arial", 12, "bold"))
+        self.label_status.pack(fill="x", padx=10)
+
+        self.resultado = ctk.CTkTextbox(self, wrap="none", font=("Consolas", 10))
+        self.resultado.pack(fill="both", expand=True, padx=10, pady=(5, 10))
+        self.resultado.configure(state="disabled")
+
+    def simular(self):
+        try:
+            remessas = interpretar_fila_remessas(self.texto_remessas.get("1.0", "end"))
+        except ValueError as e:
+            self.label_status.configure(text=f"Lista de remessas inválida: {e}", text_color="red")
+            return
+        if not remessas:
+            self.label_status.configure(text="Informe ao menos uma remessa.", text_color="orange")
+            return
+        peso_vazio = converter_para_float_seguro(self.peso_vazio_var.get())
+
+        self.botao_simular.configure(state="disabled")
+        self.label_status.configure(text=f"Simulando {len(remessas)} remessa(s)...", text_color="#2a7fff")
+        self.app.add_log(f"[fila] iniciando simulação de {len(remessas)} remessa(s)")
+        threading.Thread(target=self._rodar, args=(remessas, peso_vazio), daemon=True).start()
+
+    def _rodar(self, remessas, peso_vazio):
+        try:
+            bases = self.app.bases.snapshot()
+            resumo = simular_fila_remessas(remessas, bases, peso_vazio=peso_vazio, log=self.app.add_log)
+            destino = salvar_resumo_fila(resumo, caminho_resumo_fila_padrao(), log=self.app.add_log)
+            erro = None
+        except Exception as e:
+            resumo, destino, erro = None, None, e
+            self.app.add_log(f"[fila][erro] {e!r}\n{traceback.format_exc()}")
+        self.after(0, self._mostrar_resumo, resumo, destino, erro)
+
+    def _mostrar_resumo(self, resumo, destino, erro):
+        self.botao_simular.configure(state="normal")
+        if erro is not None:
+            self.label_status.configure(text=f"Erro ao simular fila: {erro}", text_color="red")
+            return
+        ok = int((resumo["Status"] == "ok").sum())
+        self.label_status.configure(text=f"{ok}/{len(resumo)} remessas simuladas. Resumo salvo em: {destino}", text_color="green")
+        exibicao = resumo[["Remessa", "Status", "Pallets", "Peso Estimado (kg)", "Limite Inferior (kg)",
+                           "Limite Superior (kg)", "Família", "% SP Real"]].copy()
+        exibicao["% SP Real"] = exibicao["% SP Real"].map(lambda v: "" if pd.isna(v) else f"{v:.1%}")
+        self.resultado.configure(state="normal")
+        self.resultado.delete("1.0", "end")
+        self.resultado.insert("end", exibicao.to_string(index=False, float_format=lambda v: f"{v:,.2f}", na_rep=""))
+        self.resultado.configure(state="disabled")
+
+
 class App(ctk.CTk):
+    INTERVALO_VERIFICACAO_BASES_MS = 60_000
+    INTERVALO_LOGS_MS = 50
+    MAX_LINHAS_LOG_TELA = 3000
+    MAX_LOGS_POR_DRENAGEM = 2000
+
     def __init__(self):
         super().__init__()
         self.title("Simulador de Sobrepeso 5.0")
@@ -1642,80 +3541,136 @@ class App(ctk.CTk):
         self.log_text = []
         self.log_geral = []
         self.log_tecnico = []
+        self._fila_logs = queue.SimpleQueue()
+        self._linhas_log_tela = 0
+        self.after(self.INTERVALO_LOGS_MS, self._drenar_logs)
+        # registros do motor de cálculo: a tela recebe tudo o que passa no nível do logger;
+        # o e-mail, só INFO para cima. Mensagens do fluxo entram por log_callback_completo.
+        logger.addHandler(_LogParaCallback(self.add_log))
+        logger.addHandler(_LogParaCallback(lambda msg: self.log_geral.append(self._formatar_log(msg)), logging.INFO))
 
         self.tab_edicao = self.tabs.add("Edição de Remessa")
-        self.df_expedicao = carregar_base_expedicao_csv(BASE_DIR_AUD, log=self.add_log)
+        self.bases = BaseRegistry(BASE_DIR_DOCS, BASE_DIR_AUD, log=self.add_log)
+        self.df_expedicao = self.bases.carregar().df_expedicao
         self.add_log(f"Base de expedição (CSV Auditoria) carregada com {len(self.df_expedicao)} linhas "
              f"e {self.df_expedicao['REMESSA'].nunique()} remessas.")
 
         self.edicao_frame = EdicaoRemessaFrame(master=self.tab_edicao, df_expedicao=self.df_expedicao, log_callback=self.add_log, app=self)
         self.edicao_frame.pack(fill="both", expand=True, padx=10, pady=10)
 
+        self.tab_fila = self.tabs.add("Fila de Remessas")
+        self.fila_frame = FilaRemessasFrame(master=self.tab_fila, app=self)
+        self.fila_frame.pack(fill="both", expand=True, padx=10, pady=10)
+
         footer_label = ctk.CTkLabel(self, text="Desenvolvido por Douglas Lins - Analista de Logística", font=("Arial", 10), anchor="center")
         footer_label.grid(row=1, column=0, columnspan=2, pady=(0, 10))
 
+        self.after(self.INTERVALO_VERIFICACAO_BASES_MS, self._verificar_bases)
 
 
     def atualizar_bases(self):
-        try:
-            self.add_log("⏳ Atualizando bases do OneDrive...")
-            path_base_sobrepeso = os.path.join(BASE_DIR_DOCS, "Base_sobrepeso_real.xlsx")
-            path_base_sap       = os.path.join(BASE_DIR_DOCS, "base_sap.xlsx")
+        if self.bases.atualizar_async(ao_terminar=lambda snap, erro: self.after(0, self._bases_atualizadas, snap, erro)):
+            self.add_log("⏳ Atualizando bases do OneDrive em segundo plano...")
 
-            df_expedicao = carregar_base_expedicao_csv(BASE_DIR_AUD, log=self.add_log)
+    def _bases_atualizadas(self, snapshot, erro):
+        if erro is not None:
+            self.add_log(f"Erro ao atualizar bases: {erro}")
+            return
 
-            _ = pd.read_excel(path_base_sap, sheet_name="Sheet1")       
-            _ = pd.read_excel(path_base_sobrepeso, sheet_name="SOBREPESO") 
+        self.edicao_frame.df_expedicao = snapshot.df_expedicao
+        self.df_expedicao = snapshot.df_expedicao
 
-            self.edicao_frame.df_expedicao = df_expedicao
-            self.df_expedicao = df_expedicao
+        self.edicao_frame.remessa_var.set("")
+        self.edicao_frame.filtro_chave.set("")
+        self.edicao_frame.filtro_sku.set("")
+        self.edicao_frame.limpar_tabela()
 
-           
-            self.edicao_frame.remessa_var.set("")
-            self.edicao_frame.filtro_chave.set("")
-            self.edicao_frame.filtro_sku.set("")
-            for widget in self.edicao_frame.tabela_frame.winfo_children():
-                widget.destroy()
+        self.add_log("Bases atualizadas com sucesso!")
 
-            self.add_log("Bases atualizadas com sucesso!")
+    def _verificar_bases(self):
+        try:
+            if not self.bases.atualizando() and self.bases.houve_alteracao():
+                self.add_log("[bases] alteração detectada nos arquivos do OneDrive.")
+                self.atualizar_bases()
         except Exception as e:
-            self.add_log(f"Erro ao atualizar bases: {e}")
+            self.add_log(f"[bases][erro] ao verificar alterações: {e!r}")
+        self.after(self.INTERVALO_VERIFICACAO_BASES_MS, self._verificar_bases)
 
     def add_log(self, msg):
+        """
+        Pode ser chamado de qualquer thread: registra em log_text e enfileira a linha
+        para a tela. Quem escreve no Textbox é só o loop do Tk, em `_drenar_logs`.
+        Devolve a linha formatada (log_text[-1] pode já ser de outra thread).
+        """
+        entrada = self._formatar_log(msg)
+        self.log_text.append(entrada)
+        self._fila_logs.put(entrada)
+        return entrada
+
+    @staticmethod
+    def _formatar_log(msg):
         if isinstance(msg, str) and msg.startswith("[") and "] " in msg[:10]:
-            entrada = msg
-        else:
-            timestamp = datetime.now().strftime("%H:%M:%S")
-            entrada = f"[{timestamp}] {msg}"
+            return msg
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        return f"[{timestamp}] {msg}"
 
-        self.log_text.append(entrada)                 
-        self.log_display.configure(state="normal")
-        self.log_display.insert("end", entrada + "\n")
-        self.log_display.see("end")
-        self.log_display.configure(state="disabled")
+    def _drenar_logs(self):
+        """Escreve no Textbox, de uma vez, o que chegou desde a última passada e corta o excesso do topo."""
+        try:
+            entradas = []
+            try:
+                while len(entradas) < self.MAX_LOGS_POR_DRENAGEM:
+                    entradas.append(self._fila_logs.get_nowait())
+            except queue.Empty:
+                pass
+
+            if entradas:
+                texto = "\n".join(entradas) + "\n"
+                self.log_display.configure(state="normal")
+                self.log_display.insert("end", texto)
+                self._linhas_log_tela += texto.count("\n")
+                excesso = self._linhas_log_tela - self.MAX_LINHAS_LOG_TELA
+                if excesso > 0:
+                    self.log_display.delete("1.0", f"{excesso + 1}.0")
+                    self._linhas_log_tela -= excesso
+                self.log_display.see("end")
+                self.log_display.configure(state="disabled")
+        finally:
+            # fila ainda cheia: volta logo em vez de esperar o intervalo inteiro
+            atraso = 1 if not self._fila_logs.empty() else self.INTERVALO_LOGS_MS
+            self.after(atraso, self._drenar_logs)
 
 
     def limpar_logs(self):
         self.log_text.clear()
         self.log_geral.clear()
+        try:
+            while True:
+                self._fila_logs.get_nowait()
+        except queue.Empty:
+            pass
+        self._linhas_log_tela = 0
         self.log_display.configure(state="normal")
         self.log_display.delete("1.0", "end")
         self.log_display.configure(state="disabled")
 
     def log_callback_completo(self, mensagem):
-        self.add_log(mensagem)
-        self.log_geral.append(self.log_text[-1])
+        """
+        Mensagem do fluxo de processamento: vai para a tela e para o corpo do e-mail
+        sempre, fora do logger, para não depender do nível configurado.
+        """
+        self.log_geral.append(self.add_log(mensagem))
 
 
     def log_callback_tecnico(self, mensagem):
-        self.add_log(mensagem)
-        self.log_tecnico.append(self.log_text[-1])
+        self.log_tecnico.append(self.add_log(mensagem))
 
 
     def iniciar_processamento(self):
         self.progress_bar.pack()
         self.progress_bar.set(0)
-        self.add_log("Iniciando cálculo...")
+        self.log_geral.clear()
+        self.log_callback_completo("Iniciando cálculo...")
         threading.Thread(target=self.processar).start()
 
     def processar(self):
@@ -1727,37 +3682,28 @@ class App(ctk.CTk):
             peso_balanca = float(self.peso_balanca.get())
             qtd_paletes = int(float(self.qtd_paletes.get()))
 
-            path_base_sobrepeso = os.path.join(BASE_DIR_DOCS, "Base_sobrepeso_real.xlsx")
-            path_base_sap       = os.path.join(BASE_DIR_DOCS, "base_sap.xlsx")
-            file_path = criar_copia_planilha(BASE_DIR_DOCS, "SIMULADOR_BALANÇA_LIMPO_2.xlsx", self.add_log)
-
-            df_base_fisica, df_base_familia_local = carregar_base_fisica(BASE_DIR_DOCS, log=self.add_log)
+            bases = self.bases.snapshot()
+            file_path = criar_copia_planilha(BASE_DIR_DOCS, "SIMULADOR_BALANÇA_LIMPO_2.xlsx", self.log_callback_completo)
 
             global df_base_familia
-            df_base_familia = df_base_familia_local
-
-            with pd.ExcelFile(file_path) as xl:
-                df_sku = xl.parse("dado_sku")
+            df_base_familia = bases.df_base_familia
 
+            df_sku = bases.catalogo
+            df_expedicao = bases.df_expedicao
 
-            df_expedicao = carregar_base_expedicao_csv(BASE_DIR_AUD, log=self.add_log)
-            df_sap = pd.read_excel(path_base_sap, sheet_name="Sheet1")
-            df_sobrepeso_real = pd.read_excel(path_base_sobrepeso, sheet_name="SOBREPESO")
-            df_sobrepeso_real["DataHora"] = pd.to_datetime(df_sobrepeso_real["DataHora"])
-
-            df_remessa = obter_dados_remessa(remessa, df_expedicao, log_callback=self.add_log)
+            df_remessa = obter_dados_remessa(remessa, df_expedicao, log_callback=self.log_callback_completo,
+                                             indice_remessas=bases.remessas)
             if df_remessa.empty:
-                disponiveis = sorted(df_expedicao["REMESSA"].dropna().unique().tolist())
+                disponiveis = bases.remessas.disponiveis()
                 self.log_callback_completo(f"❌ Remessa {remessa} não encontrada. Remessas disponíveis: {disponiveis[-10:]}")
                 messagebox.showwarning("Remessa não encontrada", f"A remessa {remessa} não foi localizada.")
                 return
 
             self.progress_bar.set(0.5)
 
-            resultado = calcular_peso_final(
+            resultado = calcular_peso_final_lote(
                 remessa, peso_vazio, qtd_paletes,
-                df_remessa, df_sku, df_sap, df_sobrepeso_real, df_base_fisica,
-                self.log_callback_completo,   
+                df_remessa, df_sku, bases.pallets, bases.sobrepeso, bases.df_base_fisica,
             )
 
             if not resultado:
@@ -1766,11 +3712,10 @@ class App(ctk.CTk):
                 return
 
             peso_base, sp_total, peso_com_sp, peso_final, media_sp, itens_detalhados = resultado
-            mask_qtd = _match_remessa_series(df_expedicao['REMESSA'], remessa)
             
             dados = {
                 'remessa': remessa,
-                'qtd_skus': df_expedicao.loc[mask_qtd, 'ITEM'].nunique(),
+                'qtd_skus': df_expedicao['ITEM'].iloc[bases.remessas.posicoes(remessa)].nunique(),
                 'placa': self.placa.get(),
                 'turno': self.turno.get(),
                 'peso_vazio': peso_vazio,
@@ -1785,12 +3730,12 @@ class App(ctk.CTk):
             df_fracao_vazio = pd.DataFrame(columns=['chave_pallete', 'qtd'])
 
             preencher_formulario_com_openpyxl(
-                file_path, dados, itens_detalhados, self.add_log, df_sku, df_remessa, df_fracao_vazio
+                file_path, dados, itens_detalhados, self.log_callback_completo, df_sku, df_remessa, df_fracao_vazio
             )
 
             self.progress_bar.set(0.7)
             self.log_callback_completo("Exportando PDF...")
-            pdf_path = exportar_pdf_com_comtypes(file_path, "FORMULARIO", nome_remessa=remessa, log_callback=self.add_log)
+            pdf_path = exportar_pdf_com_comtypes(file_path, "FORMULARIO", nome_remessa=remessa, log_callback=self.log_callback_completo)
             self.log_callback_completo(f"PDF exportado com sucesso: {pdf_path}")
 
             self.progress_bar.set(0.85)
@@ -1824,12 +3769,12 @@ class App(ctk.CTk):
                     pdf_path,
                     remessa,
                     log_callback=self.log_callback_completo,
-                    log_geral=self.log_text,   
+                    log_geral=self.log_geral,
                 )
 
                 self.log_callback_completo("Envio com sucesso para o e-mail de tratativa")
                 self.progress_bar.set(1)
-                self.add_log("✅ Processamento concluído com sucesso!")
+                self.log_callback_completo("✅ Processamento concluído com sucesso!")
             except:
                 self.log_callback_completo("Erro ao enviar para o e-mail de tratativa")
 
@@ -1852,6 +3797,44 @@ class App(ctk.CTk):
 
 
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulador de Sobrepeso. Sem argumentos abre a interface.")
+    parser.add_argument("--fila", nargs="+", metavar="REMESSA",
+                        help="remessas a pré-simular em lote (ex.: 8001234 8001240-8001250)")
+    parser.add_argument("--fila-arquivo", metavar="ARQUIVO", help="arquivo texto com as remessas da fila")
+    parser.add_argument("--peso-vazio", type=float, default=0.0, help="peso do veículo vazio somado ao estimado (kg)")
+    parser.add_argument("--saida", help="arquivo do resumo (.xlsx ou .csv); padrão: Downloads/fila_remessas_<data>.xlsx")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processos para simular a fila em paralelo (padrão: 1, sem paralelismo)")
+    parser.add_argument("--log-nivel", choices=["DEBUG", "INFO", "WARNING", "ERROR"], type=str.upper,
+                        help="detalhe do log do cálculo (padrão: SIMULADOR_LOG_NIVEL ou INFO)")
+    args = parser.parse_args(argv)
+    configurar_log(args.log_nivel)
+
+    if not (args.fila or args.fila_arquivo):
+        app = App()
+        app.mainloop()
+        return 0
+
+    texto = " ".join(args.fila or [])
+    if args.fila_arquivo:
+        with open(args.fila_arquivo, "r", encoding="utf-8-sig") as f:
+            texto += "\n" + f.read()
+    try:
+        remessas = interpretar_fila_remessas(texto)
+    except ValueError as e:
+        parser.error(str(e))
+    if not remessas:
+        parser.error("nenhuma remessa informada")
+
+    logging.basicConfig(format="%(message)s")
+    bases = BaseRegistry(BASE_DIR_DOCS, BASE_DIR_AUD, log=print).carregar()
+    resumo = simular_fila_remessas_paralelo(remessas, bases, args.workers, peso_vazio=args.peso_vazio, log=print)
+    salvar_resumo_fila(resumo, args.saida or caminho_resumo_fila_padrao(), log=print)
+    print(resumo.to_string(index=False))
+    return 0 if (resumo["Status"] == "ok").any() else 1
+
+
 if __name__ == "__main__":
-    app = App()
-    app.mainloop()
+    multiprocessing.freeze_support()
+    raise SystemExit(main())
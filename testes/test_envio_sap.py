@@ -0,0 +1,199 @@
+import contextlib
+import datetime
+import gzip
+import importlib.util
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import pandas as pd
+
+CAMINHO_ENVIO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "teste envio sap para api ec2.py")
+
+envio = None
+
+
+def setUpModule():
+    global envio
+    spec = importlib.util.spec_from_file_location("teste_envio_sap_api", CAMINHO_ENVIO)
+    modulo = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(modulo)
+    except ImportError as e:
+        raise unittest.SkipTest(f"dependência do envio ausente: {e}")
+    envio = modulo
+
+
+class _UploadSap(BaseHTTPRequestHandler):
+    """
+    upload_sap local: responde com os status de `sequencia`, na ordem; depois,
+    `falhar[chave]` ao bloco que contém a chave, senão 201.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        corpo = self.rfile.read(int(self.headers["Content-Length"]))
+        chaves = [r["chave_pallet"] for r in json.loads(gzip.decompress(corpo))]
+        servidor = self.server
+        with servidor.lock:
+            servidor.requisicoes.append(chaves)
+            if servidor.sequencia:
+                status = servidor.sequencia.pop(0)
+            else:
+                status = next((servidor.falhar[c] for c in chaves if c in servidor.falhar), 201)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps({"status": status}).encode("utf-8"))
+
+
+class EnvioSapTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", 0), _UploadSap)
+        self.servidor.lock = threading.Lock()
+        self.servidor.requisicoes = []
+        self.servidor.sequencia = []
+        self.servidor.falhar = {}
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.servidor.server_port}/balanca/api/upload_sap/"
+
+        self.pasta = tempfile.mkdtemp()
+        self.base_sap = os.path.join(self.pasta, "Downloads", "base_sap")
+        os.makedirs(self.base_sap)
+        self._userprofile = os.environ.get("USERPROFILE")
+        os.environ["USERPROFILE"] = self.pasta
+        self.manifesto = os.path.join(self.base_sap, envio.MANIFESTO_ARQUIVO)
+
+        n = 25
+        self.export = pd.DataFrame({
+            "Chave Pallet": [f"P{i:04d}" for i in range(n)],
+            "Doc.material": [4900000000 + i for i in range(n)],
+            "Ano doc.material": 2025,
+            "Item doc.material": 1,
+            "Lote": "A123",
+            "Data de entrada": pd.Timestamp("2025-01-02"),
+            "Data de criação": pd.Timestamp("2025-01-02"),
+            "Hora de criação": [datetime.time(7, 8, 9)] * n,
+        })
+        self._gravar_export()
+
+    def tearDown(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+        if self._userprofile is None:
+            os.environ.pop("USERPROFILE", None)
+        else:
+            os.environ["USERPROFILE"] = self._userprofile
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def _gravar_export(self):
+        # o pandas não reconhece a extensão maiúscula do export do SAP na escrita
+        tmp = os.path.join(self.base_sap, "export.xlsx")
+        self.export.to_excel(tmp, index=False)
+        os.replace(tmp, os.path.join(self.base_sap, "EXPORT.XLSX"))
+
+    def _enviar(self, **kwargs):
+        """Roda o envio e devolve as chaves recebidas pelo servidor, por requisição."""
+        self.servidor.requisicoes.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            envio.envio_sap_api(url=self.url, batch_size=10, paralelos=2, **kwargs)
+        return list(self.servidor.requisicoes)
+
+    def _chaves(self, requisicoes):
+        return sorted(c for chaves in requisicoes for c in chaves)
+
+    def _pallets(self, linhas):
+        return [f"P{i:04d}" for i in linhas]
+
+    def _chaves_naturais(self, linhas):
+        # chave do manifesto: "doc|ano|item"
+        return [f"{4900000000 + i}|2025|1" for i in linhas]
+
+
+class ManifestoTests(EnvioSapTestCase):
+
+    def test_linhas_inalteradas_nao_sao_reenviadas(self):
+        self.assertEqual(self._chaves(self._enviar()), self._pallets(range(25)))
+        self.assertEqual(self._enviar(), [])
+
+    def test_linhas_alteradas_sao_reenviadas(self):
+        self._enviar()
+        self.export.loc[[3, 17], "Lote"] = "B456"
+        self._gravar_export()
+        self.assertEqual(self._chaves(self._enviar()), self._pallets([3, 17]))
+        self.assertEqual(self._enviar(), [])
+
+    def test_bloco_com_falha_mantem_hash_antigo_e_volta_no_proximo_envio(self):
+        self._enviar()
+        hash_antigo = envio.ler_manifesto(self.manifesto)
+        self.export.loc[:14, "Lote"] = "B456"
+        self._gravar_export()
+
+        # blocos de 10 linhas: o segundo (linhas 10 a 14) é recusado
+        self.servidor.falhar = {"P0012": 400}
+        self._enviar()
+        manifesto = envio.ler_manifesto(self.manifesto)
+        falhadas, aceitas = self._chaves_naturais(range(10, 15)), self._chaves_naturais(range(10))
+        pd.testing.assert_series_equal(manifesto[falhadas], hash_antigo[falhadas])
+        self.assertTrue((manifesto[aceitas] != hash_antigo[aceitas]).all())
+
+        self.servidor.falhar = {}
+        self.assertEqual(self._chaves(self._enviar()), self._pallets(range(10, 15)))
+        self.assertEqual(self._enviar(), [])
+
+    def test_completo_ignora_manifesto(self):
+        self._enviar()
+        self.assertEqual(self._chaves(self._enviar(completo=True)), self._pallets(range(25)))
+
+
+class UploaderTests(EnvioSapTestCase):
+
+    def _postar(self, **kwargs):
+        with envio.requests.Session() as sessao:
+            return envio._postar_bloco(sessao, self.url, [{"chave_pallet": "P0001"}], espera_base=0, **kwargs)
+
+    def test_repete_em_503_e_429(self):
+        self.servidor.sequencia = [503, 429, 201]
+        self.assertEqual(self._postar().status_code, 201)
+        self.assertEqual(len(self.servidor.requisicoes), 3)
+
+    def test_desiste_apos_as_tentativas(self):
+        self.servidor.sequencia = [503] * 5
+        with self.assertRaises(RuntimeError):
+            self._postar(tentativas=3)
+        self.assertEqual(len(self.servidor.requisicoes), 3)
+
+    def test_nao_repete_em_400(self):
+        self.servidor.sequencia = [400, 201]
+        with self.assertRaisesRegex(RuntimeError, "HTTP 400"):
+            self._postar()
+        self.assertEqual(len(self.servidor.requisicoes), 1)
+
+    def test_execucao_interrompida_retoma_do_checkpoint(self):
+        checkpoint = self.manifesto + ".parcial"
+        self.servidor.falhar = {"P0012": 400}
+        # o processo cai depois de enviar os blocos e antes de gravar o manifesto
+        with mock.patch.object(envio, "gravar_manifesto", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self._enviar()
+        self.assertTrue(os.path.exists(checkpoint))
+        self.assertFalse(os.path.exists(self.manifesto))
+
+        # só o bloco recusado volta; os aceitos estão no checkpoint
+        self.servidor.falhar = {}
+        self.assertEqual(self._chaves(self._enviar()), self._pallets(range(10, 20)))
+        self.assertFalse(os.path.exists(checkpoint))
+        self.assertEqual(self._enviar(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
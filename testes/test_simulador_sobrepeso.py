@@ -0,0 +1,282 @@
+import contextlib
+import importlib.util
+import io
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+import numpy as np
+import pandas as pd
+
+CAMINHO_SIMULADOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "simuladorsobrepeso_final_4.0.py")
+
+CABECALHO = ("ID;LOCAL_EXPEDICAO;REMESSA;COD_ITEM;DESC_ITEM;LOTE;"
+             "CASEWHENA.EXCLUIDO_POR_LOGINISNULLTHENA.VOLUMEELSE-1*A.VOLUMEEND;UOM;DATA_VALIDADE;"
+             "COD_RASTREABILIDADE;TIPO_RASTREABILIDADE;CREATED_AT;CRIADO_POR_LOGIN;ATUALIZADO_POR_LOGIN;"
+             "UPDATED_AT;DELETED_AT;EXCLUIDO_POR_LOGIN")
+
+_pasta_usuario = None
+simulador = None
+
+
+def linha_csv(id_, remessa, item, chave, volume, excluida=False):
+    exclusao = "01/01/2025;usuario" if excluida else ";"
+    return (f"{id_};CD01;{remessa};{item};PRODUTO {item};L1;{volume:.1f};CX;31/12/2025;{chave};PALETE;"
+            f"01/01/2025;usuario;;;{exclusao}")
+
+
+def setUpModule():
+    global _pasta_usuario, simulador
+    _pasta_usuario = tempfile.mkdtemp()
+    raiz = os.path.join(_pasta_usuario, "OneDrive - M DIAS BRANCO")
+    os.makedirs(os.path.join(raiz, "Gestão de Estoque - Documentos"))
+    os.makedirs(os.path.join(raiz, "Gestão de Estoque - Gestão_Auditoria"))
+    os.environ["USERPROFILE"] = _pasta_usuario
+    os.environ["LOCALAPPDATA"] = os.path.join(_pasta_usuario, "AppData")
+
+    spec = importlib.util.spec_from_file_location("simuladorsobrepeso_final_4", CAMINHO_SIMULADOR)
+    modulo = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(modulo)
+    except ImportError as e:
+        raise unittest.SkipTest(f"dependência do simulador ausente: {e}")
+    simulador = modulo
+
+
+def tearDownModule():
+    if _pasta_usuario:
+        shutil.rmtree(_pasta_usuario, ignore_errors=True)
+
+
+class CarregamentoIncrementalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp(dir=_pasta_usuario)
+        self.csv = os.path.join(self.pasta, "rastreabilidade.csv")
+        linhas = [linha_csv(i, 8000000 + i % 7, 1000 + i % 5, f"PAL{i:07d}", 10.0 + i) for i in range(1, 41)]
+        # ID repetido dentro da própria leitura inicial
+        linhas.append(linha_csv(3, 8000003, 1003, "PAL0000003", 99.0))
+        self._escrever("w", [CABECALHO] + linhas)
+        simulador._ESTADO_EXPEDICAO_INCREMENTAL.clear()
+
+    def tearDown(self):
+        simulador._ESTADO_EXPEDICAO_INCREMENTAL.clear()
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def _escrever(self, modo, linhas):
+        with open(self.csv, modo, encoding="utf-8", newline="") as f:
+            f.write("\r\n".join(linhas) + "\r\n")
+
+    def _incremental(self):
+        return simulador._carregar_expedicao_incremental(self.csv, log=lambda *_: None)
+
+    def _completa(self):
+        return simulador._montar_base_expedicao(self.csv, log=lambda *_: None)
+
+    def test_leitura_inicial_igual_a_completa(self):
+        pd.testing.assert_frame_equal(self._incremental(), self._completa())
+
+    def test_cauda_anexada_igual_a_leitura_completa(self):
+        self._incremental()
+        self._escrever("a", [
+            linha_csv(41, 8000009, 1009, "PAL0000041", 5.0),
+            # retratação de um ID já ingerido, com item novo e repetida na própria cauda
+            linha_csv(5, 8000005, 1010, "PAL0000005", -15.0, excluida=True),
+            linha_csv(42, 8000001, 1001, "PAL0000042", 6.0),
+            linha_csv(5, 8000005, 1010, "PAL0000005", -15.0, excluida=True),
+        ])
+        anexada = self._incremental()
+        completa = self._completa()
+        pd.testing.assert_frame_equal(anexada, completa)
+        self.assertEqual(completa["ID"].tolist().count("5"), 1)
+        self.assertEqual(completa.loc[completa["ID"] == "5", "QUANTIDADE"].item(), -15.0)
+
+        # outro processo: estado lido das partes em disco, mais uma cauda
+        simulador._ESTADO_EXPEDICAO_INCREMENTAL.clear()
+        self._escrever("a", [linha_csv(42, 8000001, 1001, "PAL0000042", -6.0, excluida=True),
+                             linha_csv(43, 8000011, 1011, "PAL0000043", 7.0)])
+        pd.testing.assert_frame_equal(self._incremental(), self._completa())
+
+        simulador._ESTADO_EXPEDICAO_INCREMENTAL.clear()
+        pd.testing.assert_frame_equal(self._incremental(), self._completa())
+
+    def test_arquivo_reescrito_volta_a_leitura_completa(self):
+        self._incremental()
+        self._escrever("w", [CABECALHO, linha_csv(1, 8100000, 2000, "PAL9000001", 1.0)])
+        pd.testing.assert_frame_equal(self._incremental(), self._completa())
+
+
+class EdicoesStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp(dir=_pasta_usuario)
+        self.xlsx = os.path.join(self.pasta, simulador.EdicoesStore.NOME_XLSX)
+        self.logs = []
+
+    def tearDown(self):
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def _remessa(self, remessa, chave):
+        return pd.DataFrame([{"REMESSA": remessa, "ITEM": "1001", "QUANTIDADE": 10.0,
+                              "CHAVE_PALETE": chave, "COD_RASTREABILIDADE": chave, "ID": "1"}])
+
+    def test_importacao_falha_nao_marca_nem_regrava_planilha(self):
+        with open(self.xlsx, "wb") as f:
+            f.write(b"planilha corrompida")
+        store = simulador.EdicoesStore(self.pasta)
+
+        with self.assertRaises(RuntimeError):
+            store.salvar(self._remessa("8000001", "PAL1"), "8000001", self.logs.append)
+        with self.assertRaises(RuntimeError):
+            store.exportar()
+        self.assertFalse(store._inicializado)
+        with open(self.xlsx, "rb") as f:
+            self.assertEqual(f.read(), b"planilha corrompida")
+
+        # na conexão seguinte a importação é tentada de novo
+        self._remessa("0008000002", "PAL2").to_excel(self.xlsx, sheet_name="dado_exp", index=False)
+        store.exportar_xlsx = False
+        store.salvar(self._remessa("8000001", "PAL1"), "8000001", self.logs.append)
+        self.assertTrue(store._inicializado)
+        self.assertEqual(sorted(store.todos()["CHAVE_PALETE"]), ["PAL1", "PAL2"])
+        self.assertEqual(store.remessa("8000002")["CHAVE_PALETE"].tolist(), ["PAL2"])
+
+    def _estacao(self, nome):
+        # cada estação tem a sua cópia local; a planilha é a mesma
+        return simulador.EdicoesStore(self.pasta, exportar_xlsx=False,
+                                      pasta_local=os.path.join(self.pasta, "local", nome))
+
+    def test_estacoes_trocam_remessas_pela_planilha(self):
+        a, b = self._estacao("a"), self._estacao("b")
+        self.assertNotEqual(a.caminho_db, b.caminho_db)
+        # por padrão a cópia local fica fora da pasta sincronizada
+        self.assertTrue(simulador.EdicoesStore(self.pasta).caminho_db.startswith(simulador.CACHE_DIR))
+
+        a.salvar(self._remessa("8000001", "PAL1"), "8000001", self.logs.append)
+        b.salvar(self._remessa("8000002", "PAL2"), "8000002", self.logs.append)
+        a.exportar()
+        b.exportar()
+        a.exportar()
+
+        planilha = pd.read_excel(self.xlsx, sheet_name="dado_exp")
+        self.assertEqual(sorted(planilha["CHAVE_PALETE"]), ["PAL1", "PAL2"])
+        for store in (a, b):
+            self.assertEqual(sorted(store.todos()["CHAVE_PALETE"]), ["PAL1", "PAL2"])
+
+        # remessa removida em B some de A depois da exportação
+        b.remover("8000001", self.logs.append)
+        b.exportar()
+        self.assertEqual(a.todos()["CHAVE_PALETE"].tolist(), ["PAL2"])
+
+    def test_alteracao_sobre_remessa_atualizada_por_outra_estacao(self):
+        a, b = self._estacao("a"), self._estacao("b")
+        a.salvar(self._remessa("8000001", "PAL1"), "8000001", self.logs.append)
+        a.exportar()
+        aberta = b.remessa("8000001")
+
+        a.salvar(self._remessa("8000001", "PAL9"), "8000001", self.logs.append)
+        a.exportar()
+
+        alteracoes = simulador.AlteracoesRemessa(simulador.COLUNAS_EDICOES)
+        alteracoes.alterar(aberta.index[0], "QUANTIDADE", 5.0)
+        with self.assertRaises(RuntimeError):
+            b.aplicar("8000001", alteracoes, self.logs.append)
+        self.assertEqual(b.remessa("8000001")["CHAVE_PALETE"].tolist(), ["PAL9"])
+
+
+class _Entrada:
+
+    def __init__(self, texto):
+        self.texto = texto
+
+    def get(self):
+        return self.texto
+
+
+class EdicaoCelulaTests(unittest.TestCase):
+
+    def setUp(self):
+        frame = simulador.EdicaoRemessaFrame
+        self.totais = []
+        self.frame = types.SimpleNamespace(
+            COLUNAS_DADOS=frame.COLUNAS_DADOS,
+            dados_remessa=pd.DataFrame({"ITEM": ["1001"], "QUANTIDADE": [10.0], "CHAVE_PALETE": [None], "ID": ["1"]},
+                                       index=[7]),
+            alteracoes=simulador.AlteracoesRemessa(frame.COLUNAS_DADOS),
+            _sku_texto=frame._sku_texto,
+            _aplicar_delta_totais=lambda *args: self.totais.append(args),
+        )
+
+    def _editar(self, coluna, sku="1001", qtd="10", chave=""):
+        linha = types.SimpleNamespace(pos=0, sku=_Entrada(sku), qtd=_Entrada(qtd), chave=_Entrada(chave))
+        simulador.EdicaoRemessaFrame._editar_celula(self.frame, linha, coluna)
+
+    def test_tecla_sem_mudanca_nao_registra_alteracao(self):
+        # Tab, setas e Shift disparam <KeyRelease> com o mesmo texto
+        for coluna in ("ITEM", "QUANTIDADE", "CHAVE_PALETE"):
+            self._editar(coluna, sku=" 1001 ", qtd="10.0")
+        self.assertFalse(self.frame.alteracoes)
+        self.assertEqual(self.totais, [])
+
+    def test_valor_diferente_registra_alteracao(self):
+        self._editar("QUANTIDADE", qtd="12")
+        self._editar("CHAVE_PALETE", chave="PAL1")
+        self.assertEqual(len(self.frame.alteracoes), 1)
+        self.assertEqual(self.frame.alteracoes.alteradas["QUANTIDADE"], {7: 12.0})
+        self.assertEqual(self.frame.alteracoes.alteradas["CHAVE_PALETE"], {7: "PAL1"})
+        self.assertEqual(len(self.totais), 1)
+
+
+class FilaRemessasTests(unittest.TestCase):
+
+    def test_interpreta_lista_e_intervalos(self):
+        self.assertEqual(simulador.interpretar_fila_remessas("8001234, 8001240-8001242;8001234.0\n8001241"),
+                         [8001234, 8001240, 8001241, 8001242])
+
+    def test_intervalo_grande_demais(self):
+        with self.assertRaises(ValueError):
+            simulador.interpretar_fila_remessas("1-99999999")
+
+    def test_token_invalido_encerra_com_erro(self):
+        for argumento in ("80012x4", "1-99999999"):
+            with self.subTest(argumento=argumento), contextlib.redirect_stderr(io.StringIO()) as erro:
+                with self.assertRaises(SystemExit) as saida:
+                    simulador.main(["--fila", "8001234", argumento])
+            self.assertEqual(saida.exception.code, 2)
+            self.assertIn(argumento, erro.getvalue())
+
+
+class IndicesFilaParalelaTests(unittest.TestCase):
+
+    def test_sobrepeso_lido_do_feather_da_as_mesmas_medias(self):
+        datahora = pd.date_range("2025-01-01 06:00", periods=48, freq="h")
+        df = pd.DataFrame({"DataHora": datahora, "L001": [float(i % 7) for i in range(48)],
+                           "LB06/07": [None if i % 5 == 0 else i / 10 for i in range(48)]})
+        original = simulador.SobrepesoIndex(df)
+        pasta = tempfile.mkdtemp(dir=_pasta_usuario)
+        self.addCleanup(shutil.rmtree, pasta, True)
+        original.gravar_feather(os.path.join(pasta, "sobrepeso"))
+        lido = simulador.SobrepesoIndex.ler_feather(os.path.join(pasta, "sobrepeso"))
+
+        linhas = ["L001", "LB06/07", "L999", "L001"]
+        ini = [datahora[2], datahora[10], datahora[0], pd.NaT]
+        fim = [datahora[20], datahora[47], datahora[5], datahora[3]]
+        np.testing.assert_array_equal(lido.medias(linhas, ini, fim), original.medias(linhas, ini, fim))
+        self.assertEqual((lido.dt_min, lido.dt_max), (original.dt_min, original.dt_max))
+        self.assertTrue(lido.tem_datahora)
+
+    def test_recorte_do_pallet_index(self):
+        df_sap = pd.DataFrame({"Chave Pallet": ["P 1", "P2", "P1", "P3"], "Lote": ["A001", "B002", "C003", "D004"],
+                               "Data de produção": ["01/01/2025"] * 4, "Outra": [1, 2, 3, 4]})
+        indice = simulador.PalletIndex(df_sap)
+        recorte = indice.recorte(["P1", "P3", "P9"])
+        self.assertEqual(len(recorte), 2)
+        self.assertNotIn("P2", recorte)
+        self.assertEqual(recorte.localizar("P1"), indice.localizar("P1"))
+        self.assertEqual(recorte.localizar("P3"), indice.localizar("P3"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,9 +3,118 @@ import requests
 import datetime
 import certifi
 import os
+import argparse
+import gzip
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
-def envio_sap_api():
+# Chave natural do documento no SAP; é a mesma usada no upsert do upload_sap
+CHAVE_NATURAL = ["doc_material", "ano_doc_material", "item_doc_material"]
+MANIFESTO_ARQUIVO = "manifesto_envio_sap.csv"
+URL_PADRAO = os.getenv("SAP_API_URL", "https://simuladorsobrepesovitarella.com/balanca/api/upload_sap/")
+
+
+def hashes_linhas(df):
+    """Chave natural ("doc|ano|item") e hash do conteúdo de cada linha, como texto."""
+    chaves = df[CHAVE_NATURAL[0]].astype(str)
+    for col in CHAVE_NATURAL[1:]:
+        chaves = chaves + "|" + df[col].astype(str)
+    hashes = pd.util.hash_pandas_object(df, index=False).astype(str)
+    return chaves, hashes
+
+
+def ler_manifesto(caminho):
+    """Hash enviado por chave no último envio bem-sucedido (Series chave -> hash)."""
+    if not os.path.exists(caminho):
+        return pd.Series(dtype=str)
+    manifesto = pd.read_csv(caminho, dtype=str)
+    return pd.Series(manifesto["hash"].values, index=manifesto["chave"].values)
+
+
+def gravar_manifesto(caminho, manifesto):
+    """Grava o manifesto (a última ocorrência de cada chave vale) de forma atômica."""
+    manifesto = manifesto[~manifesto.index.duplicated(keep="last")]
+    tmp = caminho + ".tmp"
+    pd.DataFrame({"chave": manifesto.index, "hash": manifesto.values}).to_csv(tmp, index=False)
+    os.replace(tmp, caminho)
+
+
+def ler_checkpoint(caminho):
+    """Chaves/hashes dos blocos já aceitos numa execução que não chegou ao fim."""
+    if not os.path.exists(caminho) or os.path.getsize(caminho) == 0:
+        return pd.Series(dtype=str)
+    # a última linha pode ter ficado pela metade se o processo caiu durante a escrita
+    checkpoint = pd.read_csv(caminho, dtype=str, on_bad_lines="skip").dropna()
+    return pd.Series(checkpoint["hash"].values, index=checkpoint["chave"].values)
+
+
+def _postar_bloco(sessao, url, bloco, tentativas=5, espera_base=2.0, timeout=60):
+    """
+    Envia um bloco como JSON com gzip, repetindo com espera exponencial em
+    falhas de rede, HTTP 429 e 5xx. Devolve a resposta ou levanta RuntimeError.
+    """
+    corpo = gzip.compress(json.dumps(bloco).encode("utf-8"))
+    headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    for tentativa in range(1, tentativas + 1):
+        try:
+            response = sessao.post(url, data=corpo, headers=headers, verify=False, timeout=timeout)
+        except requests.RequestException as e:
+            erro = str(e)
+        else:
+            if response.status_code in [200, 201]:
+                return response
+            erro = f"HTTP {response.status_code}: {response.text[:300]}"
+            if response.status_code < 500 and response.status_code != 429:
+                break  # erro do próprio bloco; repetir não resolve
+        if tentativa < tentativas:
+            espera = espera_base * 2 ** (tentativa - 1)
+            time.sleep(espera + random.uniform(0, espera / 2))
+    raise RuntimeError(erro)
+
+
+def enviar_blocos(json_data, chaves, hashes, url, checkpoint_path, batch_size=10000, paralelos=4):
+    """
+    Envia os registros em blocos de batch_size, com até `paralelos` requisições
+    em andamento numa mesma Session. Cada bloco aceito tem suas chaves/hashes
+    acrescentados ao checkpoint na hora, para que uma execução interrompida
+    continue de onde parou. Devolve o número de blocos que falharam.
+    """
+    falhas = 0
+    with requests.Session() as sessao, ThreadPoolExecutor(max_workers=paralelos) as executor:
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=paralelos)
+        sessao.mount("https://", adaptador)
+        sessao.mount("http://", adaptador)
+        futuros = {
+            executor.submit(_postar_bloco, sessao, url, json_data[i:i+batch_size]): i
+            for i in range(0, len(json_data), batch_size)
+        }
+        with open(checkpoint_path, "a", newline="", encoding="utf-8") as checkpoint:
+            for futuro in tqdm(as_completed(futuros), total=len(futuros), desc="Enviando blocos"):
+                i = futuros[futuro]
+                try:
+                    futuro.result()
+                except Exception as e:
+                    falhas += 1
+                    tqdm.write(f"❌ Erro ao enviar bloco {i//batch_size + 1}: {str(e)}")
+                    continue
+                tqdm.write(f"✅ Bloco {i//batch_size + 1} enviado com sucesso.")
+                pd.DataFrame({"chave": chaves.iloc[i:i+batch_size].values,
+                              "hash": hashes.iloc[i:i+batch_size].values}).to_csv(
+                    checkpoint, header=checkpoint.tell() == 0, index=False)
+                checkpoint.flush()
+    return falhas
+
+
+def envio_sap_api(completo=False, url=URL_PADRAO, batch_size=10000, paralelos=4):
+    """
+    Envia para a API os registros do EXPORT.XLSX que mudaram desde o último
+    envio, segundo o manifesto de hashes salvo ao lado do arquivo. Com
+    completo=True (ou --completo na linha de comando) envia tudo de novo.
+    """
     download_dir = os.path.join(os.environ['USERPROFILE'], 'Downloads', 'base_sap')
     arquivo_excel = os.path.join(download_dir, 'EXPORT.XLSX')
 
@@ -48,18 +157,42 @@ def envio_sap_api():
     print("📊 Registros restantes após filtro:", len(df))
 
     # Converte datas e horas
-    for col in df.columns:
-        df[col] = df[col].apply(lambda x:
-            x.strftime("%Y-%m-%d") if isinstance(x, (pd.Timestamp, datetime.datetime)) and not pd.isna(x)
-            else x.strftime("%H:%M:%S") if isinstance(x, datetime.time) and not pd.isna(x)
-            else x
-        )
+    for col in df.select_dtypes(include=['datetime64[ns]', 'datetimetz']).columns:
+        df[col] = df[col].dt.strftime("%Y-%m-%d")
+    for col in df.select_dtypes(include='object').columns:
+        preenchidos = df[col].notna()
+        amostra = df.loc[preenchidos, col]
+        if not amostra.empty and isinstance(amostra.iloc[0], datetime.time):
+            df.loc[preenchidos, col] = amostra.astype(str).str[:8]
 
     print("📌 Preview de datas:")
     print(df[["data_criacao", "data_entrada", "hora_criacao"]].head())
 
+    # Só vai para a API o que é novo ou mudou desde o último envio bem-sucedido
+    manifesto_path = os.path.join(download_dir, MANIFESTO_ARQUIVO)
+    checkpoint_path = manifesto_path + ".parcial"
+    chaves, hashes = hashes_linhas(df)
+    if completo:
+        manifesto = pd.Series(dtype=str)
+        enviar = pd.Series(True, index=df.index)
+    else:
+        # inclui o checkpoint de uma execução interrompida: o que já subiu não é reenviado
+        manifesto = pd.concat([ler_manifesto(manifesto_path), ler_checkpoint(checkpoint_path)])
+        enviados = pd.Series(manifesto.index, dtype=str) + ":" + pd.Series(manifesto.values, dtype=str)
+        enviar = ~(chaves + ":" + hashes).isin(enviados)
+    print(f"📊 {int(enviar.sum())} de {len(df)} registros novos ou alterados desde o último envio")
+
+    df = df[enviar]
+    chaves, hashes = chaves[enviar], hashes[enviar]
+    if df.empty:
+        print("✅ Nada a enviar.")
+        if os.path.exists(checkpoint_path):
+            gravar_manifesto(manifesto_path, manifesto)
+            os.remove(checkpoint_path)
+        return
+
     # Substitui NaN por None para o JSON
-    df = df.where(pd.notnull(df), None)
+    df = df.astype(object).where(pd.notnull(df), None)
 
     json_data = df.to_dict(orient='records')
 
@@ -70,31 +203,22 @@ def envio_sap_api():
         if not row["chave_pallet"]:
             print(f"❌ Linha {i} com chave_pallet vazia detectada:", row)
 
-    url = "https://simuladorsobrepesovitarella.com/balanca/api/upload_sap/"
-    headers = {"Content-Type": "application/json"}
-    batch_size = 10000
-    print(f"🚀 Enviando {len(json_data)} registros em blocos de {batch_size}...")
-
-    for i in tqdm(range(0, len(json_data), batch_size), desc="Enviando blocos"):
-        bloco = json_data[i:i+batch_size]
+    print(f"🚀 Enviando {len(json_data)} registros em blocos de {batch_size} ({paralelos} em paralelo)...")
+    falhas = enviar_blocos(json_data, chaves, hashes, url, checkpoint_path,
+                           batch_size=batch_size, paralelos=paralelos)
 
-        try:
-            response = requests.post(
-                url,
-                json=bloco,
-                headers=headers,
-                verify=False,
-                timeout=60
-            )
-
-            if response.status_code in [200, 201]:
-                tqdm.write(f"✅ Bloco {i//batch_size + 1} enviado com sucesso.")
-            else:
-                tqdm.write(f"⚠️ Bloco {i//batch_size + 1} retornou erro {response.status_code}")
-                print("Resposta resumida:", response.text[:300])
+    # Blocos com erro ficam com o hash antigo (ou sem hash) e voltam no próximo envio
+    gravar_manifesto(manifesto_path, pd.concat([manifesto, ler_checkpoint(checkpoint_path)]))
+    os.remove(checkpoint_path)
+    if falhas:
+        print(f"⚠️ {falhas} bloco(s) não foram enviados; serão reenviados na próxima execução.")
 
-        except Exception as e:
-            tqdm.write(f"❌ Erro ao enviar bloco {i//batch_size + 1}: {str(e)}")
 
 if __name__ == "__main__":
-    envio_sap_api()
+    parser = argparse.ArgumentParser(description="Envia o EXPORT.XLSX do SAP para a API do simulador.")
+    parser.add_argument("--completo", action="store_true", help="ignora o manifesto e envia todos os registros")
+    parser.add_argument("--url", default=URL_PADRAO, help="endpoint upload_sap (padrão: SAP_API_URL ou produção)")
+    parser.add_argument("--bloco", type=int, default=10000, help="registros por requisição")
+    parser.add_argument("--paralelos", type=int, default=4, help="requisições simultâneas")
+    args = parser.parse_args()
+    envio_sap_api(completo=args.completo, url=args.url, batch_size=args.bloco, paralelos=args.paralelos)